@@ -0,0 +1,606 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import subprocess
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import speech_recognition as sr
+
+from models.base import set_openai_clients
+from models.menu_encoding import DEFAULT_MENU_ENCODING, MenuEncoding
+from models.menu_index import MenuEntry
+from models.ordering import (
+    Item,
+    Menu,
+    Order,
+    OrderDelta,
+    OrderOperation,
+    SalesAgent,
+    logger,
+)
+from utils.api_replay import ApiRecording, AsyncReplayOpenAI, LatencyModel, ReplayOpenAI
+from utils.api_scheduler import (
+    CHAT_COMPLETIONS,
+    SPEECH,
+    ApiScheduler,
+    api_scheduler_metrics,
+    set_api_scheduler,
+)
+from utils.audio import PCM_CHANNELS, PCM_SAMPLE_RATE, PCM_SAMPLE_WIDTH, NullAudioSink, set_audio_sink
+from utils.stt import DEFAULT_STT_BACKEND, STT_BACKENDS, get_speech_to_text
+from utils.tts_cache import SpeechCache, set_speech_cache
+
+TEST_MENU_DIR = "tests/test_menus"
+DEFAULT_OUTPUT = "benchmark_results.json"
+DEFAULT_RUNS = 3
+# Median time to first token or byte around 0.4s with a long tail
+DEFAULT_API_LATENCY = "lognormal:-0.9,0.35"
+DEFAULT_CHUNK_LATENCY = "uniform:0.005,0.02"
+
+PCM_BYTES_PER_SECOND = PCM_SAMPLE_RATE * PCM_SAMPLE_WIDTH * PCM_CHANNELS
+PERCENTILES = (50, 95, 99)
+TURN_METRICS = (
+    "first_audio",
+    "first_reply_audio",
+    "turn",
+    "stt",
+    "llm",
+    "parse",
+    "audio_queue",
+    "tts",
+    "playback",
+)
+
+_speaking_filler: ContextVar[bool] = ContextVar("speaking_filler", default=False)
+
+
+@dataclass
+class AudioTiming:
+    filler: bool
+    queued: float
+    # When the speaker asked for audio, and when it got the first chunk
+    pulled: float = None
+    first_chunk: float = None
+    finished: float = None
+
+
+@dataclass
+class TurnTiming:
+    """One customer turn, from the end of their utterance until the agent is
+    listening again. Stage durations overlap, they don't add up to the turn."""
+
+    started: float
+    ended: float = None
+    stt: float = 0.0
+    llm: float = 0.0
+    parse: float = 0.0
+    audio: List[AudioTiming] = field(default_factory=list)
+
+    def metrics(self) -> Dict[str, float]:
+        metrics = {
+            "turn": self.ended - self.started,
+            "stt": self.stt,
+            "llm": self.llm,
+            "parse": self.parse,
+        }
+
+        heard = [a for a in self.audio if a.first_chunk is not None]
+        if heard:
+            metrics["first_audio"] = min(a.first_chunk for a in heard) - self.started
+
+        replies = [a for a in heard if not a.filler]
+        if replies:
+            reply = replies[0]
+            metrics["first_reply_audio"] = reply.first_chunk - self.started
+            metrics["audio_queue"] = reply.pulled - reply.queued
+            metrics["tts"] = reply.first_chunk - reply.pulled
+            metrics["playback"] = sum(
+                (a.finished or a.first_chunk) - a.first_chunk for a in replies
+            )
+        return metrics
+
+
+class TurnTimer:
+    def __init__(self):
+        self.turns: List[TurnTiming] = []
+        self.current: Optional[TurnTiming] = None
+
+    def start_turn(self, started: float, stt: float = 0.0):
+        self.end_turn()
+        self.current = TurnTiming(started=started, stt=stt)
+
+    def end_turn(self):
+        if self.current is not None:
+            self.current.ended = time.perf_counter()
+            self.turns.append(self.current)
+            self.current = None
+
+    @contextmanager
+    def stage(self, name: str):
+        turn = self.current
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            if turn is not None:
+                setattr(turn, name, getattr(turn, name) + time.perf_counter() - started)
+
+    def audio_queued(self) -> Optional[AudioTiming]:
+        if self.current is None:
+            return None
+        timing = AudioTiming(filler=_speaking_filler.get(), queued=time.perf_counter())
+        self.current.audio.append(timing)
+        return timing
+
+
+class BenchmarkAudioSink(NullAudioSink):
+    """Plays into nothing at a multiple of real time, timing every utterance
+    spoken during the current turn."""
+
+    def __init__(self, speed: float = 1.0):
+        self.speed = speed
+        self.timer: Optional[TurnTimer] = None
+        super().__init__()
+
+    def play(self, chunks: Iterable[bytes], blocking=True):
+        timing = self.timer.audio_queued() if self.timer else None
+        if timing is not None:
+            chunks = _timed_chunks(chunks, timing)
+        return super().play(chunks, blocking=blocking)
+
+    def write(self, chunk: bytes):
+        if self.speed:
+            time.sleep(len(chunk) / PCM_BYTES_PER_SECOND / self.speed)
+
+
+def _timed_chunks(chunks: Iterable[bytes], timing: AudioTiming):
+    timing.pulled = time.perf_counter()
+    for chunk in chunks:
+        if timing.first_chunk is None:
+            timing.first_chunk = time.perf_counter()
+        yield chunk
+    timing.finished = time.perf_counter()
+
+
+@dataclass
+class BenchmarkAgent(SalesAgent):
+    """A SalesAgent fed a scripted conversation, timing each stage of every
+    turn. Customer text can be paired with canned audio so speech to text is
+    timed too, while the transcript used stays the scripted one."""
+
+    inputs: List[str] = field(kw_only=True, default_factory=list)
+    timer: TurnTimer = field(kw_only=True, default_factory=TurnTimer)
+    stt_audio: sr.AudioData = field(kw_only=True, default=None)
+    use_speech_input: bool = False
+
+    def __post_init__(self, *args, **kwargs):
+        super().__post_init__(*args, **kwargs)
+        self.use_ui_spinners = False
+        if self.stt_audio is not None:
+            self.speech_to_text = get_speech_to_text(self.stt_backend)
+
+    async def adjust_for_ambient_noise_task(self):
+        pass
+
+    async def waiting_for_api_response_task(self):
+        _speaking_filler.set(True)
+        await super().waiting_for_api_response_task()
+
+    async def get_func_completion_res_async(self, *args, **kwargs):
+        with self.timer.stage("llm"):
+            return await super().get_func_completion_res_async(*args, **kwargs)
+
+    def parse_order(self, response) -> Order:
+        with self.timer.stage("parse"):
+            return super().parse_order(response)
+
+    async def communicate(
+        self,
+        msg: str = "",
+        get_response=False,
+        display_summary: str = "",
+        speech_summary: str = "",
+        add_to_message_history=True,
+        with_ui_spinner=True,
+        speech_blocking=True,
+    ) -> str | None:
+        if msg:
+            if msg in self.prefetched_speech:
+                await self.say(
+                    msg, blocking=True if speech_summary else speech_blocking
+                )
+                if speech_summary:
+                    await self.say(speech_summary, blocking=speech_blocking)
+            else:
+                await self.say(msg + speech_summary, blocking=speech_blocking)
+
+        if msg and add_to_message_history:
+            self.add_agent_message(msg)
+
+        if get_response:
+            return await self.next_input()
+
+    async def next_input(self) -> str:
+        self.timer.end_turn()
+        if not self.inputs:
+            raise RuntimeError("The scripted conversation ran out of customer turns")
+        text = self.inputs.pop(0)
+
+        # The customer has just stopped talking
+        started = time.perf_counter()
+        stt = 0.0
+        if self.stt_audio is not None:
+            transcript = await asyncio.to_thread(
+                self.speech_to_text.transcribe, self.stt_audio
+            )
+            stt = time.perf_counter() - started
+            logger.debug(f"Canned audio recognized as: {transcript.text}")
+
+        self.timer.start_turn(started, stt=stt)
+        self.next_turn()
+        return text
+
+
+@dataclass
+class ScriptedConversation:
+    name: str
+    inputs: List[str]
+    # Function called and the arguments the stand-in API answers with, in order
+    replies: List[Tuple[str, Dict]]
+
+
+def _order_reply(
+    human_response: str,
+    operations: List[Dict] = (),
+    unrecognized: List[Dict] = (),
+    completed=True,
+    finalized=False,
+) -> Dict:
+    return {
+        OrderDelta.HUMAN_RESPONSE: human_response,
+        OrderDelta.OPERATIONS: list(operations),
+        OrderDelta.UNRECOGNIZED_ITEMS: list(unrecognized),
+        OrderDelta.IS_COMPLETED: completed,
+        OrderDelta.IS_FINALIZED: finalized,
+    }
+
+
+def _item(name: str, quantity: int = 1) -> Dict:
+    return {Item.NAME: name, Item.QAUNTITY: quantity, Item.DETAILS: []}
+
+
+def _add(name: str, quantity: int = 1) -> Dict:
+    return {
+        OrderOperation.OP: OrderOperation.ADD,
+        OrderOperation.NAME: name,
+        OrderOperation.QUANTITY: quantity,
+    }
+
+
+def scripted_conversations(menu: Menu) -> List[ScriptedConversation]:
+    """Conversations built from the menu's own items, so every menu can be
+    benchmarked without recordings made against it."""
+    entries: List[MenuEntry] = [
+        e for e in menu.index if e.price is not None and not menu.index.is_ambiguous(e.name)
+    ]
+    first, second, third = (menu.index.display_name(e) for e in entries[:3])
+
+    direct = ScriptedConversation(
+        name="direct",
+        inputs=[f"Can I get a {first} and two {second}", "Yes, that's everything"],
+        replies=[
+            (
+                "process_user_order",
+                _order_reply(
+                    f"One {first} and two {second}, coming right up! Anything else?",
+                    [_add(first), _add(second, 2)],
+                ),
+            ),
+            (
+                "finalize_user_order",
+                _order_reply("Perfect, your order is in!", finalized=True),
+            ),
+        ],
+    )
+    clarify = ScriptedConversation(
+        name="clarify",
+        inputs=[
+            f"I'd like a {first} and the mystery special",
+            f"Oh, make that a {third} instead",
+            "Yes please",
+        ],
+        replies=[
+            (
+                "process_user_order",
+                _order_reply(
+                    f"I've got your {first}, but what's the mystery special?",
+                    [_add(first)],
+                    unrecognized=[_item("Mystery Special")],
+                    completed=False,
+                ),
+            ),
+            (
+                "clarify_user_order",
+                _order_reply(
+                    f"A {first} and a {third}, does that complete your order?",
+                    [_add(third)],
+                ),
+            ),
+            (
+                "finalize_user_order",
+                _order_reply("Great, your order is in!", finalized=True),
+            ),
+        ],
+    )
+    return [direct, clarify]
+
+
+def _replay_recording(conversation: ScriptedConversation) -> ApiRecording:
+    entries = []
+    for i, (fn_name, arguments) in enumerate(conversation.replies):
+        entries.append(
+            {
+                "endpoint": CHAT_COMPLETIONS,
+                "route": fn_name,
+                "response": {
+                    "id": f"chatcmpl-benchmark{i}",
+                    "object": "chat.completion",
+                    "created": 0,
+                    "model": "benchmark",
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {
+                                "role": "assistant",
+                                "content": None,
+                                "tool_calls": [
+                                    {
+                                        "id": f"call_benchmark{i}",
+                                        "type": "function",
+                                        "function": {
+                                            "name": fn_name,
+                                            "arguments": json.dumps(arguments),
+                                        },
+                                    }
+                                ],
+                            },
+                            "finish_reason": "stop",
+                            "logprobs": None,
+                        }
+                    ],
+                    "usage": None,
+                },
+            }
+        )
+    return ApiRecording(None, entries)
+
+
+async def run_conversation(
+    menu: Menu,
+    conversation: ScriptedConversation,
+    sink: BenchmarkAudioSink,
+    latency: LatencyModel,
+    chunk_latency: LatencyModel,
+    **agent_kwargs,
+) -> List[TurnTiming]:
+    recording = _replay_recording(conversation)
+    set_openai_clients(
+        ReplayOpenAI(recording, latency, chunk_latency),
+        AsyncReplayOpenAI(recording, latency, chunk_latency),
+    )
+    # Every conversation starts cold, with only its own stock phrases prewarmed
+    set_speech_cache(SpeechCache(cache_dir=None))
+
+    timer = TurnTimer()
+    sink.timer = timer
+    agent = BenchmarkAgent(
+        menu, inputs=list(conversation.inputs), timer=timer, **agent_kwargs
+    )
+    order = await agent.process_order_async()
+    timer.end_turn()
+    if order is None or not order.is_final():
+        raise RuntimeError(f"Conversation {conversation.name} did not finish the order")
+    return timer.turns
+
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(turns: List[TurnTiming]) -> Dict:
+    samples: Dict[str, List[float]] = {metric: [] for metric in TURN_METRICS}
+    for turn in turns:
+        for metric, value in turn.metrics().items():
+            samples[metric].append(value)
+
+    summary = {}
+    for metric, values in samples.items():
+        if not values:
+            continue
+        summary[metric] = {
+            "count": len(values),
+            "mean": sum(values) / len(values),
+            **{f"p{p}": percentile(values, p) for p in PERCENTILES},
+        }
+    return summary
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmark(args) -> Dict:
+    sink = BenchmarkAudioSink(speed=args.playback_speed)
+    set_audio_sink(sink)
+    if not args.rate_limits:
+        # Replayed requests cost nothing, so the account limits only add noise
+        set_api_scheduler(CHAT_COMPLETIONS, ApiScheduler(CHAT_COMPLETIONS))
+        set_api_scheduler(SPEECH, ApiScheduler(SPEECH))
+
+    stt_audio = None
+    if args.stt_audio:
+        with sr.AudioFile(args.stt_audio) as source:
+            stt_audio = sr.Recognizer().record(source)
+
+    latency = LatencyModel(args.latency)
+    chunk_latency = LatencyModel(args.chunk_latency)
+    menu_names = args.menus or sorted(
+        os.path.splitext(f)[0] for f in os.listdir(TEST_MENU_DIR) if f.endswith(".json")
+    )
+
+    results = {}
+    all_turns = []
+    for menu_name in menu_names:
+        menu = Menu.from_file(menu_name)
+        menu_turns = []
+        conversations = scripted_conversations(menu)
+        for run in range(args.runs):
+            for conversation in conversations:
+                turns = await run_conversation(
+                    menu,
+                    conversation,
+                    sink,
+                    latency,
+                    chunk_latency,
+                    stt_audio=stt_audio,
+                    stt_backend=args.stt_backend,
+                    menu_encoding=args.menu_encoding,
+                )
+                menu_turns.extend(turns)
+                logger.debug(
+                    f"{menu_name} {conversation.name} run {run + 1}: "
+                    f"{[round(t.metrics()['turn'], 2) for t in turns]}"
+                )
+
+        results[menu_name] = {
+            "conversations": args.runs * len(conversations),
+            "turns": len(menu_turns),
+            "metrics": summarize(menu_turns),
+        }
+        all_turns.extend(menu_turns)
+        logger.info(
+            f"{menu_name}: first audio p50 "
+            f"{results[menu_name]['metrics']['first_audio']['p50']:.3f}s, turn p95 "
+            f"{results[menu_name]['metrics']['turn']['p95']:.3f}s"
+        )
+
+    return {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "commit": _git_commit(),
+        "config": {
+            "runs": args.runs,
+            "latency": args.latency,
+            "chunk_latency": args.chunk_latency,
+            "playback_speed": args.playback_speed,
+            "stt_audio": args.stt_audio,
+            "stt_backend": args.stt_backend if args.stt_audio else None,
+            "menu_encoding": args.menu_encoding,
+            "rate_limits": args.rate_limits,
+        },
+        "menus": results,
+        "all": {"turns": len(all_turns), "metrics": summarize(all_turns)},
+        "api_scheduler": api_scheduler_metrics(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark per turn latency of scripted ordering conversations."
+    )
+    parser.add_argument(
+        "--menus",
+        type=str,
+        nargs="*",
+        default=None,
+        help=f"Menus to benchmark (default: every menu in {TEST_MENU_DIR})",
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=DEFAULT_RUNS,
+        help=f"Times each scripted conversation is run per menu (default: {DEFAULT_RUNS})",
+    )
+    parser.add_argument(
+        "--latency",
+        type=str,
+        default=DEFAULT_API_LATENCY,
+        help=f"Stand-in API latency before a response (default: {DEFAULT_API_LATENCY})",
+    )
+    parser.add_argument(
+        "--chunk_latency",
+        type=str,
+        default=DEFAULT_CHUNK_LATENCY,
+        help=f"Stand-in API delay between streamed chunks (default: {DEFAULT_CHUNK_LATENCY})",
+    )
+    parser.add_argument(
+        "--playback_speed",
+        type=float,
+        default=1.0,
+        help="Multiple of real time audio is played at, 0 plays instantly (default: 1.0)",
+    )
+    parser.add_argument(
+        "--stt_audio",
+        type=str,
+        default=None,
+        help="WAV utterance transcribed on every customer turn to time speech to text",
+    )
+    parser.add_argument(
+        "--stt_backend",
+        choices=list(STT_BACKENDS),
+        default=DEFAULT_STT_BACKEND,
+        help="Speech to text engine used with --stt_audio",
+    )
+    parser.add_argument(
+        "--menu_encoding",
+        choices=[e.value for e in MenuEncoding],
+        default=DEFAULT_MENU_ENCODING,
+        help="How the menu is written into the agent prompt",
+    )
+    parser.add_argument(
+        "--rate_limits",
+        type=bool,
+        default=False,
+        help="Whether to keep the account rate limits for replayed requests (default: False)",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=DEFAULT_OUTPUT,
+        help=f"JSON file the results are written to (default: {DEFAULT_OUTPUT})",
+    )
+    parser.add_argument(
+        "--log_level",
+        type=int,
+        default=2,
+        help="The logging level (default: 2/INFO)",
+    )
+
+    args = parser.parse_args()
+
+    logger.set_level(args.log_level)
+
+    results = asyncio.run(run_benchmark(args))
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4)
+    logger.info(f"Benchmark results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import asyncio
+
+from models.ordering import logger
+from utils.audio import BufferedAudio, get_audio_sink
+from utils.frames import FRAME_LIMIT, decode_audio, read_frame, write_frame
+from utils.speech import listen_async, start_ambient_noise_calibration
+from utils.stt import DEFAULT_STT_BACKEND, get_speech_to_text
+
+
+async def run_client(
+    host: str,
+    port: int,
+    menu_name: str,
+    voice: str,
+    personality: str,
+    use_speech_input=False,
+    use_speech_output=False,
+    stt_backend: str = DEFAULT_STT_BACKEND,
+):
+    """Interactive terminal client for an order server, optionally using the
+    local microphone and speaker."""
+    reader, writer = await asyncio.open_connection(host, port, limit=FRAME_LIMIT)
+    await write_frame(
+        writer,
+        "start",
+        menu=menu_name,
+        voice=voice,
+        personality=personality,
+        audio=use_speech_output,
+    )
+
+    speech_to_text = None
+    if use_speech_input:
+        speech_to_text = get_speech_to_text(stt_backend)
+        start_ambient_noise_calibration()
+
+    audio = None
+    playback = None
+    try:
+        while True:
+            frame = await read_frame(reader)
+            frame_type = frame["type"]
+
+            if frame_type == "say":
+                print(frame["display"] + "\n\n")
+            elif frame_type == "audio" and frame.get("format") == "pcm":
+                if audio is None:
+                    audio = BufferedAudio()
+                    playback = get_audio_sink().play(audio, blocking=False)
+                audio.append(decode_audio(frame["data"]))
+            elif frame_type == "audio_end" and audio is not None:
+                audio.close()
+                audio = None
+            elif frame_type == "listen":
+                # Don't let the microphone hear the agent still talking
+                if playback is not None:
+                    await playback.wait_async()
+                if use_speech_input:
+                    response = await listen_async(logger, speech_to_text)
+                else:
+                    response = await asyncio.to_thread(
+                        input, "waiting for response... \n\n"
+                    )
+                await write_frame(writer, "text", text=response or "")
+            elif frame_type == "done":
+                if playback is not None:
+                    await playback.wait_async()
+                logger.debug(f"Session usage: {frame['usage']}, cost: {frame['cost']}")
+                return frame
+            elif frame_type == "error":
+                print(f"Order server error: {frame['message']}")
+                return frame
+    finally:
+        writer.close()
+        await writer.wait_closed()
@@ -1,31 +1,106 @@
+import atexit
+import json
 import logging
+import os
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+# text or json, json writes one object per line for log collectors
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# Longer messages, like menus and scraped pages, are cut down to this size
+LOG_MAX_CHARS = int(os.getenv("LOG_MAX_CHARS", 4000))
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+_listener = None
+_queue_handler = None
+_setup_lock = threading.Lock()
+
+
+def truncate(message: str, max_chars: int = LOG_MAX_CHARS) -> str:
+    if max_chars is None or len(message) <= max_chars:
+        return message
+    head = max_chars * 3 // 4
+    tail = max_chars - head
+    return (
+        f"{message[:head]} ... [{len(message) - max_chars} chars truncated] ... "
+        f"{message[-tail:]}"
+    )
+
+
+class TruncatingFormatter(logging.Formatter):
+    def formatMessage(self, record):
+        record.message = truncate(record.message)
+        return super().formatMessage(record)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "logger": record.name,
+            "level": record.levelname,
+            "message": truncate(record.getMessage()),
+            **getattr(record, "fields", {}),
+        }
+        return json.dumps(entry, default=str)
+
+
+def _make_formatter(log_format: str) -> logging.Formatter:
+    if log_format == "json":
+        return JsonFormatter()
+    return TruncatingFormatter(TEXT_FORMAT)
+
+
+def _get_queue_handler() -> QueueHandler:
+    """Every logger shares one queue, drained by a single background thread
+    that does the formatting and console I/O, so logging never blocks."""
+    global _listener, _queue_handler
+    with _setup_lock:
+        if _queue_handler is None:
+            log_queue = queue.SimpleQueue()
+            console_handler = logging.StreamHandler()
+            console_handler.setFormatter(_make_formatter(LOG_FORMAT))
+            _queue_handler = QueueHandler(log_queue)
+            _listener = QueueListener(log_queue, console_handler)
+            _listener.start()
+            atexit.register(_listener.stop)
+        return _queue_handler
+
 
 class Logger:
+    """Messages can be passed as callables, which are only called when the
+    level is enabled, for anything expensive to build like JSON dumps.
+    Keyword arguments are kept as structured fields in JSON output."""
+
     def __init__(self, name, level=logging.DEBUG):
-        # Create a logger with the specified name
         self.logger = logging.getLogger(name)
-        # Set the log level to DEBUG so all log messages are recorded
         self.logger.setLevel(level)
+        # The root logger would print everything a second time
+        self.logger.propagate = False
 
-        # Create console handler with a higher log level
-        self.console_handler = logging.StreamHandler()
-        self.console_handler.setLevel(level)
-
-        # Create formatter and add it to the handler
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        self.console_handler.setFormatter(formatter)
+        # Loggers are process wide, so a second Logger with the same name
+        # must not add another handler
+        queue_handler = _get_queue_handler()
+        if queue_handler not in self.logger.handlers:
+            self.logger.addHandler(queue_handler)
 
-        # Add the handler to the logger
-        self.logger.addHandler(self.console_handler)
+    def _log(self, level, message, fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        if callable(message):
+            message = message()
+        self.logger.log(level, message, extra={"fields": fields} if fields else None)
 
-    def debug(self, message):
-        self.logger.debug(message)
+    def debug(self, message, **fields):
+        self._log(logging.DEBUG, message, fields)
 
-    def info(self, message):
-        self.logger.info(message)
+    def info(self, message, **fields):
+        self._log(logging.INFO, message, fields)
 
-    def error(self, message):
-        self.logger.error(message)
+    def error(self, message, **fields):
+        self._log(logging.ERROR, message, fields)
 
     def set_level(self, level: int):
         map_int_to_level = {
@@ -35,4 +110,3 @@ class Logger:
         }
         log_level = map_int_to_level.get(level, logging.DEBUG)
         self.logger.setLevel(log_level)
-        self.console_handler.setLevel(log_level)
\ No newline at end of file
@@ -15,12 +15,20 @@ from selenium.webdriver.support import ui
 from webdriver_manager.chrome import ChromeDriverManager
 
 from logger import Logger
-from models.base import AbstractAgent, AbstractOrderData, ApiResponseException
+from models.base import (
+    AbstractAgent,
+    AbstractOrderData,
+    ApiResponseException,
+    record_api,
+    replay_api,
+)
+from utils.api_scheduler import Priority, api_priority
 
 CHROME_PATH = (
     "/Users/williammurphy/Downloads/Google Chrome.app/Contents/MacOS/Google Chrome"
 )
 PAGE_LOAD_WAIT_TIME = 5
+DEFAULT_SCRAPER_RECORDING = "tests/recordings/scraper.jsonl"
 
 logger = Logger("menu_logger")
 
@@ -114,7 +122,7 @@ class ScraperItem(AbstractOrderData):
             f"{ScraperItem.ITEM_PRICE}": self.item_price,
             f"{ScraperItem.CATEGORY}": self.category,
             f"{ScraperItem.OPTIONS}": [x.as_dict() for x in self.options],
-            f"{ScraperItem.ADDONS}": [x.as_dict() for x in self.options],
+            f"{ScraperItem.ADDONS}": [x.as_dict() for x in self.addons],
         }
 
     def __post_init__(self, *args, **kwargs):
@@ -271,6 +279,11 @@ class ScraperAgent(AbstractAgent):
             ),
         }
 
+    def get_func_completion_res(self, *args, **kwargs):
+        # Scraping is bulk work, live ordering sessions go first
+        with api_priority(Priority.BACKGROUND):
+            return super().get_func_completion_res(*args, **kwargs)
+
     def add_to_menu(self, item: ScraperItem):
         self.scraper_menu.menu_items.append(item)
 
@@ -319,7 +332,7 @@ class ScraperAgent(AbstractAgent):
         # Now you can access the final HTML with JavaScript executed
         html = driver.page_source
 
-        logger.debug(f"Menu scraped from {url}...: \n\n {html}")
+        logger.debug(lambda: f"Menu scraped from {url}...: \n\n {html}")
 
         print(html)
 
@@ -337,7 +350,7 @@ class ScraperAgent(AbstractAgent):
             i += chunk_size
 
             logger.debug(
-                f"\n Processing raw menu chunk of len {len(current_chunk)}. {i} of "
+                lambda: f"\n Processing raw menu chunk of len {len(current_chunk)}. {i} of "
                 f"total {total}: \n\n {current_chunk}"
             )
 
@@ -351,7 +364,7 @@ class ScraperAgent(AbstractAgent):
                     response = self.get_func_completion_res(
                         add_user_msg=prompt, fn_name="process_scraped_menu"
                     )
-                    logger.debug(f"Got response from API: \n\n {response}")
+                    logger.debug(lambda: f"Got response from API: \n\n {response}")
                 else:
                     logger.debug(f"Retrying with error: \n\n {error}")
                     retry_prompt = self.get_retry_prompt(current_chunk, error)
@@ -361,7 +374,7 @@ class ScraperAgent(AbstractAgent):
 
                 try:
                     menu_chunk = ScraperMenu.from_api_response(response)
-                    logger.debug(f"Turned into menu chunk: \n\n {menu_chunk}")
+                    logger.debug(lambda: f"Turned into menu chunk: \n\n {menu_chunk}")
                     break
                 except ApiResponseException:
                     error = traceback.format_exc()
@@ -371,7 +384,7 @@ class ScraperAgent(AbstractAgent):
 
             initial_menu.extend_menu(menu_chunk)
 
-            logger.debug(f"Extended menu: \n\n {initial_menu}")
+            logger.debug(lambda: f"Extended menu: \n\n {initial_menu}")
 
         return initial_menu
 
@@ -417,12 +430,57 @@ def main():
         default="https://www.ediningexpress.com/live20/927/1749",
         help="URL of menu to scrape",
     )
+    parser.add_argument(
+        "--html_file",
+        type=str,
+        default=None,
+        help="Saved menu page to process instead of scraping --url",
+    )
+    parser.add_argument(
+        "--mock",
+        type=bool,
+        default=False,
+        help="Whether to replay recorded API responses instead of calling the API (default: False)",
+    )
+    parser.add_argument(
+        "--record",
+        type=bool,
+        default=False,
+        help="Whether to record every API request and response for later replay (default: False)",
+    )
+    parser.add_argument(
+        "--recording",
+        type=str,
+        default=DEFAULT_SCRAPER_RECORDING,
+        help=f"Recording file to replay or record into (default: {DEFAULT_SCRAPER_RECORDING})",
+    )
+    parser.add_argument(
+        "--mock_latency",
+        type=str,
+        default="recorded",
+        help="Replayed response latency, recorded or a distribution like lognormal:-0.7,0.4 (default: recorded)",
+    )
+    parser.add_argument(
+        "--mock_chunk_latency",
+        type=str,
+        default="recorded",
+        help="Delay between replayed stream chunks, same format as --mock_latency (default: recorded)",
+    )
     args = parser.parse_args()
 
+    if args.mock:
+        replay_api(args.recording, args.mock_latency, args.mock_chunk_latency)
+    elif args.record:
+        record_api(args.recording)
+
     ms = ScraperAgent()
 
     # Create a menu from the text
-    menu_html = ms.scrape(args.url)
+    if args.html_file:
+        with open(args.html_file, "r") as f:
+            menu_html = f.read()
+    else:
+        menu_html = ms.scrape(args.url)
     menu = ms.process_scraped_menu(menu_html, chunk_size=args.chunks, max=args.max_len)
 
     # Save / print the menu
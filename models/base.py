@@ -4,14 +4,47 @@ import asyncio
 import json
 import os
 import random
+import threading
+import time
+import uuid
 from dataclasses import asdict, dataclass, field
-from typing import Dict, List
+from typing import Callable, Dict, List
 
 from halo import Halo
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
 from models.api import ApiModels, ApiVoices
-from utils.speech import adjust_for_ambient_noise_async, listen, speak_new
+from models.history import HistoryManager
+from models.prompt_layout import CompletionRequestBuilder, get_request_builder
+from models.streaming import ToolCallStreamAccumulator
+from utils.api_replay import (
+    ApiRecording,
+    AsyncRecordingOpenAI,
+    AsyncReplayOpenAI,
+    LatencyModel,
+    RecordingOpenAI,
+    ReplayOpenAI,
+)
+from utils.api_scheduler import (
+    CHAT_COMPLETIONS,
+    Priority,
+    api_priority,
+    get_api_scheduler,
+)
+from utils.audio import BufferedAudio
+from utils.metering import get_usage_meter
+from utils.stt import SpeechToText
+from utils.tokens import count_tokens
+from utils.tracing import set_trace_turn, span
+from utils.speech import (
+    adjust_for_ambient_noise_async,
+    listen_async,
+    play_prefetched_speech_async,
+    prefetch_speech_async,
+    prewarm_speech_async,
+    speak_async,
+    wait_for_barge_in,
+)
 from utils.ux import (
     get_generic_order_waiting_phrases,
     get_generic_requests_to_repeat_order,
@@ -20,11 +53,67 @@ from utils.ux import (
 
 DEFAULT_MAX_NO_INPUT_RETRIES = 5
 DEFAULT_MAX_API_RETRIES = 5
+# Completion tokens reserved for a request that doesn't set max_tokens
+DEFAULT_COMPLETION_TOKENS_ESTIMATE = 300
 
 DEFAULT_API_MODEL = ApiModels.GPT4o.value
 DEFAULT_API_VOICE = ApiVoices.ONYX.value
 
 
+_client_lock = threading.Lock()
+_openai_client = None
+_async_openai_client = None
+
+
+def get_openai_client() -> OpenAI:
+    global _openai_client
+    with _client_lock:
+        if _openai_client is None:
+            # Retries are left to the API scheduler, which backs off every
+            # request sharing the rate limit instead of just this one
+            _openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+        return _openai_client
+
+
+def get_async_openai_client() -> AsyncOpenAI:
+    # One client, and so one connection pool, is shared by every session
+    global _async_openai_client
+    with _client_lock:
+        if _async_openai_client is None:
+            _async_openai_client = AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"), max_retries=0
+            )
+        return _async_openai_client
+
+
+def set_openai_clients(client, async_client):
+    global _openai_client, _async_openai_client
+    with _client_lock:
+        _openai_client = client
+        _async_openai_client = async_client
+
+
+def record_api(path: str):
+    """Appends every completion and speech exchange made from now on to the
+    JSONL recording at path."""
+    recording = ApiRecording(path)
+    set_openai_clients(
+        RecordingOpenAI(get_openai_client(), recording),
+        AsyncRecordingOpenAI(get_async_openai_client(), recording),
+    )
+
+
+def replay_api(path: str, latency: str = "recorded", chunk_latency: str = "recorded"):
+    """Answers every API request from a recording made by record_api, with
+    delays drawn from the given latency specs, without network access."""
+    recording = ApiRecording.load(path)
+    latency, chunk_latency = LatencyModel(latency), LatencyModel(chunk_latency)
+    set_openai_clients(
+        ReplayOpenAI(recording, latency, chunk_latency),
+        AsyncReplayOpenAI(recording, latency, chunk_latency),
+    )
+
+
 class ApiResponseException(Exception):
     pass
 
@@ -33,8 +122,15 @@ class NoInputException(Exception):
     pass
 
 
+class BargeInException(Exception):
+    pass
+
+
 @dataclass
 class AbstractOrderData:
+    # Lets slotted subclasses, like order items, go without a __dict__
+    __slots__ = ()
+
     def __repr__(self):
         return json.dumps(self.as_dict(), indent=4)
 
@@ -65,23 +161,48 @@ class UsageData:
     prompt_tokens: int = 0
     completion_tokens: int = 0
     total_tokens: int = 0
+    cached_tokens: int = 0
 
     def add_usage(self, response):
+        if response.usage is None:
+            return
+
         self.prompt_tokens += response.usage.prompt_tokens
         self.completion_tokens += response.usage.completion_tokens
         self.total_tokens += response.usage.total_tokens
 
+        prompt_details = getattr(response.usage, "prompt_tokens_details", None)
+        self.cached_tokens += getattr(prompt_details, "cached_tokens", None) or 0
+
+    @property
+    def cache_hit_rate(self) -> float:
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
 
 @dataclass
 class AbstractAgent:
     api_model: str = field(init=False, default=DEFAULT_API_MODEL)
     voice_selection: str = field(init=True, kw_only=True, default=DEFAULT_API_VOICE)
+    barge_in: bool = field(init=True, kw_only=True, default=False)
     message_history: List[Dict] = field(init=False, default_factory=list)
     usage_data: UsageData = field(init=False, default_factory=UsageData)
+    history_manager: HistoryManager = field(init=False, default_factory=HistoryManager)
     max_no_input_retries: int = field(init=False, default=DEFAULT_MAX_NO_INPUT_RETRIES)
+    prefetched_speech: Dict[str, asyncio.Task | BufferedAudio] = field(
+        init=False, default_factory=dict
+    )
+    speech_to_text: SpeechToText = field(init=False, default=None, repr=False)
+    use_ui_spinners: bool = field(init=False, default=True)
+    session_id: str = field(
+        init=True, kw_only=True, default_factory=lambda: uuid.uuid4().hex
+    )
+    turn: int = field(init=False, default=0)
+    # The last system prompt and its token count
+    _system_tokens: tuple = field(init=False, default=None, repr=False)
 
     def __post_init__(self, *args, **kwargs):
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.client = get_openai_client()
+        self.async_client = get_async_openai_client()
 
     @Halo(spinner="hamburger", color="grey", text="Thinking...")
     def get_func_completion_res(
@@ -92,52 +213,218 @@ class AbstractAgent:
         with_message_history=True,
         **api_kwargs,
     ):
-        if add_system_msg:
-            self.add_system_message(add_system_msg)
-        if add_user_msg:
-            self.add_user_message(add_user_msg)
+        request = self._build_completion_request(
+            add_user_msg, add_system_msg, fn_name, with_message_history
+        )
 
-        messages = [
-            self.get_system_message(),
-            *(self.message_history if with_message_history else []),
-        ]
+        model = self._select_model()
+        scheduler = get_api_scheduler(CHAT_COMPLETIONS)
+        estimated_tokens = self._estimate_request_tokens(request, api_kwargs)
+
+        started = time.perf_counter()
+        with span(
+            "completion",
+            fn_name=fn_name,
+            model=model,
+            estimated_tokens=estimated_tokens,
+            streamed=False,
+        ) as completion_span:
+            completion = scheduler.run(
+                lambda: self.client.chat.completions.create(
+                    model=model, **request, **api_kwargs
+                ),
+                tokens=estimated_tokens,
+            )
+
+            self._record_usage(completion, estimated_tokens, completion_span)
+        get_usage_meter().record_completion(
+            model, fn_name, completion.usage, time.perf_counter() - started, self.turn
+        )
+        return completion
 
-        self.logger.debug(f"For response messages: {json.dumps(messages,indent=4)}")
+    async def get_func_completion_res_async(
+        self,
+        add_user_msg: str = "",
+        add_system_msg: str = "",
+        fn_name: str = None,
+        with_message_history=True,
+        on_stream_field: Dict[str, Callable[[str], None]] = None,
+        **api_kwargs,
+    ):
+        request = self._build_completion_request(
+            add_user_msg, add_system_msg, fn_name, with_message_history
+        )
 
-        function_as_tool = {"type": "function", "function": self.functions[fn_name]}
+        model = self._select_model()
+        scheduler = get_api_scheduler(CHAT_COMPLETIONS)
+        estimated_tokens = self._estimate_request_tokens(request, api_kwargs)
+
+        async def create(**stream_kwargs):
+            return await scheduler.run_async(
+                lambda: self.async_client.chat.completions.create(
+                    model=model, **request, **api_kwargs, **stream_kwargs
+                ),
+                tokens=estimated_tokens,
+            )
+
+        started = time.perf_counter()
+        with span(
+            "completion",
+            fn_name=fn_name,
+            model=model,
+            estimated_tokens=estimated_tokens,
+            streamed=bool(on_stream_field),
+        ) as completion_span:
+            if on_stream_field:
+                completion = await self._stream_completion_async(create, on_stream_field)
+            else:
+                completion = await create()
+
+            self._record_usage(completion, estimated_tokens, completion_span)
+        get_usage_meter().record_completion(
+            model, fn_name, completion.usage, time.perf_counter() - started, self.turn
+        )
+        return completion
 
-        function_call = {"type": "function", "function": {"name": fn_name}}
+    def _build_completion_request(
+        self,
+        add_user_msg: str,
+        add_system_msg: str,
+        fn_name: str,
+        with_message_history: bool,
+    ) -> Dict:
+        if add_user_msg:
+            self.add_user_message(add_user_msg)
 
-        completion = self.client.chat.completions.create(
-            model=self.api_model,
-            messages=messages,
-            tools=[function_as_tool],
-            tool_choice=function_call,
-            **api_kwargs,
+        self.message_history = self.history_manager.compact(
+            self.message_history, self.api_model
         )
 
-        self.usage_data.add_usage(completion)
+        # Per turn instructions (order state, clarification requests) are
+        # only sent with this request, after the cacheable prefix
+        volatile_messages = (
+            [{"role": "system", "content": add_system_msg}] if add_system_msg else []
+        )
 
-        return completion
+        request = self.request_builder.build(
+            system_message=self.get_system_message(),
+            history=self.message_history if with_message_history else [],
+            fn_name=fn_name,
+            volatile_messages=volatile_messages,
+        )
 
-    async def get_func_completion_res_with_waiting(self, *args, **kwargs):
-        waiting_res = asyncio.create_task(self.waiting_for_api_response_task())
+        self.logger.debug(
+            lambda: f"For response messages: {json.dumps(request['messages'], indent=4)}"
+        )
+        return request
+
+    def _select_model(self) -> str:
+        model = get_usage_meter().select_model(self.api_model)
+        if model != self.api_model:
+            self.logger.debug(f"Over a soft budget, falling back to {model}")
+        return model
+
+    def _estimate_request_tokens(self, request: Dict, api_kwargs: Dict) -> int:
+        # Reserved up front against the tokens per minute budget, and settled
+        # against the actual usage once the response is in. The tools and
+        # system prompt, menu included, are counted once, only the history
+        # and per turn messages after them are counted on every request.
+        system_message, *messages = request["messages"]
+        prefix_tokens = self.request_builder.tool_tokens(
+            self.api_model
+        ) + self._system_message_tokens(system_message)
+        message_tokens = sum(
+            count_tokens(json.dumps(message), self.api_model) for message in messages
+        )
+        return (
+            prefix_tokens
+            + message_tokens
+            + api_kwargs.get("max_tokens", DEFAULT_COMPLETION_TOKENS_ESTIMATE)
+        )
 
-        noise_adjustment = asyncio.create_task(self.adjust_for_ambient_noise_task())
+    def _system_message_tokens(self, system_message: Dict) -> int:
+        content = system_message["content"]
+        if self._system_tokens is None or self._system_tokens[0] != content:
+            self._system_tokens = (
+                content,
+                count_tokens(json.dumps(system_message), self.api_model),
+            )
+        return self._system_tokens[1]
 
-        completion = await asyncio.to_thread(
-            self.get_func_completion_res,
-            *args,
-            **kwargs,
+    def _record_usage(self, completion, estimated_tokens: int, completion_span):
+        self.usage_data.add_usage(completion)
+        if completion.usage is not None:
+            get_api_scheduler(CHAT_COMPLETIONS).record_tokens(
+                estimated_tokens, completion.usage.total_tokens
+            )
+            prompt_details = getattr(completion.usage, "prompt_tokens_details", None)
+            completion_span.set(
+                prompt_tokens=completion.usage.prompt_tokens,
+                completion_tokens=completion.usage.completion_tokens,
+                cached_tokens=getattr(prompt_details, "cached_tokens", None) or 0,
+            )
+        self.logger.debug(
+            f"Cached prompt tokens: {self.usage_data.cached_tokens} of "
+            f"{self.usage_data.prompt_tokens} ({self.usage_data.cache_hit_rate:.0%})"
         )
 
-        await waiting_res
+    async def _stream_completion_async(
+        self,
+        create: Callable,
+        on_stream_field: Dict[str, Callable[[str], None]],
+    ):
+        stream = await create(stream=True, stream_options={"include_usage": True})
+
+        accumulator = ToolCallStreamAccumulator(on_field=on_stream_field)
+        async for chunk in stream:
+            accumulator.add_chunk(chunk)
+
+        return accumulator.to_completion()
+
+    async def get_func_completion_res_with_waiting(self, *args, **kwargs):
+        while True:
+            try:
+                return await self._get_func_completion_res_with_waiting(
+                    *args, **kwargs
+                )
+            except BargeInException:
+                # The customer kept talking, so the request in flight no
+                # longer covers what they said. Hear them out and retry.
+                self.logger.debug("Customer barged in, restarting the request...")
+                kwargs["add_user_msg"] = await self.communicate(
+                    get_response=True, with_ui_spinner=False
+                )
 
-        # cancel if not done to avoid slowing response
-        if not noise_adjustment.done():
-            noise_adjustment.cancel()
+    async def _get_func_completion_res_with_waiting(self, *args, **kwargs):
+        waiting_res = asyncio.create_task(self.waiting_for_api_response_task())
+        completion_res = asyncio.create_task(
+            self.get_func_completion_res_async(*args, **kwargs)
+        )
+        barge_in = asyncio.create_task(wait_for_barge_in()) if self.barge_in else None
 
-        await noise_adjustment
+        try:
+            with halo_context(
+                spinner="hamburger",
+                color="grey",
+                text="Thinking...",
+                enabled=self.use_ui_spinners,
+            ):
+                if barge_in is not None:
+                    await asyncio.wait(
+                        {completion_res, barge_in}, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    if not completion_res.done():
+                        raise BargeInException("Customer spoke during the request")
+                completion = await completion_res
+
+            await waiting_res
+        finally:
+            tasks = [task for task in (waiting_res, completion_res, barge_in) if task]
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+            await asyncio.gather(*tasks, return_exceptions=True)
 
         return completion
 
@@ -145,6 +432,10 @@ class AbstractAgent:
     def functions(self):
         raise NotImplementedError
 
+    @property
+    def request_builder(self) -> CompletionRequestBuilder:
+        return get_request_builder(self.functions)
+
     @property
     def logger(self):
         raise NotImplementedError
@@ -152,6 +443,11 @@ class AbstractAgent:
     def get_system_message(self):
         raise NotImplementedError
 
+    def next_turn(self):
+        """Starts the next customer turn, which tags the spans that follow."""
+        self.turn += 1
+        set_trace_turn(self.turn)
+
     def add_user_message(self, msg):
         self.message_history.append({"role": "user", "content": msg})
 
@@ -161,7 +457,32 @@ class AbstractAgent:
     def add_system_message(self, msg):
         self.message_history.append({"role": "system", "content": msg})
 
-    def communicate(
+    def prefetch_speech(self, text: str):
+        if text and text not in self.prefetched_speech:
+            self.prefetched_speech[text] = prefetch_speech_async(
+                self.async_client, text, voice_selection=self.voice_selection
+            )
+
+    def prewarm_speech(self, phrases: List[str]) -> List[asyncio.Task]:
+        tasks = prewarm_speech_async(
+            self.async_client, phrases, voice_selection=self.voice_selection
+        )
+        self.logger.debug(f"Pre-warming speech for {len(tasks)} stock phrases")
+        return tasks
+
+    async def say(self, text: str, blocking=True):
+        prefetched = self.prefetched_speech.pop(text, None)
+        if prefetched is None:
+            await speak_async(
+                self.async_client,
+                text,
+                voice_selection=self.voice_selection,
+                blocking=blocking,
+            )
+        else:
+            await play_prefetched_speech_async(prefetched, blocking=blocking)
+
+    async def communicate(
         self,
         msg: str = "",
         get_response=False,
@@ -171,14 +492,22 @@ class AbstractAgent:
         with_ui_spinner=True,
         speech_blocking=True,
     ) -> str | None:
-        def listen_for(speaking_spinner) -> str:
+        async def listen_for(speaking_spinner) -> str:
             speaking_spinner.stop()
 
             with halo_context(
                 spinner="hamburger", color="green", text="Listening..."
             ) as listening_spinner:
+                def show_partial(partial: str):
+                    listening_spinner.text = f"Listening... {partial}"
+
+                async def listen_for_speech() -> str:
+                    return await listen_async(
+                        self.logger, self.speech_to_text, on_partial=show_partial
+                    )
+
                 if self.use_speech_input:
-                    response = listen(self.logger)
+                    response = await listen_for_speech()
                     no_input_retries = 0
                     while not response:
                         err_msg = random.choice(get_generic_requests_to_repeat_order())
@@ -186,16 +515,11 @@ class AbstractAgent:
 
                         listening_spinner.stop()
                         speaking_spinner.start()
-                        speak_new(
-                            self.client,
-                            err_msg,
-                            voice_selection=self.voice_selection,
-                            blocking=speech_blocking,
-                        )
+                        await self.say(err_msg, blocking=speech_blocking)
 
                         speaking_spinner.stop()
                         listening_spinner.start()
-                        response = listen(self.logger)
+                        response = await listen_for_speech()
 
                         no_input_retries += 1
                         if no_input_retries >= self.max_no_input_retries:
@@ -207,11 +531,13 @@ class AbstractAgent:
                         listening_spinner.stop()
 
                     while True:
-                        response = input("waiting for response... \n\n")
+                        response = await asyncio.to_thread(
+                            input, "waiting for response... \n\n"
+                        )
                         if response:  # if the user entered something
                             break  # exit the loop
                         else:
-                            input(err_msg)
+                            await asyncio.to_thread(input, err_msg)
 
                 return response
 
@@ -223,34 +549,34 @@ class AbstractAgent:
         ) as speaking_spinner:
             if msg:
                 print(msg + display_summary + "\n\n")
-                speak_new(
-                    self.client,
-                    msg + speech_summary,
-                    voice_selection=self.voice_selection,
-                    blocking=speech_blocking,
-                )
+                if msg in self.prefetched_speech:
+                    await self.say(
+                        msg, blocking=True if speech_summary else speech_blocking
+                    )
+                    if speech_summary:
+                        await self.say(speech_summary, blocking=speech_blocking)
+                else:
+                    await self.say(msg + speech_summary, blocking=speech_blocking)
 
             if msg and add_to_message_history:
                 self.add_agent_message(msg)
             if get_response:
-                user_response = listen_for(speaking_spinner)
+                user_response = await listen_for(speaking_spinner)
+                self.next_turn()
                 self.logger.info(f"user response: {user_response}")
                 return user_response
 
-    async def communicate_async(self, *args, **kwargs):
-        return self.communicate(*args, **kwargs)
-
     async def waiting_for_api_response_task(self):
-        await self.communicate_async(
-            f"\n {random.choice(get_generic_order_waiting_phrases())} \n",
-            add_to_message_history=False,
-            with_ui_spinner=False,
-            speech_blocking=False,
-        )
+        # Filler speech must not hold up the completion it is covering for
+        with api_priority(Priority.FILLER):
+            await self.communicate(
+                f"\n {random.choice(get_generic_order_waiting_phrases())} \n",
+                add_to_message_history=False,
+                with_ui_spinner=False,
+                speech_blocking=False,
+            )
 
     async def adjust_for_ambient_noise_task(self):
-        try:
-            await adjust_for_ambient_noise_async()
-            self.logger.debug("Ambient noise adjustment done...")
-        except asyncio.CancelledError:
-            self.logger.debug("Ambient noise adjustment cancelled...")
+        # Only starts the background calibrator, it keeps adjusting on its own
+        await adjust_for_ambient_noise_async()
+        self.logger.debug("Ambient noise calibration running...")
@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+from models.menu_index import MenuEntry, normalize_name
+
+if TYPE_CHECKING:
+    from models.ordering import Menu
+
+MAX_FAST_PATH_QUANTITY = 20
+
+QUANTITY_WORDS = {
+    "a": 1,
+    "an": 1,
+    "one": 1,
+    "single": 1,
+    "two": 2,
+    "pair": 2,
+    "couple": 2,
+    "three": 3,
+    "four": 4,
+    "five": 5,
+    "six": 6,
+    "seven": 7,
+    "eight": 8,
+    "nine": 9,
+    "ten": 10,
+    "eleven": 11,
+    "twelve": 12,
+    "dozen": 12,
+}
+
+# Leading and trailing politeness that carries no order information
+FILLER_PHRASES = [
+    "hi",
+    "hello",
+    "hey",
+    "yes",
+    "yeah",
+    "ok",
+    "okay",
+    "um",
+    "uh",
+    "so",
+    "can i get",
+    "could i get",
+    "can i have",
+    "could i have",
+    "can we get",
+    "could we get",
+    "can we have",
+    "may i have",
+    "i would like",
+    "i d like",
+    "we would like",
+    "we d like",
+    "i ll have",
+    "i will have",
+    "we ll have",
+    "i ll take",
+    "i want",
+    "give me",
+    "let me get",
+    "let me have",
+    "let me do",
+    "please",
+    "thanks",
+    "thank you",
+    "for me",
+    "to go",
+]
+
+SEPARATORS = ("and", "plus", "also", "then")
+
+_FILLER = re.compile(
+    r"^(?:(?:%s)\b\s*)+|(?:\s*\b(?:%s))+$"
+    % ("|".join(FILLER_PHRASES), "|".join(FILLER_PHRASES))
+)
+_SEPARATOR = re.compile(r"\s*\b(%s)\b\s*" % "|".join(SEPARATORS))
+_LIST_PUNCTUATION = re.compile(r"[,;]")
+
+
+def _split_chunks(text: str) -> Tuple[List[str], List[str]]:
+    """Splits on separators, returning the chunks between them and the
+    separator before each chunk but the first. Separators with nothing
+    between them, like the Oxford comma in "a bagel, and a coffee", count as
+    one."""
+    parts = _SEPARATOR.split(text)
+    chunks, separators = [], []
+    # Chunks and the separators captured between them alternate
+    for i in range(0, len(parts), 2):
+        if not parts[i].strip():
+            continue
+        if chunks:
+            separators.append(parts[i - 1])
+        chunks.append(parts[i])
+    return chunks, separators
+
+
+@dataclass
+class FastPathLine:
+    entry: MenuEntry
+    quantity: int
+
+
+@dataclass
+class FastPathParser:
+    menu: "Menu"
+    attempts: int = field(init=False, default=0)
+    hits: int = field(init=False, default=0)
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.attempts if self.attempts else 0.0
+
+    def parse(self, utterance: str) -> Optional[List[FastPathLine]]:
+        self.attempts += 1
+        lines = self._parse(utterance)
+        if lines:
+            self.hits += 1
+        return lines
+
+    def _parse(self, utterance: str) -> Optional[List[FastPathLine]]:
+        text = normalize_name(_LIST_PUNCTUATION.sub(" and ", utterance))
+        text = _FILLER.sub("", text).strip()
+        if not text:
+            return None
+
+        # Separators may also be part of an item name ("ham and cheese
+        # omelette"), so chunks are rejoined whenever that resolves better
+        chunks, separators = _split_chunks(text)
+        if not chunks:
+            return None
+
+        # best[i] holds the fewest lines covering chunks[:i]
+        best: List[Optional[List[FastPathLine]]] = [None] * (len(chunks) + 1)
+        best[0] = []
+        for start in range(len(chunks)):
+            if best[start] is None:
+                continue
+            segment = ""
+            for end in range(start, len(chunks)):
+                if end > start:
+                    segment += f" {separators[end - 1].strip()} "
+                segment += chunks[end]
+                line = self._parse_line(segment.strip())
+                if line is None:
+                    continue
+                candidate = best[start] + [line]
+                if best[end + 1] is None or len(candidate) < len(best[end + 1]):
+                    best[end + 1] = candidate
+
+        return best[-1] or None
+
+    def _parse_line(self, segment: str) -> Optional[FastPathLine]:
+        quantity, name = self._split_quantity(segment)
+        if not name or quantity is None:
+            return None
+
+        entry = self.menu.index.get(name) or self.menu.matcher.resolve(name)
+        if entry is None or entry.price is None:
+            return None
+
+        return FastPathLine(entry, quantity)
+
+    @staticmethod
+    def _split_quantity(segment: str) -> Tuple[Optional[int], str]:
+        tokens = segment.split()
+        if not tokens:
+            return None, ""
+
+        quantity = 1
+        head = tokens[0]
+        if head.isdigit():
+            quantity = int(head)
+            tokens = tokens[1:]
+        elif head in QUANTITY_WORDS:
+            quantity = QUANTITY_WORDS[head]
+            tokens = tokens[1:]
+            # "a couple of", "a dozen"
+            if head in ("a", "an") and tokens and tokens[0] in QUANTITY_WORDS:
+                quantity = QUANTITY_WORDS[tokens[0]]
+                tokens = tokens[1:]
+
+        if tokens and tokens[0] == "of":
+            tokens = tokens[1:]
+
+        if not 0 < quantity <= MAX_FAST_PATH_QUANTITY:
+            return None, ""
+
+        return quantity, " ".join(tokens)
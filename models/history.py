@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Dict, List
+
+from utils.tokens import count_tokens
+
+DEFAULT_HISTORY_TOKEN_BUDGET = 3000
+DEFAULT_KEEP_LAST_EXCHANGES = 3
+DEFAULT_MAX_EXCHANGES = 6
+DEFAULT_MAX_SUMMARY_CHARS = 1200
+DEFAULT_MAX_SUMMARY_LINE_CHARS = 200
+
+SUMMARY_PREFIX = "Summary of the earlier conversation with the customer:"
+ORDER_STATE_PREFIX = "The users order was recorded as:"
+
+
+def _is_summary(message: Dict) -> bool:
+    return message["role"] == "system" and message["content"].startswith(
+        SUMMARY_PREFIX
+    )
+
+
+def _is_order_state(message: Dict) -> bool:
+    return message["role"] == "system" and message["content"].startswith(
+        ORDER_STATE_PREFIX
+    )
+
+
+def _split_exchanges(history: List[Dict]) -> List[List[Dict]]:
+    exchanges = []
+    for message in history:
+        if message["role"] == "user" or not exchanges:
+            exchanges.append([])
+        exchanges[-1].append(message)
+    return exchanges
+
+
+@dataclass
+class HistoryManager:
+    """Bounds message_history by compacting older turns into one summary.
+
+    Compaction only happens once the history grows past max_exchanges or the
+    token budget, so the cacheable request prefix stays stable between
+    compactions instead of shifting every turn.
+    """
+
+    token_budget: int = DEFAULT_HISTORY_TOKEN_BUDGET
+    keep_last_exchanges: int = DEFAULT_KEEP_LAST_EXCHANGES
+    max_exchanges: int = DEFAULT_MAX_EXCHANGES
+    max_summary_chars: int = DEFAULT_MAX_SUMMARY_CHARS
+    max_summary_line_chars: int = DEFAULT_MAX_SUMMARY_LINE_CHARS
+
+    def count_tokens(self, history: List[Dict], model: str) -> int:
+        return sum(count_tokens(message["content"], model) for message in history)
+
+    def needs_compaction(self, history: List[Dict], model: str) -> bool:
+        exchanges = _split_exchanges(history)
+        return len(exchanges) > self.max_exchanges or (
+            len(exchanges) > 1 and self.count_tokens(history, model) > self.token_budget
+        )
+
+    def compact(self, history: List[Dict], model: str) -> List[Dict]:
+        if not self.needs_compaction(history, model):
+            return history
+
+        summary_lines = []
+        if history and _is_summary(history[0]):
+            summary_lines = history[0]["content"][len(SUMMARY_PREFIX) :].splitlines()
+            history = history[1:]
+
+        exchanges = _split_exchanges(history)
+        keep = max(min(self.keep_last_exchanges, len(exchanges) - 1), 1)
+        compacted = self._compact_into(summary_lines, exchanges[:-keep], exchanges[-keep:])
+
+        # Still over budget, fold the oldest verbatim exchanges in as well
+        while (
+            keep > 1 and self.count_tokens(compacted, model) > self.token_budget
+        ):
+            keep -= 1
+            compacted = self._compact_into(
+                summary_lines, exchanges[:-keep], exchanges[-keep:]
+            )
+
+        return compacted
+
+    def _compact_into(
+        self,
+        summary_lines: List[str],
+        old_exchanges: List[List[Dict]],
+        recent_exchanges: List[List[Dict]],
+    ) -> List[Dict]:
+        lines = list(summary_lines)
+        order_state = None
+        for exchange in old_exchanges:
+            for message in exchange:
+                if _is_order_state(message):
+                    order_state = message
+                elif message["role"] == "user":
+                    lines.append(f"- Customer said: {self._clip(message['content'])}")
+
+        recent = [message for exchange in recent_exchanges for message in exchange]
+        # A newer order state supersedes every older one
+        if any(_is_order_state(message) for message in recent):
+            order_state = None
+
+        summary = "\n".join(line for line in lines if line.strip())
+        if len(summary) > self.max_summary_chars:
+            summary = summary[-self.max_summary_chars :].split("\n", 1)[-1]
+
+        compacted = []
+        if summary:
+            compacted.append(
+                {"role": "system", "content": f"{SUMMARY_PREFIX}\n{summary}"}
+            )
+        if order_state:
+            compacted.append(order_state)
+        return compacted + recent
+
+    def _clip(self, text: str) -> str:
+        text = " ".join(text.split())
+        if len(text) <= self.max_summary_line_chars:
+            return text
+        return text[: self.max_summary_line_chars - 3] + "..."
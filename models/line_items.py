@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Menu entry id and sorted details, the same for every way of ordering a line
+LineKey = Tuple[int, Tuple[str, ...]]
+
+
+def line_key(entry_id: int, details: Iterable[str]) -> LineKey:
+    return entry_id, tuple(sorted(details))
+
+
+class LineItemTable:
+    """The lines of one order as parallel columns, one row per distinct menu
+    item and details. Ordering the same thing again adds to its row instead of
+    a new line, quantities and subtotals are updated in place and the total
+    is kept as rows change, all in whole cents so sums are exact.
+
+    Line ids are row numbers plus one and never change, so removed rows are
+    kept as empty rows, which ordering the same thing again brings back."""
+
+    __slots__ = (
+        "entry_ids",
+        "quantities",
+        "unit_cents",
+        "subtotal_cents",
+        "names",
+        "details",
+        "total_cents",
+        "_rows",
+        "_live",
+    )
+
+    def __init__(self):
+        self.entry_ids = array("l")
+        self.quantities = array("l")
+        self.unit_cents = array("q")
+        self.subtotal_cents = array("q")
+        self.names: List[str] = []
+        self.details: List[Tuple[str, ...]] = []
+        self.total_cents = 0
+        self._rows: Dict[LineKey, int] = {}
+        self._live = 0
+
+    def copy(self) -> LineItemTable:
+        table = LineItemTable.__new__(LineItemTable)
+        table.entry_ids = array("l", self.entry_ids)
+        table.quantities = array("l", self.quantities)
+        table.unit_cents = array("q", self.unit_cents)
+        table.subtotal_cents = array("q", self.subtotal_cents)
+        table.names = list(self.names)
+        table.details = list(self.details)
+        table.total_cents = self.total_cents
+        table._rows = dict(self._rows)
+        table._live = self._live
+        return table
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.as_dicts()})"
+
+    def __len__(self) -> int:
+        return self._live
+
+    def __iter__(self) -> Iterator[int]:
+        """Line ids of the current lines, in the order they were added."""
+        for row, quantity in enumerate(self.quantities):
+            if quantity > 0:
+                yield row + 1
+
+    def __contains__(self, line_id: int) -> bool:
+        return self._row(line_id) is not None
+
+    def _row(self, line_id: int) -> Optional[int]:
+        if not isinstance(line_id, int):
+            return None
+        row = line_id - 1
+        if 0 <= row < len(self.quantities) and self.quantities[row] > 0:
+            return row
+        return None
+
+    def row(self, line_id: int) -> int:
+        row = self._row(line_id)
+        if row is None:
+            raise KeyError(line_id)
+        return row
+
+    def find(self, entry_id: int, details: Iterable[str] = ()) -> Optional[int]:
+        row = self._rows.get(line_key(entry_id, details))
+        if row is None or self.quantities[row] <= 0:
+            return None
+        return row + 1
+
+    def add(
+        self,
+        entry_id: int,
+        name: str,
+        quantity: int,
+        unit_cents: int,
+        details: Iterable[str] = (),
+    ) -> int:
+        """Adds quantity to the line for this item and details, starting one
+        if there is none, and returns its line id."""
+        if quantity <= 0:
+            raise ValueError(f"Quantity must be positive, got {quantity}")
+        key = line_key(entry_id, details)
+        row = self._rows.get(key)
+        if row is None:
+            row = self._rows[key] = len(self.quantities)
+            self.entry_ids.append(entry_id)
+            self.quantities.append(0)
+            self.unit_cents.append(unit_cents)
+            self.subtotal_cents.append(0)
+            self.names.append(name)
+            self.details.append(key[1])
+        else:
+            self.unit_cents[row] = unit_cents
+
+        self._set_quantity(row, self.quantities[row] + quantity)
+        return row + 1
+
+    def remove(self, line_id: int):
+        self._set_quantity(self.row(line_id), 0)
+
+    def set_quantity(self, line_id: int, quantity: int):
+        self._set_quantity(self.row(line_id), quantity)
+
+    def set_details(
+        self, line_id: int, details: Iterable[str], unit_cents: int
+    ) -> int:
+        """Changes the details of a line, keeping its line id unless another
+        line already has them, which it is then merged into. Returns the line
+        id it ends up on."""
+        row = self.row(line_id)
+        key = line_key(self.entry_ids[row], details)
+        if key[1] == self.details[row]:
+            return line_id
+
+        other = self._rows.get(key)
+        if other is not None and self.quantities[other] > 0:
+            quantity = self.quantities[row]
+            self._set_quantity(row, 0)
+            self.unit_cents[other] = unit_cents
+            self._set_quantity(other, self.quantities[other] + quantity)
+            return other + 1
+
+        old_key = (self.entry_ids[row], self.details[row])
+        if self._rows.get(old_key) == row:
+            del self._rows[old_key]
+        self._rows[key] = row
+        self.details[row] = key[1]
+        self.unit_cents[row] = unit_cents
+        self._set_quantity(row, self.quantities[row])
+        return line_id
+
+    def _set_quantity(self, row: int, quantity: int):
+        # The model sends quantities as JSON numbers
+        quantity = max(int(quantity), 0)
+        # A row is a live line exactly while its quantity is positive
+        if (quantity > 0) != (self.quantities[row] > 0):
+            self._live += 1 if quantity > 0 else -1
+        subtotal = self.unit_cents[row] * quantity
+        self.total_cents += subtotal - self.subtotal_cents[row]
+        self.quantities[row] = quantity
+        self.subtotal_cents[row] = subtotal
+
+    def line_summary(self) -> str:
+        lines = []
+        for line_id in self:
+            row = line_id - 1
+            details = self.details[row]
+            lines.append(
+                f"line {line_id}: {self.quantities[row]} x {self.names[row]}"
+                + (f" ({', '.join(details)})" if details else "")
+            )
+        return "\n".join(lines)
+
+    def as_dicts(self) -> List[Dict]:
+        return [
+            {
+                "line_id": line_id,
+                "name": self.names[line_id - 1],
+                "details": list(self.details[line_id - 1]),
+                "quantity": self.quantities[line_id - 1],
+                "unit_cents": self.unit_cents[line_id - 1],
+                "subtotal_cents": self.subtotal_cents[line_id - 1],
+            }
+            for line_id in self
+        ]
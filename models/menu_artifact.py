@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import pickle
+import struct
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+from models.api import ApiModels
+from models.menu_encoding import (
+    MENU_ENCODERS,
+    cache_menu_encodings,
+    encode_menu,
+    menu_token_count,
+)
+from models.menu_index import (
+    MenuIndex,
+    cache_menu_index,
+    compile_menu_index,
+    menu_content_hash,
+)
+from models.menu_matcher import MenuMatcher, cache_menu_matcher, compile_menu_matcher
+from models.pricing import PriceBook, cache_price_book, compile_price_book
+from utils.tokens import TOKENIZER
+
+# Bump whenever anything pickled in an artifact changes shape
+MENU_ARTIFACT_VERSION = 2
+MENU_ARTIFACT_DIR = os.getenv("MENU_ARTIFACT_DIR", ".menu_cache")
+MENU_ARTIFACT_SUFFIX = ".menu"
+
+# Magic, format version and the sha256 of the pickled payload that follows
+_HEADER = struct.Struct(">8sI32s")
+_MAGIC = b"ORDMENU\x00"
+
+
+@dataclass
+class MenuArtifact:
+    """Everything derived from a menu file, compiled once and loaded with a
+    single unpickle instead of parsed and indexed on every start."""
+
+    source_path: str
+    source_size: int
+    source_mtime_ns: int
+    source_hash: str
+    content_hash: str
+    full_detail: dict
+    index: MenuIndex
+    matcher: MenuMatcher
+    prices: PriceBook
+    encodings: Dict[str, str] = field(default_factory=dict)
+    # By (encoding, model)
+    token_counts: Dict[Tuple[str, str], int] = field(default_factory=dict)
+    tokenizer: str = TOKENIZER
+    version: int = MENU_ARTIFACT_VERSION
+
+    @property
+    def restaurant_name(self) -> str:
+        return self.full_detail["restaurant"]
+
+    def is_fresh(self, source_path: str, stat: os.stat_result) -> bool:
+        """Whether the artifact was compiled from the file as it is now,
+        hashing the file only when its size or mtime changed."""
+        if (
+            self.version != MENU_ARTIFACT_VERSION
+            or self.tokenizer != TOKENIZER
+            or self.source_path != os.path.abspath(source_path)
+        ):
+            return False
+        if self.matches_stat(stat):
+            return True
+        with open(source_path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest() == self.source_hash
+
+    def matches_stat(self, stat: os.stat_result) -> bool:
+        return (self.source_size, self.source_mtime_ns) == (
+            stat.st_size,
+            stat.st_mtime_ns,
+        )
+
+    def install(self):
+        """Seeds the process wide menu caches, so building a Menu from the
+        artifact reuses its index, matcher, prices and prompt text."""
+        cache_menu_index(self.content_hash, self.index)
+        cache_menu_matcher(self.content_hash, self.matcher)
+        cache_price_book(self.content_hash, self.prices)
+        cache_menu_encodings(self.content_hash, self.encodings, self.token_counts)
+
+
+def menu_artifact_path(source_path: str, artifact_dir: str = MENU_ARTIFACT_DIR) -> str:
+    """Where the artifact of a menu file goes, named after the file and
+    keyed by its full path, so menus of the same name in different
+    directories don't keep replacing each other's artifact."""
+    name = os.path.splitext(os.path.basename(source_path))[0]
+    path_hash = hashlib.sha256(os.path.abspath(source_path).encode("utf-8"))
+    return os.path.join(
+        artifact_dir, f"{name}-{path_hash.hexdigest()[:16]}{MENU_ARTIFACT_SUFFIX}"
+    )
+
+
+def compile_menu_artifact(source_path: str) -> MenuArtifact:
+    with open(source_path, "rb") as f:
+        stat = os.fstat(f.fileno())
+        source = f.read()
+
+    full_detail = json.loads(source)
+    content_hash = menu_content_hash(full_detail)
+    index = compile_menu_index(full_detail, content_hash)
+    encodings = {
+        encoding: encode_menu(full_detail, encoding, content_hash)
+        for encoding in MENU_ENCODERS
+    }
+    token_counts = {
+        (encoding, model.value): menu_token_count(
+            encodings[encoding], encoding, content_hash, model.value
+        )
+        for encoding in MENU_ENCODERS
+        for model in ApiModels
+    }
+    return MenuArtifact(
+        source_path=os.path.abspath(source_path),
+        source_size=stat.st_size,
+        source_mtime_ns=stat.st_mtime_ns,
+        source_hash=hashlib.sha256(source).hexdigest(),
+        content_hash=content_hash,
+        full_detail=full_detail,
+        index=index,
+        matcher=compile_menu_matcher(index, content_hash),
+        prices=compile_price_book(index, full_detail, content_hash),
+        encodings=encodings,
+        token_counts=token_counts,
+    )
+
+
+def write_menu_artifact(artifact: MenuArtifact, path: str):
+    payload = pickle.dumps(artifact, protocol=pickle.HIGHEST_PROTOCOL)
+    header = _HEADER.pack(
+        _MAGIC, MENU_ARTIFACT_VERSION, hashlib.sha256(payload).digest()
+    )
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # Write then rename so a concurrently starting process never reads half
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(header)
+        f.write(payload)
+    os.replace(temp_path, path)
+
+
+def read_menu_artifact(path: str) -> Optional[MenuArtifact]:
+    """Returns the artifact at path, or None when it is missing, from another
+    format version or fails its checksum. Artifacts are pickles, only read
+    ones this deployment wrote."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+
+    if len(data) < _HEADER.size:
+        return None
+    magic, version, checksum = _HEADER.unpack_from(data)
+    payload = memoryview(data)[_HEADER.size :]
+    if (
+        magic != _MAGIC
+        or version != MENU_ARTIFACT_VERSION
+        or hashlib.sha256(payload).digest() != checksum
+    ):
+        return None
+    try:
+        return pickle.loads(payload)
+    except (pickle.UnpicklingError, AttributeError, ImportError, EOFError):
+        return None
+
+
+def load_menu_artifact(
+    source_path: str, artifact_dir: str = MENU_ARTIFACT_DIR
+) -> MenuArtifact:
+    """Loads the compiled menu for a menu file, compiling and saving it first
+    when there is none or the file changed since, and installs it."""
+    stat = os.stat(source_path)
+    path = menu_artifact_path(source_path, artifact_dir)
+
+    artifact = read_menu_artifact(path)
+    if artifact is None or not artifact.is_fresh(source_path, stat):
+        artifact = compile_menu_artifact(source_path)
+        _save_menu_artifact(artifact, path)
+    elif not artifact.matches_stat(stat):
+        # Touched or saved without changes, so remember the new size and
+        # mtime instead of hashing the file again on every load
+        artifact.source_size = stat.st_size
+        artifact.source_mtime_ns = stat.st_mtime_ns
+        _save_menu_artifact(artifact, path)
+
+    artifact.install()
+    return artifact
+
+
+def _save_menu_artifact(artifact: MenuArtifact, path: str):
+    try:
+        write_menu_artifact(artifact, path)
+    except OSError:
+        # A read only deployment still works, it just compiles each start
+        pass
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import csv
+import io
+import json
+from enum import Enum
+from typing import Callable, Dict, Tuple
+
+from models.menu_index import iter_menu_addons, iter_menu_items
+from utils.tokens import count_tokens
+
+
+class MenuEncoding(Enum):
+    PYTHON_REPR = "python_repr"
+    COMPACT_TEXT = "compact_text"
+    CATEGORY_CSV = "category_csv"
+    MINIFIED_JSON = "minified_json"
+
+
+DEFAULT_MENU_ENCODING = MenuEncoding.COMPACT_TEXT.value
+
+_ENCODING_CACHE: Dict[Tuple[str, str], str] = {}
+_TOKEN_COUNT_CACHE: Dict[Tuple[str, str, str], int] = {}
+
+
+def format_price(price) -> str:
+    if price is None:
+        return "?"
+    return f"{price:.2f}".rstrip("0").rstrip(".")
+
+
+def encode_python_repr(full_detail: dict) -> str:
+    return f"{full_detail}"
+
+
+def encode_minified_json(full_detail: dict) -> str:
+    return json.dumps(full_detail, separators=(",", ":"), ensure_ascii=False)
+
+
+def encode_compact_text(full_detail: dict) -> str:
+    lines = []
+    current_path = ()
+    for path, name, price, details, addons in iter_menu_items(full_detail):
+        # Only print the categories that changed since the previous item
+        shared = 0
+        while (
+            shared < min(len(path), len(current_path))
+            and path[shared] == current_path[shared]
+        ):
+            shared += 1
+        for depth in range(shared, len(path)):
+            lines.append(f"{' ' * depth}{path[depth]}:")
+        current_path = path
+
+        indent = " " * len(path)
+        lines.append(f"{indent}{name}: {format_price(price)}")
+        for detail_name, detail_price in details:
+            lines.append(f"{indent} - {detail_name}: {format_price(detail_price)}")
+        for addon_name, addon_price in addons:
+            lines.append(f"{indent} + {addon_name}: {format_price(addon_price)}")
+
+    for category, name, price in iter_menu_addons(full_detail):
+        scope = f" ({category})" if category else ""
+        lines.append(f"+ {name}: {format_price(price)}{scope}")
+
+    return "\n".join(lines)
+
+
+def encode_category_csv(full_detail: dict) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    current_path = None
+    for path, name, price, details, addons in iter_menu_items(full_detail):
+        if path != current_path:
+            buffer.write(f"[{' > '.join(path) or 'menu'}]\n")
+            current_path = path
+        row = [name, format_price(price)]
+        if details or addons:
+            row.append("; ".join(f"{d}: {format_price(p)}" for d, p in details))
+        if addons:
+            row.append("; ".join(f"+{a}: {format_price(p)}" for a, p in addons))
+        writer.writerow(row)
+
+    addons = list(iter_menu_addons(full_detail))
+    if addons:
+        buffer.write("[add ons]\n")
+        for category, name, price in addons:
+            writer.writerow([name, format_price(price), category])
+
+    return buffer.getvalue().rstrip("\n")
+
+
+MENU_ENCODERS: Dict[str, Callable[[dict], str]] = {
+    MenuEncoding.PYTHON_REPR.value: encode_python_repr,
+    MenuEncoding.COMPACT_TEXT.value: encode_compact_text,
+    MenuEncoding.CATEGORY_CSV.value: encode_category_csv,
+    MenuEncoding.MINIFIED_JSON.value: encode_minified_json,
+}
+
+
+def register_menu_encoder(name: str, encoder: Callable[[dict], str]):
+    MENU_ENCODERS[name] = encoder
+
+
+def encode_menu(full_detail: dict, encoding: str, content_hash: str = None) -> str:
+    """The prompt text of a menu, taken from the cache when it was compiled
+    ahead of time. Text encoded here isn't cached, the Menu asking for it
+    keeps it, so evicting a menu can't be undone by a session still using it."""
+    encoded = _ENCODING_CACHE.get((content_hash, encoding))
+    if encoded is None:
+        encoded = MENU_ENCODERS[encoding](full_detail)
+    return encoded
+
+
+def menu_token_count(
+    encoded: str, encoding: str, content_hash: str, model: str
+) -> int:
+    count = _TOKEN_COUNT_CACHE.get((content_hash, encoding, model))
+    if count is None:
+        count = count_tokens(encoded, model)
+    return count
+
+
+def cache_menu_encodings(
+    content_hash: str,
+    encodings: Dict[str, str],
+    token_counts: Dict[Tuple[str, str], int],
+):
+    """Seeds the caches with encodings and token counts by (encoding, model)
+    computed ahead of time, like those of a compiled menu."""
+    for encoding, encoded in encodings.items():
+        _ENCODING_CACHE[(content_hash, encoding)] = encoded
+    for (encoding, model), count in token_counts.items():
+        _TOKEN_COUNT_CACHE[(content_hash, encoding, model)] = count
+
+
+def evict_menu_encodings(content_hash: str):
+    for key in [key for key in _ENCODING_CACHE if key[0] == content_hash]:
+        _ENCODING_CACHE.pop(key, None)
+    for key in [key for key in _TOKEN_COUNT_CACHE if key[0] == content_hash]:
+        _TOKEN_COUNT_CACHE.pop(key, None)
+
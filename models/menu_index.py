@@ -0,0 +1,276 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+from dataclasses import dataclass, field, replace
+from typing import Dict, Iterator, List, Optional, Tuple
+
+MENU_KEY = "menu"
+MENU_ITEMS_KEY = "menu_items"
+MENU_ADDONS_KEY = "menu_addons"
+
+# Top level keys of a menu file that describe the restaurant, not items
+MENU_METADATA_KEYS = ("restaurant", "restaurant_name", "restaurant_address")
+
+_WITH_ABBREVIATION = re.compile(r"\bw/\s*")
+_NON_ALPHANUMERIC = re.compile(r"[^a-z0-9]+")
+_PRICE = re.compile(r"-?\d+(?:\.\d+)?")
+
+_INDEX_CACHE: Dict[str, "MenuIndex"] = {}
+
+
+def normalize_name(name: str) -> str:
+    name = name.lower()
+    name = _WITH_ABBREVIATION.sub("with ", name)
+    name = name.replace("&", " and ")
+    return " ".join(_NON_ALPHANUMERIC.sub(" ", name).split())
+
+
+def parse_price(value) -> Optional[float]:
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _PRICE.search(str(value))
+    return float(match.group()) if match else None
+
+
+def menu_content_hash(full_detail: dict) -> str:
+    serialized = json.dumps(full_detail, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+@dataclass(frozen=True)
+class MenuEntry:
+    id: int
+    name: str
+    key: str
+    path: Tuple[str, ...]
+    price: Optional[float]
+    details: Tuple[Tuple[str, float], ...] = ()
+    addons: Tuple[Tuple[str, float], ...] = ()
+
+    @property
+    def category(self) -> str:
+        return self.path[-1] if self.path else ""
+
+    @property
+    def qualified_name(self) -> str:
+        return f"{self.name} ({self.category.title()})" if self.category else self.name
+
+
+@dataclass
+class MenuIndex:
+    entries: List[MenuEntry] = field(default_factory=list)
+    by_key: Dict[str, int] = field(default_factory=dict)
+    aliases: Dict[str, int] = field(default_factory=dict)
+    collisions: Dict[str, List[int]] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self) -> Iterator[MenuEntry]:
+        return iter(self.entries)
+
+    def __contains__(self, name: str) -> bool:
+        return self.get(name) is not None
+
+    def get(self, name: str) -> Optional[MenuEntry]:
+        key = normalize_name(name)
+        entry_id = self.by_key.get(key)
+        if entry_id is None:
+            entry_id = self.aliases.get(key)
+        return self.entries[entry_id] if entry_id is not None else None
+
+    def is_ambiguous(self, name: str) -> bool:
+        return normalize_name(name) in self.collisions
+
+    def candidates(self, name: str) -> List[MenuEntry]:
+        entry = self.get(name)
+        if entry is not None:
+            return [entry]
+        return [self.entries[i] for i in self.collisions.get(normalize_name(name), [])]
+
+    def price_of(self, name: str) -> Optional[float]:
+        entry = self.get(name)
+        return entry.price if entry else None
+
+    def display_name(self, entry: MenuEntry) -> str:
+        return entry.qualified_name if entry.key in self.collisions else entry.name
+
+    def flat_menu_items(self) -> Dict[str, Optional[float]]:
+        return {self.display_name(entry): entry.price for entry in self.entries}
+
+    def add(
+        self,
+        name: str,
+        path: Tuple[str, ...],
+        price: Optional[float],
+        details: Tuple[Tuple[str, float], ...] = (),
+        addons: Tuple[Tuple[str, float], ...] = (),
+    ) -> MenuEntry:
+        duplicate = self._uncategorized_duplicate(normalize_name(name), path)
+        if duplicate is not None:
+            return self._merge(duplicate, path, price, details, addons)
+
+        entry = MenuEntry(
+            id=len(self.entries),
+            name=name.title(),
+            key=normalize_name(name),
+            path=path,
+            price=price,
+            details=details,
+            addons=addons,
+        )
+        self.entries.append(entry)
+
+        for alias in self._aliases_for(entry):
+            self.aliases.setdefault(alias, entry.id)
+
+        if entry.key in self.collisions:
+            self.collisions[entry.key].append(entry.id)
+        elif entry.key in self.by_key:
+            # Keep every colliding entry reachable through its category
+            # qualified alias and force the bare name through clarification
+            self.collisions[entry.key] = [self.by_key.pop(entry.key), entry.id]
+        else:
+            self.by_key[entry.key] = entry.id
+
+        return entry
+
+    def _uncategorized_duplicate(
+        self, key: str, path: Tuple[str, ...]
+    ) -> Optional[MenuEntry]:
+        """The entry a new item of the same name is part of when either has
+        no category. Scrapes split one item over several rows, like its
+        sizes on one and its description on another, and without a category
+        there would be no way to tell the rows apart."""
+        if key in self.by_key:
+            entry = self.entries[self.by_key[key]]
+            if not path or not entry.path:
+                return entry
+        elif key in self.collisions and not path:
+            return self.entries[self.collisions[key][0]]
+        return None
+
+    def _merge(
+        self,
+        entry: MenuEntry,
+        path: Tuple[str, ...],
+        price: Optional[float],
+        details: Tuple[Tuple[str, float], ...],
+        addons: Tuple[Tuple[str, float], ...],
+    ) -> MenuEntry:
+        prices = [p for p in (entry.price, price) if p is not None]
+        merged = replace(
+            entry,
+            path=entry.path or path,
+            price=min(prices) if prices else None,
+            details=_merge_details(entry.details, details),
+            addons=_merge_details(entry.addons, addons),
+        )
+        self.entries[entry.id] = merged
+
+        if merged.path != entry.path:
+            for alias in self._aliases_for(merged):
+                self.aliases.setdefault(alias, merged.id)
+        return merged
+
+    @staticmethod
+    def _aliases_for(entry: MenuEntry) -> List[str]:
+        aliases = []
+        if entry.category:
+            category = normalize_name(entry.category)
+            aliases.append(f"{category} {entry.key}")
+            aliases.append(f"{entry.key} {category}")
+            aliases.append(normalize_name(entry.qualified_name))
+        return aliases
+
+    @classmethod
+    def from_menu_detail(cls, full_detail: dict) -> "MenuIndex":
+        index = cls()
+        for path, name, price, details, addons in iter_menu_items(full_detail):
+            if price is None and details:
+                price = min(detail_price for _, detail_price in details)
+            index.add(name, path, price, details, addons)
+        return index
+
+
+PricedDetails = Tuple[Tuple[str, float], ...]
+
+
+def _merge_details(details: PricedDetails, more: PricedDetails) -> PricedDetails:
+    seen = {normalize_name(name) for name, _ in details}
+    return details + tuple(
+        (name, price) for name, price in more if normalize_name(name) not in seen
+    )
+MenuRow = Tuple[Tuple[str, ...], str, Optional[float], PricedDetails, PricedDetails]
+
+
+def _priced_details(details: Optional[List[dict]]) -> PricedDetails:
+    return tuple(
+        (detail["name"], parse_price(detail.get("detail_price")) or 0.0)
+        for detail in details or []
+    )
+
+
+def iter_menu_items(full_detail: dict) -> Iterator[MenuRow]:
+    """Yields (category path, name, price, priced details, priced add ons) for
+    every item of either a nested category menu or a scraped `menu_items`
+    list. Details are options or, from older scrapes, plain details, both of
+    which replace the item price when priced, add ons add to it."""
+    if isinstance(full_detail.get(MENU_ITEMS_KEY), list):
+        for item in full_detail[MENU_ITEMS_KEY]:
+            category = item.get("category")
+            yield (
+                (category,) if category else (),
+                item["name"],
+                parse_price(item.get("item_price")),
+                _priced_details(item.get("options"))
+                + _priced_details(item.get("details")),
+                _priced_details(item.get("addons")),
+            )
+    else:
+        tree = full_detail.get(MENU_KEY, full_detail)
+        for path, name, price in _walk_menu_tree(tree):
+            yield path, name, parse_price(price), (), ()
+
+
+def iter_menu_addons(full_detail: dict) -> Iterator[Tuple[str, str, float]]:
+    """Yields (category, name, price) for the add ons of a scraped menu that
+    go with every item, or every item of a category when it is set."""
+    for addon in full_detail.get(MENU_ADDONS_KEY) or []:
+        yield (
+            addon.get("category") or "",
+            addon["name"],
+            parse_price(addon.get("detail_price")) or 0.0,
+        )
+
+
+def _walk_menu_tree(
+    tree: dict, path: Tuple[str, ...] = ()
+) -> Iterator[Tuple[Tuple[str, ...], str, object]]:
+    for key, value in tree.items():
+        if not path and key in MENU_METADATA_KEYS:
+            continue
+        if isinstance(value, dict):
+            yield from _walk_menu_tree(value, path + (key,))
+        else:
+            yield path, key, value
+
+
+def compile_menu_index(full_detail: dict, content_hash: str = None) -> MenuIndex:
+    content_hash = content_hash or menu_content_hash(full_detail)
+    index = _INDEX_CACHE.get(content_hash)
+    if index is None:
+        index = _INDEX_CACHE[content_hash] = MenuIndex.from_menu_detail(full_detail)
+    return index
+
+
+def cache_menu_index(content_hash: str, index: MenuIndex):
+    _INDEX_CACHE[content_hash] = index
+
+
+def evict_menu_index(content_hash: str):
+    _INDEX_CACHE.pop(content_hash, None)
@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import heapq
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from models.menu_index import MenuEntry, MenuIndex, normalize_name
+from utils.phonetics import phonetic_tokens
+
+NGRAM_SIZE = 3
+SHORTLIST_SIZE = 5
+
+NGRAM_WEIGHT = 0.3
+EDIT_WEIGHT = 0.5
+PHONETIC_WEIGHT = 0.2
+
+DEFAULT_MIN_CONFIDENCE = 0.72
+DEFAULT_MIN_MARGIN = 0.08
+# Every spoken token must closely match some token of the menu item, so
+# "mocha latte" never silently becomes "matcha latte"
+DEFAULT_MIN_TOKEN_SIMILARITY = 0.75
+
+# Spoken or shorthand tokens folded before scoring
+TOKEN_EQUIVALENTS = {"w": "with", "n": "and"}
+
+_MATCHER_CACHE: Dict[str, "MenuMatcher"] = {}
+
+
+def match_key(name: str) -> str:
+    tokens = []
+    for token in normalize_name(name).split():
+        token = TOKEN_EQUIVALENTS.get(token, token)
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return " ".join(tokens)
+
+
+def char_ngrams(key: str, n: int = NGRAM_SIZE) -> List[str]:
+    padded = f" {key} "
+    return [padded[i : i + n] for i in range(max(len(padded) - n + 1, 1))]
+
+
+def levenshtein(a: str, b: str) -> int:
+    """Bit-parallel (Myers/Hyyro) edit distance, linear in len(b)."""
+    if not a:
+        return len(b)
+
+    mask = (1 << len(a)) - 1
+    high = 1 << (len(a) - 1)
+    peq = {}
+    for i, c in enumerate(a):
+        peq[c] = peq.get(c, 0) | (1 << i)
+
+    pv, mv, distance = mask, 0, len(a)
+    for c in b:
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & high:
+            distance += 1
+        elif mh & high:
+            distance -= 1
+        ph = ((ph << 1) | 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+
+    return distance
+
+
+def edit_similarity(a: str, b: str) -> float:
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    return 1.0 - levenshtein(a, b) / max(len(a), len(b))
+
+
+def phonetic_similarity(a: Tuple[str, ...], b: Tuple[str, ...]) -> float:
+    if not a or not b:
+        return 0.0
+    set_a, set_b = set(a), set(b)
+    return len(set_a & set_b) / len(set_a | set_b)
+
+
+@dataclass(frozen=True)
+class MatchResult:
+    query: str
+    entry: Optional[MenuEntry]
+    score: float
+    runner_up: Optional[MenuEntry] = None
+    runner_up_score: float = 0.0
+    is_confident: bool = False
+
+
+@dataclass
+class MenuMatcher:
+    index: MenuIndex
+    min_confidence: float = DEFAULT_MIN_CONFIDENCE
+    min_margin: float = DEFAULT_MIN_MARGIN
+    min_token_similarity: float = DEFAULT_MIN_TOKEN_SIMILARITY
+    match_keys: List[str] = field(init=False, repr=False)
+    ngram_postings: Dict[str, List[int]] = field(init=False, repr=False)
+    ngram_counts: List[int] = field(init=False, repr=False)
+    phonetics: List[Tuple[str, ...]] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        postings = defaultdict(list)
+        self.match_keys = []
+        self.ngram_counts = []
+        self.phonetics = []
+        for entry in self.index:
+            key = match_key(entry.key)
+            grams = set(char_ngrams(key))
+            for gram in grams:
+                postings[gram].append(entry.id)
+            self.match_keys.append(key.replace(" ", ""))
+            self.ngram_counts.append(len(grams))
+            self.phonetics.append(tuple(phonetic_tokens(key)))
+        self.ngram_postings = dict(postings)
+
+    def score_all(self, name: str) -> Dict[int, float]:
+        """N-gram dice coefficient of the name against every menu entry in one
+        pass over the posting lists, entries sharing no n-gram are omitted."""
+        query_grams = set(char_ngrams(match_key(name)))
+        shared = defaultdict(int)
+        for gram in query_grams:
+            for entry_id in self.ngram_postings.get(gram, ()):
+                shared[entry_id] += 1
+
+        query_count = len(query_grams)
+        counts = self.ngram_counts
+        return {
+            entry_id: 2 * overlap / (query_count + counts[entry_id])
+            for entry_id, overlap in shared.items()
+        }
+
+    def match(self, name: str) -> MatchResult:
+        exact = self.index.get(name)
+        if exact is not None:
+            return MatchResult(name, exact, 1.0, is_confident=True)
+
+        ngram_scores = self.score_all(name)
+        shortlist = heapq.nlargest(
+            SHORTLIST_SIZE, ngram_scores, key=ngram_scores.__getitem__
+        )
+        if not shortlist:
+            return MatchResult(name, None, 0.0)
+
+        key = match_key(name)
+        query_phonetics = tuple(phonetic_tokens(key))
+        compact_key = key.replace(" ", "")
+        ranked = sorted(
+            (
+                (
+                    NGRAM_WEIGHT * ngram_scores[i]
+                    + EDIT_WEIGHT * edit_similarity(compact_key, self.match_keys[i])
+                    + PHONETIC_WEIGHT
+                    * phonetic_similarity(query_phonetics, self.phonetics[i]),
+                    i,
+                )
+                for i in shortlist
+            ),
+            reverse=True,
+        )
+
+        best_score, best_id = ranked[0]
+        runner_up_score, runner_up_id = ranked[1] if len(ranked) > 1 else (0.0, None)
+        best = self.index.entries[best_id]
+        runner_up = (
+            self.index.entries[runner_up_id] if runner_up_id is not None else None
+        )
+
+        is_confident = (
+            best_score >= self.min_confidence
+            and best_score - runner_up_score >= self.min_margin
+            and best.key not in self.index.collisions
+            and self._tokens_align(key, match_key(best.key))
+        )
+        return MatchResult(
+            name, best, best_score, runner_up, runner_up_score, is_confident
+        )
+
+    def _tokens_align(self, query_key: str, entry_key: str) -> bool:
+        entry_tokens = entry_key.split()
+        return all(
+            max(edit_similarity(token, other) for other in entry_tokens)
+            >= self.min_token_similarity
+            for token in query_key.split()
+        )
+
+    def resolve(self, name: str) -> Optional[MenuEntry]:
+        result = self.match(name)
+        return result.entry if result.is_confident else None
+
+
+def compile_menu_matcher(index: MenuIndex, content_hash: str) -> MenuMatcher:
+    matcher = _MATCHER_CACHE.get(content_hash)
+    if matcher is None or matcher.index is not index:
+        matcher = _MATCHER_CACHE[content_hash] = MenuMatcher(index)
+    return matcher
+
+
+def cache_menu_matcher(content_hash: str, matcher: MenuMatcher):
+    _MATCHER_CACHE[content_hash] = matcher
+
+
+def evict_menu_matcher(content_hash: str):
+    _MATCHER_CACHE.pop(content_hash, None)
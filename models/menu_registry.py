@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterator, Optional, Tuple
+
+from models.menu_encoding import evict_menu_encodings
+from models.menu_index import evict_menu_index
+from models.menu_matcher import evict_menu_matcher
+from models.ordering import TEST_MENU_DIR, Menu, logger
+from models.pricing import evict_price_book
+
+DEFAULT_MAX_MENUS = 64
+DEFAULT_RELOAD_INTERVAL = 2.0
+
+MENU_NAME_PATTERN = re.compile(r"^[\w-]+$")
+
+# Size and mtime of a menu file, which change with every edit
+FileSignature = Tuple[int, int]
+
+
+@dataclass
+class ResidentMenu:
+    menu: Menu
+    signature: FileSignature
+
+
+def evict_menu_caches(content_hash: str):
+    """Drops the prompt text, index, matcher and prices derived from one
+    version of a menu. Sessions already using it keep their Menu, which holds
+    all of them."""
+    evict_menu_encodings(content_hash)
+    evict_menu_index(content_hash)
+    evict_menu_matcher(content_hash)
+    evict_price_book(content_hash)
+
+
+class MenuRegistry:
+    """The menus of every restaurant a process serves, loaded on first use,
+    shared by all their sessions and kept to the most recently used
+    max_menus. Edited menu files are reloaded and swapped in whole, so each
+    new session gets either the old or the new menu, never a mix, while
+    sessions already ordering keep the menu they started with."""
+
+    def __init__(
+        self,
+        menu_dir: str = TEST_MENU_DIR,
+        max_menus: int = DEFAULT_MAX_MENUS,
+    ):
+        self.menu_dir = menu_dir
+        self.max_menus = max_menus
+        self.loads = 0
+        self.reloads = 0
+        self.evictions = 0
+
+        self._menus: OrderedDict[str, ResidentMenu] = OrderedDict()
+        # Loads in progress by menu name
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+        self._stop_watching = threading.Event()
+
+    def __len__(self) -> int:
+        return len(self._menus)
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            return iter(list(self._menus))
+
+    def __contains__(self, menu_name: str) -> bool:
+        return menu_name in self._menus
+
+    def _path(self, menu_name: str) -> str:
+        return os.path.join(self.menu_dir, f"{menu_name}.json")
+
+    def _signature(self, menu_name: str) -> FileSignature:
+        stat = os.stat(self._path(menu_name))
+        return stat.st_size, stat.st_mtime_ns
+
+    async def get(self, menu_name: str) -> Menu:
+        """The resident menu, or the menu loaded from its file in a worker
+        thread. Sessions starting on the same menu while it loads wait for
+        that one load."""
+        if not MENU_NAME_PATTERN.match(menu_name):
+            raise ValueError(f"Invalid menu name: {menu_name}")
+
+        with self._lock:
+            resident = self._menus.get(menu_name)
+            if resident is not None:
+                self._menus.move_to_end(menu_name)
+                return resident.menu
+
+            loading = self._loading.get(menu_name)
+            if loading is None:
+                loading = self._loading[menu_name] = (
+                    asyncio.get_running_loop().run_in_executor(
+                        None, self._load, menu_name
+                    )
+                )
+
+        # A session that gives up waiting doesn't cancel the load for others
+        return await asyncio.shield(loading)
+
+    def _load(self, menu_name: str) -> Menu:
+        try:
+            # Taken before loading, so an edit made while loading is
+            # picked up by the next refresh
+            signature = self._signature(menu_name)
+            menu = Menu.from_file(menu_name, self.menu_dir)
+        except BaseException:
+            with self._lock:
+                self._loading.pop(menu_name, None)
+            raise
+
+        with self._lock:
+            self._loading.pop(menu_name, None)
+            self._menus[menu_name] = ResidentMenu(menu, signature)
+            self.loads += 1
+            logger.debug(f"Loaded menu {menu_name}, {len(self._menus)} resident")
+
+            while len(self._menus) > self.max_menus:
+                evicted_name, evicted = self._menus.popitem(last=False)
+                self._drop(evicted.menu)
+                self.evictions += 1
+                logger.debug(f"Evicted menu {evicted_name}")
+        return menu
+
+    def _drop(self, menu: Menu):
+        # Another resident menu can share the content of the dropped one
+        content_hash = menu.content_hash
+        if all(r.menu.content_hash != content_hash for r in self._menus.values()):
+            evict_menu_caches(content_hash)
+
+    def refresh(self) -> int:
+        """Reloads every resident menu whose file changed and forgets those
+        whose file is gone, returning how many were reloaded."""
+        with self._lock:
+            names = list(self._menus)
+
+        reloaded = 0
+        for menu_name in names:
+            try:
+                signature = self._signature(menu_name)
+            except FileNotFoundError:
+                with self._lock:
+                    resident = self._menus.pop(menu_name, None)
+                    if resident is not None:
+                        self._drop(resident.menu)
+                logger.info(f"Menu {menu_name} was removed, unloaded it")
+                continue
+
+            with self._lock:
+                resident = self._menus.get(menu_name)
+            if resident is None or resident.signature == signature:
+                continue
+
+            try:
+                menu = Menu.from_file(menu_name, self.menu_dir)
+            except (OSError, ValueError, KeyError) as e:
+                # Likely caught mid save, keep serving the last good menu
+                # until the file changes again
+                logger.error(f"Reloading menu {menu_name} failed, keeping it: {e!r}")
+                resident.signature = signature
+                continue
+
+            if menu.content_hash == resident.menu.content_hash:
+                # Saved without changes, keep sharing the same menu
+                resident.signature = signature
+                continue
+
+            with self._lock:
+                if self._menus.get(menu_name) is not resident:
+                    continue
+                self._menus[menu_name] = ResidentMenu(menu, signature)
+                self._drop(resident.menu)
+                self.reloads += 1
+                reloaded += 1
+            logger.info(f"Reloaded menu {menu_name}")
+        return reloaded
+
+    def start_watching(self, interval: float = DEFAULT_RELOAD_INTERVAL):
+        """Checks the files of resident menus for edits every interval
+        seconds from a background thread."""
+        if self._watcher is not None:
+            return
+        self._stop_watching.clear()
+        self._watcher = threading.Thread(
+            target=self._watch, args=(interval,), name="menu-watcher", daemon=True
+        )
+        self._watcher.start()
+
+    def stop_watching(self):
+        if self._watcher is not None:
+            self._stop_watching.set()
+            self._watcher.join()
+            self._watcher = None
+
+    def _watch(self, interval: float):
+        while not self._stop_watching.wait(interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Menu watcher failed: {e!r}")
@@ -1,12 +1,14 @@
 from __future__ import annotations
 
 import asyncio
+import contextlib
+import copy
 import datetime
 import json
 import random
-from collections import defaultdict
-from dataclasses import asdict, dataclass, field
-from typing import DefaultDict, Dict, List, Tuple
+from dataclasses import InitVar, asdict, dataclass, field
+from decimal import Decimal
+from typing import Dict, List, Tuple
 
 from logger import Logger
 from models.base import (
@@ -16,8 +18,38 @@ from models.base import (
     ApiResponseException,
     NoInputException,
 )
-from utils.utils import get_innermost_items
-from utils.ux import get_generic_order_waiting_phrases
+from models.fast_path import FastPathParser
+from models.history import ORDER_STATE_PREFIX
+from models.line_items import LineItemTable
+from models.menu_artifact import load_menu_artifact
+from models.menu_encoding import (
+    DEFAULT_MENU_ENCODING,
+    MENU_ENCODERS,
+    encode_menu,
+    menu_token_count,
+)
+from models.menu_index import (
+    MenuEntry,
+    MenuIndex,
+    compile_menu_index,
+    menu_content_hash,
+)
+from models.menu_matcher import MenuMatcher, compile_menu_matcher
+from models.pricing import PriceBook, compile_price_book, from_cents
+from utils.api_scheduler import api_scheduler_metrics
+from utils.metering import BudgetExceededException, get_usage_meter, metered
+from utils.speech import stop_ambient_noise_calibration
+from utils.stt import DEFAULT_STT_BACKEND, get_speech_to_text
+from utils.tracing import get_tracer, span, trace_session
+from utils.ux import (
+    get_api_error_message,
+    get_fast_path_confirmation_phrases,
+    get_generic_order_waiting_phrases,
+    get_greeting,
+    get_no_input_message,
+    get_processing_error_message,
+    get_stock_phrases,
+)
 
 TEST_MENU_DIR = "tests/test_menus"
 
@@ -30,11 +62,46 @@ random.seed(datetime.datetime.now())
 class Menu(AbstractOrderData):
     restaurant_name: str
     full_detail: dict
+    # Given when already known, like for a compiled menu
+    content_hash: str = None
+    index: MenuIndex = field(init=False, repr=False)
+    matcher: MenuMatcher = field(init=False, repr=False)
+    prices: PriceBook = field(init=False, repr=False)
     flat_menu_items: dict = field(init=False)
+    # Prompt text by encoding, kept for as long as the menu is in use
+    encodings: Dict[str, str] = field(
+        init=False, default_factory=dict, repr=False, compare=False
+    )
 
     def __post_init__(self):
-        self.flat_menu_items = {
-            k.title(): v for k, v in get_innermost_items(self.full_detail).items()
+        self.content_hash = self.content_hash or menu_content_hash(self.full_detail)
+        self.index = compile_menu_index(self.full_detail, self.content_hash)
+        self.matcher = compile_menu_matcher(self.index, self.content_hash)
+        self.prices = compile_price_book(
+            self.index, self.full_detail, self.content_hash
+        )
+        self.flat_menu_items = self.index.flat_menu_items()
+
+        for key, entry_ids in self.index.collisions.items():
+            logger.debug(
+                f"Menu item name collision for '{key}': "
+                f"{[self.index.entries[i].qualified_name for i in entry_ids]}"
+            )
+
+    def encode(self, encoding: str = DEFAULT_MENU_ENCODING) -> str:
+        encoded = self.encodings.get(encoding)
+        if encoded is None:
+            encoded = self.encodings[encoding] = encode_menu(
+                self.full_detail, encoding, self.content_hash
+            )
+        return encoded
+
+    def encoding_report(self, model: str) -> Dict[str, int]:
+        return {
+            encoding: menu_token_count(
+                self.encode(encoding), encoding, self.content_hash, model
+            )
+            for encoding in MENU_ENCODERS
         }
 
     def as_dict(self):
@@ -44,14 +111,16 @@ class Menu(AbstractOrderData):
         }
 
     @classmethod
-    def from_file(cls, menu_name: str) -> dict:
-        filename = f"{TEST_MENU_DIR}/{menu_name}.json"
-        with open(filename, "r") as f:
-            menu = json.load(f)
-        return Menu(full_detail=menu, restaurant_name=menu["restaurant"])
+    def from_file(cls, menu_name: str, menu_dir: str = TEST_MENU_DIR) -> Menu:
+        artifact = load_menu_artifact(f"{menu_dir}/{menu_name}.json")
+        return Menu(
+            restaurant_name=artifact.restaurant_name,
+            full_detail=artifact.full_detail,
+            content_hash=artifact.content_hash,
+        )
 
 
-@dataclass
+@dataclass(slots=True)
 class Item(AbstractOrderData):
     NAME = "name"
     DETAILS = "details"
@@ -60,12 +129,13 @@ class Item(AbstractOrderData):
     name: str
     details: List[str] = field(default_factory=list)
     quantity: int = field(default=0)
+    line_id: int = field(default=None)
 
     def __post_init__(self):
         self.name = self.name.title()
 
     def __hash__(self) -> int:
-        return hash((self.name, (hash(x for x in self.details) or 0), self.quantity))
+        return hash((self.name, tuple(sorted(self.details)), self.quantity))
 
     @classmethod
     def get_schema(
@@ -107,6 +177,143 @@ def human_item_list(items: List[Item]):
     return ", ".join([i.name for i in items]) + last
 
 
+@dataclass
+class OrderOperation(AbstractOrderData):
+    OP = "op"
+    LINE_ID = "line_id"
+    NAME = "name"
+    QUANTITY = "quantity"
+    DETAILS = "details"
+    DETAIL = "detail"
+
+    ADD = "add"
+    REMOVE = "remove"
+    SET_QUANTITY = "set_quantity"
+    ADD_DETAIL = "add_detail"
+    REMOVE_DETAIL = "remove_detail"
+
+    op: str
+    line_id: int = None
+    name: str = None
+    quantity: int = None
+    details: List[str] = field(default_factory=list)
+    detail: str = None
+
+    @classmethod
+    def get_schema(cls):
+        return {
+            "type": "object",
+            "properties": {
+                f"{OrderOperation.OP}": {
+                    "type": "string",
+                    "enum": [
+                        OrderOperation.ADD,
+                        OrderOperation.REMOVE,
+                        OrderOperation.SET_QUANTITY,
+                        OrderOperation.ADD_DETAIL,
+                        OrderOperation.REMOVE_DETAIL,
+                    ],
+                    "description": (
+                        "add a new line, or remove, set_quantity, add_detail or "
+                        "remove_detail on an existing line."
+                    ),
+                },
+                f"{OrderOperation.LINE_ID}": {
+                    "type": "integer",
+                    "description": "Id of the existing order line, for every operation except add.",
+                },
+                f"{OrderOperation.NAME}": {
+                    "type": "string",
+                    "description": "For add, key from ONLY the innermost keys of the menu item with the greatest specificity.",
+                },
+                f"{OrderOperation.QUANTITY}": {
+                    "type": "number",
+                    "description": "For add and set_quantity, the quantity of the item.",
+                },
+                f"{OrderOperation.DETAILS}": {
+                    "type": "array",
+                    "description": "For add, array of item details.",
+                    "items": {"type": "string"},
+                },
+                f"{OrderOperation.DETAIL}": {
+                    "type": "string",
+                    "description": "For add_detail and remove_detail, the item detail.",
+                },
+            },
+            "required": [f"{OrderOperation.OP}"],
+        }
+
+
+@dataclass
+class OrderDelta(AbstractOrderData):
+    """The changes one reply makes to the order, so the model only writes
+    what changed instead of the whole order every turn."""
+
+    OPERATIONS = "operations"
+    HUMAN_RESPONSE = "human_response"
+    UNRECOGNIZED_ITEMS = "unrecognized_items"
+    IS_COMPLETED = "is_completed"
+    IS_FINALIZED = "is_finalized"
+
+    human_response: str
+    operations: List[OrderOperation] = field(default_factory=list)
+    unrecognized_items: List[Item] = field(default_factory=list)
+    is_completed: bool = False
+    is_finalized: bool = False
+
+    def __post_init__(self):
+        try:
+            self.operations = [OrderOperation(**op) for op in self.operations]
+            self.unrecognized_items = [Item(**item) for item in self.unrecognized_items]
+        except TypeError as e:
+            raise ApiResponseException("Unexpected API response format") from e
+
+    @classmethod
+    def get_schema(
+        cls,
+        operations_desc="The changes to make to the current order lines for what the user has asked for in their latest input, empty if nothing changed.",
+        unrec_items_desc="A structured mapping of items not directly mentioned in the menu AFTER clarification.",
+        single_unrec_name_desc="key user mentioned that was not found in the menu.",
+        is_completed_desc="Whether or not the order has been sufficiently clarified",
+        is_finalized_desc="Whether or not the user has given DEFINITIVE, FINAL confirmation of their order after it has been sufficiently clarified.",
+        human_res_desc="A CREATIVE, WITTY GREETING TO THE CUSTOMER",
+    ) -> dict:
+        return {
+            "type": "object",
+            "properties": {
+                f"{OrderDelta.OPERATIONS}": {
+                    "type": "array",
+                    "description": operations_desc,
+                    "items": {**OrderOperation.get_schema()},
+                },
+                f"{OrderDelta.UNRECOGNIZED_ITEMS}": {
+                    "type": "array",
+                    "description": unrec_items_desc,
+                    "items": {**Item.get_schema(name_desc=single_unrec_name_desc)},
+                },
+                f"{OrderDelta.IS_FINALIZED}": {
+                    "type": "boolean",
+                    "description": is_finalized_desc,
+                },
+                f"{OrderDelta.IS_COMPLETED}": {
+                    "type": "boolean",
+                    "description": is_completed_desc,
+                },
+                f"{OrderDelta.HUMAN_RESPONSE}": {
+                    "type": "string",
+                    "description": human_res_desc,
+                    "minLength": 10,
+                },
+            },
+            "required": [
+                f"{OrderDelta.OPERATIONS}",
+                f"{OrderDelta.HUMAN_RESPONSE}",
+                f"{OrderDelta.IS_COMPLETED}",
+                f"{OrderDelta.IS_FINALIZED}",
+            ],
+        }
+
+
 @dataclass
 class Order(AbstractOrderData):
     HUMAN_RESPONSE = "human_response"
@@ -117,55 +324,154 @@ class Order(AbstractOrderData):
     IS_FINALIZED = "is_finalized"
 
     menu: Menu
-    human_response: str
-    menu_items: List[Item]
+    human_response: str = ""
+    menu_items: InitVar[List[Dict]] = None
 
-    unrecognized_items: List[str] = field(default_factory=list)
-    processed_order: DefaultDict[Item, Tuple[float, int]] = field(
-        default_factory=lambda: defaultdict(lambda: (0, 0))
-    )
-    total_price: float = 0.0
+    unrecognized_items: List[Item] = field(default_factory=list)
     is_completed: str = False
     is_finalized: str = False
+    # One row per distinct item and details, with quantity and subtotal
+    processed_order: LineItemTable = field(init=False, default_factory=LineItemTable)
 
     def as_dict(self):
         return {
             "menu": self.menu.as_dict(),
-            "menu_items": [asdict(m) for m in self.menu_items],
+            "menu_items": self.processed_order.as_dicts(),
             "human_response": self.human_response,
-            "processed_order": {k.name: v for k, v in self.processed_order.items()},
-            "total_price": self.total_price,
+            "total_price": float(self.total_price),
             "unrecognized_items": [asdict(m) for m in self.unrecognized_items],
-            "total_price": self.total_price,
             "is_completed": self.is_completed,
         }
 
-    def __post_init__(self):
-        self.initialize()
+    def __post_init__(self, menu_items: List[Dict]):
+        self.initialize(menu_items or [])
 
-    def initialize(self):
+    def initialize(self, menu_items: List[Dict]):
         def to_item(dict_items: List[Dict]):
             return [Item(**item_args) for item_args in dict_items]
 
-        self.menu_items = to_item(self.menu_items)
-        self.unrecognized_items = to_item(self.unrecognized_items)
+        reported_unrecognized = to_item(self.unrecognized_items)
+        self.unrecognized_items = []
 
-        for item in self.menu_items:
-            if item.name not in self.menu.flat_menu_items.keys():
-                self.unrecognized_items.append(item)
-                logger.debug(f"Unrecognized item: {item}")
-                continue
+        for item in to_item(menu_items):
+            self.add_line(item)
+        self._add_unrecognized(reported_unrecognized)
+
+    @property
+    def total_price(self) -> Decimal:
+        return from_cents(self.processed_order.total_cents)
+
+    def _add_unrecognized(self, items: List[Item]):
+        # Near misses the model gave up on can still be resolved locally,
+        # saving a clarification turn
+        for item in items:
+            if self.menu.matcher.resolve(item.name) is not None:
+                self.add_line(item)
             else:
-                unit_price = self.menu.flat_menu_items[item.name]
+                self.unrecognized_items.append(item)
 
-                subtotal = unit_price * item.quantity
+    def apply(self, delta: OrderDelta) -> Order:
+        """Applies the changes from one reply in place, touching only the
+        lines they name, and takes over its response and status. The changes
+        are made to a copy of the lines first, so a reply with any invalid
+        operation leaves the order as it was."""
+        staged = copy.copy(self)
+        staged.processed_order = self.processed_order.copy()
+        staged.unrecognized_items = []
+        for operation in delta.operations:
+            staged._apply_operation(operation)
+        staged._add_unrecognized(delta.unrecognized_items)
+
+        self.processed_order = staged.processed_order
+        self.unrecognized_items = staged.unrecognized_items
+        self.human_response = delta.human_response
+        self.is_completed = delta.is_completed
+        self.is_finalized = delta.is_finalized
+        return self
+
+    def _apply_operation(self, operation: OrderOperation):
+        if operation.op == OrderOperation.ADD:
+            if not operation.name:
+                raise ApiResponseException("Order line added without a name")
+            quantity = 1 if operation.quantity is None else operation.quantity
+            self.add_line(Item(operation.name, list(operation.details), quantity))
+        elif operation.op == OrderOperation.REMOVE:
+            self.remove_line(operation.line_id)
+        elif operation.op == OrderOperation.SET_QUANTITY:
+            if operation.quantity is None:
+                raise ApiResponseException("Order line quantity set without a quantity")
+            self.set_quantity(operation.line_id, operation.quantity)
+        elif operation.op == OrderOperation.ADD_DETAIL:
+            details = self._details(operation.line_id)
+            if operation.detail and operation.detail not in details:
+                self.set_details(operation.line_id, details + (operation.detail,))
+        elif operation.op == OrderOperation.REMOVE_DETAIL:
+            details = self._details(operation.line_id)
+            if operation.detail in details:
+                self.set_details(
+                    operation.line_id, tuple(d for d in details if d != operation.detail)
+                )
+        else:
+            raise ApiResponseException(f"Unknown order operation: {operation.op}")
+
+    def _row(self, line_id: int) -> int:
+        try:
+            return self.processed_order.row(line_id)
+        except KeyError:
+            raise ApiResponseException(f"Unknown order line: {line_id}") from None
+
+    def _details(self, line_id: int) -> Tuple[str, ...]:
+        return self.processed_order.details[self._row(line_id)]
+
+    def add_line(self, item: Item) -> Item | None:
+        entry = self._resolve_menu_entry(item)
+        if entry is None:
+            self.unrecognized_items.append(item)
+            logger.debug(f"Unrecognized item: {item}")
+            return None
+        if item.quantity <= 0:
+            raise ApiResponseException(
+                f"Order line added with quantity {item.quantity}"
+            )
 
-                item_subtotal = self.processed_order[item][0] + subtotal
-                item_count = self.processed_order[item][1] + item.quantity
+        item.name = self.menu.index.display_name(entry)
+        item.line_id = self.processed_order.add(
+            entry.id,
+            item.name,
+            item.quantity,
+            self.menu.prices.unit_cents(entry.id, item.details),
+            item.details,
+        )
+        return item
+
+    def remove_line(self, line_id: int):
+        self._row(line_id)
+        self.processed_order.remove(line_id)
+
+    def set_quantity(self, line_id: int, quantity: int):
+        self._row(line_id)
+        self.processed_order.set_quantity(line_id, quantity)
+
+    def set_details(self, line_id: int, details: Tuple[str, ...]) -> int:
+        entry_id = self.processed_order.entry_ids[self._row(line_id)]
+        return self.processed_order.set_details(
+            line_id, details, self.menu.prices.unit_cents(entry_id, details)
+        )
 
-                self.processed_order[item] = (item_subtotal, item_count)
+    def _resolve_menu_entry(self, item: Item) -> MenuEntry | None:
+        entry = self.menu.index.get(item.name)
+        if entry is not None:
+            return entry
 
-                self.total_price += subtotal
+        match = self.menu.matcher.match(item.name)
+        if not match.is_confident:
+            return None
+
+        logger.debug(
+            f"Resolved '{item.name}' to '{match.entry.name}' "
+            f"locally with score {match.score:.2f}"
+        )
+        return match.entry
 
     def is_complete(self) -> bool:
         return self.is_completed
@@ -173,99 +479,64 @@ class Order(AbstractOrderData):
     def is_final(self) -> bool:
         return self.is_finalized
 
-    @classmethod
-    def from_api_response(cls, response, menu: Menu) -> "Order":
-        return super().from_api_response(response, menu=menu)
+    def get_line_summary(self) -> str:
+        """The current lines with their ids, for the model to refer to."""
+        if not self.processed_order:
+            return "The order has no lines yet."
+        return self.processed_order.line_summary()
 
     def get_human_order_summary(self, speech_only=False) -> str:
-        hpo = f"Your order is listed below: \n"
+        lines = self.processed_order
+        hpo = ["Your order is listed below: \n"]
 
-        for item, (subtotal, count) in self.processed_order.items():
+        for line_id in lines:
+            row = line_id - 1
+            name, count = lines.names[row], lines.quantities[row]
             if speech_only:
-                hpo += f"\n {count} of {item.name}"
+                hpo.append(f"\n {count} of {name}")
             else:
-                hpo += f"\n * {item.name}: {count} x {self.menu.flat_menu_items[item.name]} = ${subtotal}"
+                hpo.append(
+                    f"\n * {name}: {count} x {from_cents(lines.unit_cents[row])} = "
+                    f"${from_cents(lines.subtotal_cents[row])}"
+                )
 
-            for detail in item.details:
-                hpo += f"\n    - {detail}"
+            for detail in lines.details[row]:
+                hpo.append(f"\n    - {detail}")
 
-        hpo += f"\n\nFor a total price of: ${self.total_price} \n"
+        hpo.append(f"\n\nFor a total price of: ${self.total_price} \n")
 
         return (
-            hpo.strip("/n")
+            "".join(hpo).strip("/n")
             if speech_only
-            else f"\n\n{'='*80}\n" + hpo + f"{'='*80}\n\n"
+            else f"\n\n{'='*80}\n" + "".join(hpo) + f"{'='*80}\n\n"
         )
 
-    @classmethod
-    def get_schema(
-        cls,
-        menu_items_desc="A structured mapping to all the unique menu items the user has asked for during their session.",
-        unrec_items_desc="A structured mapping of items not directly mentioned in the menu AFTER clarification.",
-        single_unrec_name_desc="key user mentioned that was not found in the menu.",
-        is_completed_desc="Whether or not the order has been sufficiently clarified",
-        is_finalized_desc="Whether or not the user has given DEFINITIVE, FINAL confirmation of their order after it has been sufficiently clarified.",
-        human_res_desc="A CREATIVE, WITTY GREETING TO THE CUSTOMER",
-    ) -> dict:
-        return {
-            "type": "object",
-            "properties": {
-                f"{Order.MENU_ITEMS}": {
-                    "type": "array",
-                    "description": menu_items_desc,
-                    "items": {**Item.get_schema()},
-                },
-                f"{Order.UNRECOGNIZED_ITEMS}": {
-                    "type": "array",
-                    "description": unrec_items_desc,
-                    "items": {**Item.get_schema(name_desc=single_unrec_name_desc)},
-                },
-                f"{Order.IS_FINALIZED}": {
-                    "type": "boolean",
-                    "description": is_finalized_desc,
-                },
-                f"{Order.IS_COMPLETED}": {
-                    "type": "boolean",
-                    "description": is_completed_desc,
-                },
-                f"{Order.HUMAN_RESPONSE}": {
-                    "type": "string",
-                    "description": human_res_desc,
-                    "minLength": 10,
-                },
-            },
-            "required": [
-                f"{Order.MENU_ITEMS}",
-                f"{Order.HUMAN_RESPONSE}",
-                f"{Order.IS_COMPLETED}",
-                f"{Order.IS_FINALIZED}",
-            ],
-        }
-
 
 ORDER_FUNCTIONS = {
     "process_user_order": {
         "name": "process_user_order",
         "description": (
             f"Processes a users order for a given menu in order to return both a "
-            f"human readable response and a itemized transaction summary. Recognized and "
-            f"unrecognized items must be provided as separate lists. If the order is not "
+            f"human readable response and the operations that add what they asked for to "
+            f"the current order lines. Recognized items are added by operations and "
+            f"unrecognized items are provided as a separate list. If the order is not "
             f"yet complete due to ambiguity, the user will be prompted to clarify their order."
             f"If the order is complete, the user will be prompted to confirm their order."
         ),
-        "parameters": {**Order.get_schema()},
+        "parameters": {**OrderDelta.get_schema()},
     },
     "clarify_user_order": {
         "name": "clarify_user_order",
         "description": (
             f"Processes a clarification to a users order for a given menu and in order to return both a "
-            f"human readable response, an itemized transaction summary, and whether the order is complete."
-            f"Clarified and unrecognized items must be provided as separate lists, only items from the users "
+            f"human readable response, the operations that change the current order lines by their line id, "
+            f"and whether the order is complete. Clarified items are added or changed by operations and "
+            f"unrecognized items are provided as a separate list, only items from the users "
             f"recent clarification should be added the list of unrecognized items, not those being clarified."
             f"Once an order has been sufficiently clarified, the user will be prompted to confirm their order."
         ),
         "parameters": {
-            **Order.get_schema(
+            **OrderDelta.get_schema(
                 unrec_items_desc=(
                     f"A structure of items from the users current input that were not clarified. If the users "
                     f"current input is clear then this should be empty."
@@ -280,12 +551,13 @@ ORDER_FUNCTIONS = {
         "name": "finalize_user_order",
         "description": (
             f"Processes a final user users order for a given menu and in order to complete their transaction."
-            f"Recieves a human readable response, an itemized transaction summary, and whether the order is complete, "
+            f"Recieves a human readable response, operations for any last changes to the current order lines by "
+            f"their line id, and whether the order is complete, "
             f"and whether the user has confirmed that their order is finalized. Note: the human response should match "
             f"the finalization status of the order."
         ),
         "parameters": {
-            **Order.get_schema(
+            **OrderDelta.get_schema(
                 unrec_items_desc=(
                     f"Any items that have not are not clear during finalization"
                 ),
@@ -300,12 +572,35 @@ ORDER_FUNCTIONS = {
 DEFAULT_PERSONALITY_MODIFIER = "friendly and helpful"
 
 
+def get_order_lines_message(order: Order) -> str:
+    return (
+        f"The current order lines are: \n\n{order.get_line_summary()} \n\n"
+        f"Only reply with operations for what changes, referring to lines by line id."
+    )
+
+
 @dataclass
 class SalesAgent(AbstractAgent):
     menu: Menu
     use_speech_input: bool = True
+    stt_backend: str = DEFAULT_STT_BACKEND
     personality_modifier: str = DEFAULT_PERSONALITY_MODIFIER
     max_error_retries: int = DEFAULT_MAX_API_RETRIES
+    use_fast_path: bool = False
+    menu_encoding: str = DEFAULT_MENU_ENCODING
+    stream_responses: bool = True
+    prewarm_stock_speech: bool = True
+    fast_path_parser: FastPathParser = field(init=False, repr=False)
+    # The order replies are applied to, as deltas, across turns
+    order: Order = field(init=False, default=None, repr=False)
+
+    def __post_init__(self, *args, **kwargs):
+        # Barging in only makes sense when the customer is heard
+        self.barge_in = self.barge_in and self.use_speech_input
+        super().__post_init__(*args, **kwargs)
+        self.fast_path_parser = FastPathParser(self.menu)
+        if self.use_speech_input:
+            self.speech_to_text = get_speech_to_text(self.stt_backend)
 
     @property
     def functions(self) -> Dict[str, Dict]:
@@ -323,26 +618,40 @@ class SalesAgent(AbstractAgent):
                 f"interacting with a customer and mapping their order directly"
                 f"to the following menu items in an attempt to finalize their order"
                 f"while being {self.personality_modifier}:\n\n"
-                f"{self.menu.full_detail}\n\n"
+                f"{self.menu.encode(self.menu_encoding)}\n\n"
             ),
         }
 
     def process_order(self) -> Order:
         try:
-            asyncio.run(self.process_order_async())
-        except NoInputException as e:
-            logger.debug(f"No input error: \n{e}\n")
-            self.communicate(
-                "Sorry, it seems I am unable to hear you or that you've stepped away."
-                "Thank you for stopping by!"
-            )
-            return
+            return asyncio.run(self.process_order_async())
+        finally:
+            stop_ambient_noise_calibration(timeout=1)
 
     async def process_order_async(self) -> Order:
+        restaurant = self.menu.restaurant_name
+        with trace_session(self.session_id), metered(self.session_id, restaurant):
+            try:
+                with span("order", restaurant=restaurant):
+                    return await self._take_order()
+            except NoInputException as e:
+                logger.debug(f"No input error: \n{e}\n")
+                await self.communicate(get_no_input_message())
+            except BudgetExceededException as e:
+                logger.error(f"Budget exceeded: \n{e}\n")
+                # The apology is still shown when there is no budget left to
+                # speak it
+                with contextlib.suppress(BudgetExceededException):
+                    await self.communicate(get_api_error_message())
+
+    async def _take_order(self) -> Order:
+        if self.prewarm_stock_speech:
+            self.prewarm_speech(get_stock_phrases(self.menu.restaurant_name))
+
         await self.adjust_for_ambient_noise_task()
 
-        initial_input = self.communicate(
-            f"Hi, welcome to {self.menu.restaurant_name}. What can I get for you today? \n",
+        initial_input = await self.communicate(
+            get_greeting(self.menu.restaurant_name),
             get_response=True,
         )
         order = await self._initialize_order(initial_input)
@@ -364,59 +673,113 @@ class SalesAgent(AbstractAgent):
 
             if api_errors >= self.max_error_retries:
                 logger.debug(f"Max API errors exceeded: {api_errors}\n")
-                self.communicate(
-                    "Sorry, there seems to be an issue with our system or the internet connection. "
-                    "Please try again later."
-                )
+                await self.communicate(get_api_error_message())
                 return
 
-        self.communicate(
+        await self.communicate(
             order.human_response,
             display_summary=order.get_human_order_summary(),
             speech_summary=order.get_human_order_summary(speech_only=True),
         )
-        logger.debug(f"Customers Final Order: \n {order} \n")
+        logger.debug(lambda: f"Customers Final Order: \n {order} \n")
         logger.debug(f"Total API Usage Data \n {self.usage_data} \n")
+        logger.debug(
+            lambda: f"Metered API cost \n {json.dumps(get_usage_meter().report(), indent=4)} \n"
+        )
+        logger.debug(
+            lambda: f"API scheduler metrics \n {json.dumps(api_scheduler_metrics(), indent=4)} \n"
+        )
+        if get_tracer().enabled:
+            logger.debug(
+                lambda: f"Span latencies \n {json.dumps(get_tracer().latency_report(), indent=4)} \n"
+            )
+        if self.use_fast_path:
+            logger.debug(
+                f"Fast path hit rate: {self.fast_path_parser.hit_rate:.2f} "
+                f"({self.fast_path_parser.hits}/{self.fast_path_parser.attempts})"
+            )
 
         return order
 
     async def _initialize_order(
-        self, user_input: str = "", add_system_msg: str = ""
+        self, user_input: str = "", add_system_msg: str = "", keep_order: bool = False
     ) -> Order:
         logger.debug(f"\nInitialize user input: \n {user_input}\n")
 
+        if self.use_fast_path and user_input and not add_system_msg:
+            order = self._fast_path_order(user_input)
+            if order is not None:
+                logger.debug(lambda: f"Fast path Order: \n {order} \n")
+                self.order = order
+                return order
+
+        # A new order starts with no lines, a retry after an error keeps the
+        # lines from the last reply that applied cleanly
+        if not keep_order or self.order is None:
+            self.order = Order(menu=self.menu)
         response = await self.get_func_completion_res_with_waiting(
             add_user_msg=user_input,
             add_system_msg=add_system_msg,
             fn_name="process_user_order",
             with_message_history=True,
+            on_stream_field=self.get_stream_fields(),
         )
-        logger.debug(f"API response: \n{response}\n")
+        logger.debug(lambda: f"API response: \n{response}\n")
 
-        order = Order.from_api_response(response, self.menu)
-        logger.debug(f"Input Order: \n {order} \n")
+        order = self.parse_order(response)
+        self.prefetch_order_speech(order)
+        logger.debug(lambda: f"Input Order: \n {order} \n")
 
         return order
 
-    async def _reinitialize_after_error(self) -> Order:
-        self.communicate(
-            "Sorry, something went wrong processing your request. "
-            + random.choice(get_generic_order_waiting_phrases())
+    def _fast_path_order(self, user_input: str) -> Order | None:
+        lines = self.fast_path_parser.parse(user_input)
+        if not lines:
+            return None
+
+        order = Order(
+            menu=self.menu,
+            human_response=random.choice(get_fast_path_confirmation_phrases()),
+            menu_items=[
+                {
+                    Item.NAME: self.menu.index.display_name(line.entry),
+                    Item.QAUNTITY: line.quantity,
+                    Item.DETAILS: [],
+                }
+                for line in lines
+            ],
+            is_completed=True,
+        )
+
+        # Keep the locally parsed order in the conversation so later turns
+        # handled by the model know what was already ordered
+        self.add_user_message(user_input)
+        self.add_system_message(
+            f"{ORDER_STATE_PREFIX} {order.get_human_order_summary(speech_only=True)}"
         )
-        order = await self._initialize_order(
-            add_system_msg="There was an issue processing the order up to this point, it must be retried."
+        return order
+
+    async def _reinitialize_after_error(self) -> Order:
+        await self.communicate(
+            get_processing_error_message(
+                random.choice(get_generic_order_waiting_phrases())
+            )
         )
+        retry_msg = "There was an issue processing the order up to this point, it must be retried."
+        if self.order is not None:
+            retry_msg += f" {get_order_lines_message(self.order)}"
+        order = await self._initialize_order(add_system_msg=retry_msg, keep_order=True)
         return order
 
     async def _clarify_order(self, order: Order) -> Order:
-        if not order.menu_items:
-            retry_input = self.communicate(
+        if not order.processed_order:
+            retry_input = await self.communicate(
                 order.human_response,
                 get_response=True,
             )
             order = await self._initialize_order(retry_input)
         else:
-            user_clar_input = self.communicate(
+            user_clar_input = await self.communicate(
                 order.human_response,
                 get_response=True,
                 display_summary=order.get_human_order_summary(),
@@ -427,16 +790,18 @@ class SalesAgent(AbstractAgent):
                 add_system_msg=self.get_clarification_message(order),
                 fn_name="clarify_user_order",
                 with_message_history=True,
+                on_stream_field=self.get_stream_fields(),
             )
-            logger.debug(f"API response: \n{response}\n")
+            logger.debug(lambda: f"API response: \n{response}\n")
 
-            order = Order.from_api_response(response, self.menu)
-            logger.debug(f"Clarified Order: \n {order} \n")
+            order = self.parse_order(response)
+            self.prefetch_order_speech(order)
+            logger.debug(lambda: f"Clarified Order: \n {order} \n")
 
         return order
 
     async def _finalize_order(self, order: Order) -> Order:
-        final_response = self.communicate(
+        final_response = await self.communicate(
             order.human_response,
             display_summary=order.get_human_order_summary(),
             speech_summary=order.get_human_order_summary(speech_only=True),
@@ -448,21 +813,44 @@ class SalesAgent(AbstractAgent):
             add_system_msg=self.get_finalization_message(order),
             fn_name="finalize_user_order",
             with_message_history=True,
+            on_stream_field=self.get_stream_fields(),
         )
-        logger.debug(f"Finalization API response: \n{response}\n")
+        logger.debug(lambda: f"Finalization API response: \n{response}\n")
 
-        finalized_order = Order.from_api_response(response, self.menu)
-        logger.debug(f"Finalized Order: \n {finalized_order} \n")
+        finalized_order = self.parse_order(response)
+        self.prefetch_order_speech(finalized_order)
+        logger.debug(lambda: f"Finalized Order: \n {finalized_order} \n")
 
         return finalized_order
 
+    def parse_order(self, response) -> Order:
+        with span("parse_order") as parse_span:
+            delta = OrderDelta.from_api_response(response)
+            order = self.order.apply(delta)
+            parse_span.set(
+                operations=len(delta.operations), items=len(order.processed_order)
+            )
+        return order
+
+    def get_stream_fields(self) -> Dict | None:
+        # Speech for the reply starts synthesizing as soon as the model has
+        # written human_response, while the rest of the order still streams
+        if not self.stream_responses:
+            return None
+        return {Order.HUMAN_RESPONSE: self.prefetch_speech}
+
+    def prefetch_order_speech(self, order: Order):
+        self.prefetch_speech(order.human_response)
+        if order.is_complete():
+            self.prefetch_speech(order.get_human_order_summary(speech_only=True))
+
     def get_display_summary(self, order: Order) -> str:
         return f"{'='*80}\n" + f"{order.get_human_order_summary()} \n" + f"{'='*80}\n"
 
     def get_finalization_message(self, order: Order) -> str:
         msg = (
-            f"It seems the following order has been clarified, now we need to finalize it "
-            f"with the user: \n\n '{order.get_human_order_summary()}'"
+            f"It seems the order has been clarified, now we need to finalize it "
+            f"with the user. {get_order_lines_message(order)}"
         )
 
         return msg
@@ -470,10 +858,9 @@ class SalesAgent(AbstractAgent):
     def get_clarification_message(self, order: Order) -> str:
         msg = (
             f"Some items were not understood correctly or the users order was ambiguous. "
-            f"The current order is: "
-            f"\n\n {order.get_human_order_summary() if order.menu_items else ''} \n\n"
             f"The items mentioned that were not recognized are: "
-            f"\n\{human_item_list(order.unrecognized_items)}. \n"
+            f"\n\{human_item_list(order.unrecognized_items)}. \n\n"
+            f"{get_order_lines_message(order)}"
         )
 
         return msg
@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+from array import array
+from dataclasses import dataclass, field
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from models.menu_index import MenuEntry, MenuIndex, iter_menu_addons, normalize_name
+
+CENT = Decimal("0.01")
+
+_PRICE_BOOK_CACHE: Dict[str, "PriceBook"] = {}
+
+
+def to_cents(price: Optional[float]) -> int:
+    """Exact cents of a menu price, read from its shortest decimal form so
+    that 17.65 is 1765 and not one cent off from its binary float."""
+    if price is None:
+        return 0
+    return int(Decimal(repr(float(price))).quantize(CENT, ROUND_HALF_UP) * 100)
+
+
+def from_cents(cents: int) -> Decimal:
+    return Decimal(cents).scaleb(-2)
+
+
+def _detail_keys(entry: MenuEntry, name: str) -> Iterator[str]:
+    key = normalize_name(name)
+    yield key
+    # "Sm Cheese" on Cheese is also just "sm"
+    item_words = set(entry.key.split())
+    short_key = " ".join(w for w in key.split() if w not in item_words)
+    if short_key and short_key != key:
+        yield short_key
+
+
+@dataclass
+class PriceBook:
+    """Every price of a menu in cents, looked up by entry id and normalized
+    detail name. Priced options replace the item price, the most expensive
+    one when several are picked, and add ons are added to it. Details that
+    are not on the menu, like "toasted", are free."""
+
+    base_cents: array = field(default_factory=lambda: array("q"))
+    options: List[Dict[str, int]] = field(default_factory=list)
+    addons: List[Dict[str, int]] = field(default_factory=list)
+
+    def unit_cents(self, entry_id: int, details: Iterable[str] = ()) -> int:
+        options, addons = self.options[entry_id], self.addons[entry_id]
+        if not (options or addons):
+            return self.base_cents[entry_id]
+
+        option_cents = None
+        addon_cents = 0
+        for detail in details:
+            key = normalize_name(detail)
+            if key in options:
+                option_cents = max(option_cents or 0, options[key])
+            elif key in addons:
+                addon_cents += addons[key]
+
+        if option_cents is None:
+            option_cents = self.base_cents[entry_id]
+        return option_cents + addon_cents
+
+    @classmethod
+    def from_menu(cls, index: MenuIndex, full_detail: dict) -> PriceBook:
+        menu_addons = [
+            (normalize_name(category), name, to_cents(price))
+            for category, name, price in iter_menu_addons(full_detail)
+        ]
+
+        book = cls()
+        for entry in index:
+            options, addons = {}, {}
+            for name, price in entry.details:
+                # Unpriced details are notes, not options
+                if price:
+                    for key in _detail_keys(entry, name):
+                        options.setdefault(key, to_cents(price))
+
+            categories = {normalize_name(category) for category in entry.path}
+            priced_addons = [(name, to_cents(price)) for name, price in entry.addons]
+            priced_addons += [
+                (name, cents)
+                for category, name, cents in menu_addons
+                if not category or category in categories
+            ]
+            for name, cents in priced_addons:
+                for key in _detail_keys(entry, name):
+                    addons.setdefault(key, cents)
+
+            book.base_cents.append(to_cents(entry.price))
+            book.options.append(options)
+            book.addons.append(addons)
+        return book
+
+
+def compile_price_book(
+    index: MenuIndex, full_detail: dict, content_hash: str
+) -> PriceBook:
+    book = _PRICE_BOOK_CACHE.get(content_hash)
+    if book is None:
+        book = _PRICE_BOOK_CACHE[content_hash] = PriceBook.from_menu(
+            index, full_detail
+        )
+    return book
+
+
+def cache_price_book(content_hash: str, book: PriceBook):
+    _PRICE_BOOK_CACHE[content_hash] = book
+
+
+def evict_price_book(content_hash: str):
+    _PRICE_BOOK_CACHE.pop(content_hash, None)
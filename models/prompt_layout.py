@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass, field
+from typing import Dict, List, Sequence
+
+from utils.tokens import count_tokens
+
+_BUILDER_CACHE: Dict[int, "CompletionRequestBuilder"] = {}
+
+
+def canonicalize(value):
+    # Equal definitions serialize to the same bytes however they were built
+    return json.loads(json.dumps(value, sort_keys=True))
+
+
+@dataclass
+class CompletionRequestBuilder:
+    """Keeps tools, system prompt and earlier history as a byte identical,
+    provider cacheable prefix with per turn state at the end."""
+
+    functions: Dict[str, Dict]
+    tools: List[Dict] = field(init=False)
+    # Token counts of the tools by model
+    _tool_tokens: Dict[str, int] = field(init=False, default_factory=dict)
+
+    def __post_init__(self):
+        self.tools = [
+            {"type": "function", "function": canonicalize(self.functions[name])}
+            for name in sorted(self.functions)
+        ]
+
+    def tool_tokens(self, model: str) -> int:
+        tokens = self._tool_tokens.get(model)
+        if tokens is None:
+            tokens = self._tool_tokens[model] = count_tokens(
+                json.dumps(self.tools), model
+            )
+        return tokens
+
+    def build(
+        self,
+        system_message: Dict,
+        history: Sequence[Dict],
+        fn_name: str,
+        volatile_messages: Sequence[Dict] = (),
+    ) -> Dict:
+        if fn_name not in self.functions:
+            raise KeyError(f"Unknown function: {fn_name}")
+
+        return {
+            "messages": [system_message, *history, *volatile_messages],
+            # Every tool is always sent and the call is selected through
+            # tool_choice, so switching functions keeps the prefix intact
+            "tools": self.tools,
+            "tool_choice": {"type": "function", "function": {"name": fn_name}},
+        }
+
+
+def get_request_builder(functions: Dict[str, Dict]) -> CompletionRequestBuilder:
+    builder = _BUILDER_CACHE.get(id(functions))
+    if builder is None or builder.functions is not functions:
+        builder = _BUILDER_CACHE[id(functions)] = CompletionRequestBuilder(functions)
+    return builder
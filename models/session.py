@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import asyncio
+import random
+from dataclasses import dataclass, field
+from typing import Dict
+
+import speech_recognition as sr
+
+from models.base import NoInputException
+from models.ordering import SalesAgent, logger
+from utils.audio import PCM_SAMPLE_RATE, BufferedAudio
+from utils.frames import decode_audio, encode_audio, read_frame, write_frame
+from utils.speech import stream_speech_async
+from utils.stt import DEFAULT_STT_BACKEND, get_speech_to_text
+from utils.ux import get_generic_requests_to_repeat_order
+
+DEFAULT_CLIENT_SAMPLE_RATE = 16000
+DEFAULT_CLIENT_SAMPLE_WIDTH = 2
+
+
+class SessionChannel:
+    """One client connection, speaking the JSON lines frame protocol.
+
+    Server to client: say, audio, audio_end, listen, done, error.
+    Client to server: start, text, audio, end.
+    """
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        stt_backend: str = DEFAULT_STT_BACKEND,
+    ):
+        self.reader = reader
+        self.writer = writer
+        self.stt_backend = stt_backend
+        self.speech_to_text = None
+        self.wants_audio = False
+        self._write_lock = asyncio.Lock()
+
+    async def send(self, frame_type: str, **fields):
+        async with self._write_lock:
+            await write_frame(self.writer, frame_type, **fields)
+
+    async def receive(self) -> Dict:
+        return await read_frame(self.reader)
+
+    async def receive_input(self) -> str | None:
+        await self.send("listen")
+        while True:
+            frame = await self.receive()
+            if frame["type"] == "text":
+                return frame.get("text") or None
+            if frame["type"] == "audio":
+                return await self.transcribe(frame)
+            if frame["type"] == "end":
+                raise ConnectionError("Client ended the session")
+            logger.debug(f"Ignoring unexpected frame while listening: {frame['type']}")
+
+    async def transcribe(self, frame: Dict) -> str | None:
+        if self.speech_to_text is None:
+            self.speech_to_text = get_speech_to_text(self.stt_backend)
+
+        audio = sr.AudioData(
+            decode_audio(frame["data"]),
+            frame.get("sample_rate", DEFAULT_CLIENT_SAMPLE_RATE),
+            frame.get("sample_width", DEFAULT_CLIENT_SAMPLE_WIDTH),
+        )
+        transcript = await asyncio.to_thread(self.speech_to_text.transcribe, audio)
+        logger.debug(
+            f"Remote audio recognized by {transcript.backend} "
+            f"in {transcript.latency * 1000:.0f}ms: {transcript.text}"
+        )
+        return transcript.text
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+@dataclass
+class SessionAgent(SalesAgent):
+    """A SalesAgent whose customer is on the other end of a SessionChannel
+    instead of the local microphone, speaker and terminal."""
+
+    channel: SessionChannel = field(kw_only=True, default=None)
+    use_speech_input: bool = False
+
+    def __post_init__(self, *args, **kwargs):
+        super().__post_init__(*args, **kwargs)
+        self.use_ui_spinners = False
+        self.prewarm_stock_speech = self.channel.wants_audio
+
+    async def adjust_for_ambient_noise_task(self):
+        # The client owns the microphone
+        pass
+
+    def prefetch_speech(self, text: str):
+        if self.channel.wants_audio:
+            super().prefetch_speech(text)
+
+    async def say(self, text: str, blocking=True):
+        if not self.channel.wants_audio:
+            return
+
+        prefetched = self.prefetched_speech.pop(text, None)
+        if isinstance(prefetched, BufferedAudio):
+            chunks = prefetched
+            audio_format = "pcm"
+        elif prefetched is not None:
+            chunks = _iter_chunks(await prefetched)
+            audio_format = "mp3"
+        else:
+            chunks = stream_speech_async(
+                self.async_client, text, voice_selection=self.voice_selection
+            )
+            audio_format = "pcm"
+
+        async for chunk in chunks:
+            await self.channel.send(
+                "audio",
+                data=encode_audio(chunk),
+                format=audio_format,
+                sample_rate=PCM_SAMPLE_RATE,
+            )
+        await self.channel.send("audio_end", text=text)
+
+    async def communicate(
+        self,
+        msg: str = "",
+        get_response=False,
+        display_summary: str = "",
+        speech_summary: str = "",
+        add_to_message_history=True,
+        with_ui_spinner=True,
+        speech_blocking=True,
+    ) -> str | None:
+        if msg:
+            await self.channel.send("say", text=msg, display=msg + display_summary)
+            if msg in self.prefetched_speech:
+                await self.say(msg)
+                if speech_summary:
+                    await self.say(speech_summary)
+            else:
+                await self.say(msg + speech_summary)
+
+        if msg and add_to_message_history:
+            self.add_agent_message(msg)
+
+        if get_response:
+            for _ in range(self.max_no_input_retries):
+                response = await self.channel.receive_input()
+                if response:
+                    self.next_turn()
+                    logger.info(f"user response: {response}")
+                    return response
+
+                err_msg = random.choice(get_generic_requests_to_repeat_order())
+                await self.channel.send("say", text=err_msg, display=err_msg)
+                await self.say(err_msg)
+
+            raise NoInputException("No input detected after max retries")
+
+
+async def _iter_chunks(audio: bytes, chunk_size: int = 64 * 1024):
+    for i in range(0, len(audio), chunk_size):
+        yield audio[i : i + chunk_size]
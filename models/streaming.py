@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import Callable, Dict, List
+
+from utils.json_stream import IncrementalJsonFieldExtractor
+
+
+@dataclass
+class ToolCallStreamAccumulator:
+    """Rebuilds a tool call completion from streamed chunks, reporting chosen
+    string arguments through on_field as soon as each one is complete."""
+
+    on_field: Dict[str, Callable[[str], None]] = field(default_factory=dict)
+    extractor: IncrementalJsonFieldExtractor = field(init=False)
+    arguments: List[str] = field(init=False, default_factory=list)
+    tool_call_id: str = field(init=False, default=None)
+    function_name: str = field(init=False, default=None)
+    finish_reason: str = field(init=False, default=None)
+    model: str = field(init=False, default=None)
+    usage: object = field(init=False, default=None)
+
+    def __post_init__(self):
+        self.extractor = IncrementalJsonFieldExtractor(self.on_field.keys())
+
+    def add_chunk(self, chunk):
+        self.model = chunk.model or self.model
+        if chunk.usage is not None:
+            self.usage = chunk.usage
+
+        for choice in chunk.choices:
+            self.finish_reason = choice.finish_reason or self.finish_reason
+            for tool_call in choice.delta.tool_calls or []:
+                # Only the first tool call is used by from_api_response
+                if tool_call.index != 0:
+                    continue
+                self.tool_call_id = tool_call.id or self.tool_call_id
+                if tool_call.function is None:
+                    continue
+                self.function_name = tool_call.function.name or self.function_name
+                if tool_call.function.arguments:
+                    self._add_arguments(tool_call.function.arguments)
+
+    def _add_arguments(self, arguments: str):
+        self.arguments.append(arguments)
+        for name, value in self.extractor.feed(arguments).items():
+            self.on_field[name](value)
+
+    def to_completion(self):
+        tool_call = SimpleNamespace(
+            id=self.tool_call_id,
+            type="function",
+            function=SimpleNamespace(
+                name=self.function_name, arguments="".join(self.arguments)
+            ),
+        )
+        message = SimpleNamespace(role="assistant", content=None, tool_calls=[tool_call])
+        return SimpleNamespace(
+            model=self.model,
+            choices=[
+                SimpleNamespace(
+                    index=0, message=message, finish_reason=self.finish_reason
+                )
+            ],
+            usage=self.usage,
+        )
@@ -1,11 +1,19 @@
 import argparse
+import asyncio
 import json
 
-from models.api import ApiVoices
-from models.base import DEFAULT_API_VOICE
+from client import run_client
+from models.api import ApiModels, ApiVoices
+from models.base import DEFAULT_API_MODEL, DEFAULT_API_VOICE, record_api, replay_api
+from models.menu_encoding import DEFAULT_MENU_ENCODING, MenuEncoding
 from models.ordering import DEFAULT_PERSONALITY_MODIFIER, Menu, SalesAgent, logger
+from utils.metering import configure_metering
+from utils.speech import set_barge_in
+from utils.stt import DEFAULT_STT_BACKEND, STT_BACKENDS
+from utils.tracing import DEFAULT_TRACE_FORMAT, SPAN_EXPORTERS, configure_tracing
 
 TEST_MENU_DIR = "tests/test_menus"
+RECORDING_DIR = "tests/recordings"
 
 
 def main():
@@ -16,11 +24,89 @@ def main():
         default="archies_deli",
         help="The menu file to use (default: archies_deli)",
     )
+    parser.add_argument(
+        "--server",
+        type=str,
+        default=None,
+        help="host:port of an order server to order through instead of running the agent locally",
+    )
     parser.add_argument(
         "--mock",
         type=bool,
         default=False,
-        help="Whether to use the mock API response (default: False)",
+        help="Whether to replay recorded API responses instead of calling the API (default: False)",
+    )
+    parser.add_argument(
+        "--record",
+        type=bool,
+        default=False,
+        help="Whether to record every API request and response for later replay (default: False)",
+    )
+    parser.add_argument(
+        "--recording",
+        type=str,
+        default=None,
+        help=f"Recording file to replay or record into (default: {RECORDING_DIR}/<menu_name>.jsonl)",
+    )
+    parser.add_argument(
+        "--mock_latency",
+        type=str,
+        default="recorded",
+        help="Replayed response latency, recorded or a distribution like lognormal:-0.7,0.4 (default: recorded)",
+    )
+    parser.add_argument(
+        "--mock_chunk_latency",
+        type=str,
+        default="recorded",
+        help="Delay between replayed stream chunks, same format as --mock_latency (default: recorded)",
+    )
+    parser.add_argument(
+        "--trace",
+        type=bool,
+        default=False,
+        help="Whether to time listening, completions, parsing, speech and playback as spans (default: False)",
+    )
+    parser.add_argument(
+        "--trace_file",
+        type=str,
+        default=None,
+        help="File spans are appended to, turns on --trace (default: None)",
+    )
+    parser.add_argument(
+        "--trace_format",
+        choices=list(SPAN_EXPORTERS),
+        default=DEFAULT_TRACE_FORMAT,
+        help=f"Format of the trace file, otlp is OpenTelemetry JSON (default: {DEFAULT_TRACE_FORMAT})",
+    )
+    parser.add_argument(
+        "--session_budget",
+        type=str,
+        default=None,
+        help="Soft and hard USD budget per session as soft,hard, past soft completions use --budget_model (default: None)",
+    )
+    parser.add_argument(
+        "--restaurant_budget",
+        type=str,
+        default=None,
+        help="Soft and hard USD budget per restaurant as soft,hard (default: None)",
+    )
+    parser.add_argument(
+        "--daily_budget",
+        type=str,
+        default=None,
+        help="Soft and hard USD budget per day as soft,hard (default: None)",
+    )
+    parser.add_argument(
+        "--budget_model",
+        choices=[m.value for m in ApiModels],
+        default=ApiModels.GPT3_5.value,
+        help=f"Cheaper model used past a soft budget (default: {ApiModels.GPT3_5.value})",
+    )
+    parser.add_argument(
+        "--usage_file",
+        type=str,
+        default=None,
+        help="File every priced API request is appended to (default: None)",
     )
     parser.add_argument(
         "--speech_input",
@@ -28,12 +114,30 @@ def main():
         default=False,
         help="Whether or not activate speech recognition responses (default: False)",
     )
+    parser.add_argument(
+        "--stt_backend",
+        choices=list(STT_BACKENDS),
+        default=DEFAULT_STT_BACKEND,
+        help="Speech to text engine used with speech input, vosk runs locally",
+    )
+    parser.add_argument(
+        "--barge_in",
+        type=bool,
+        default=False,
+        help="Whether speaking over the agent interrupts it, best with a headset (default: False)",
+    )
     parser.add_argument(
         "--log_level",
         type=int,
         default=1,
         help="The logging level (default: 1/DEBUG)",
     )
+    parser.add_argument(
+        "--fast_path",
+        type=bool,
+        default=False,
+        help="Whether to parse simple orders locally before calling the API (default: False)",
+    )
     parser.add_argument(
         "--personality",
         type=str,
@@ -46,20 +150,69 @@ def main():
         default=DEFAULT_API_VOICE,
         help="Voice selection for agent when interation with users",
     )
+    parser.add_argument(
+        "--menu_encoding",
+        choices=[e.value for e in MenuEncoding],
+        default=DEFAULT_MENU_ENCODING,
+        help="How the menu is written into the agent prompt",
+    )
 
     args = parser.parse_args()
 
     logger.set_level(args.log_level)
 
+    if args.trace or args.trace_file:
+        configure_tracing(args.trace_file, args.trace_format)
+
+    configure_metering(
+        args.session_budget,
+        args.restaurant_budget,
+        args.daily_budget,
+        args.budget_model,
+        args.usage_file,
+    )
+
+    recording = args.recording or f"{RECORDING_DIR}/{args.menu_name}.jsonl"
+    if args.mock:
+        replay_api(recording, args.mock_latency, args.mock_chunk_latency)
+    elif args.record:
+        record_api(recording)
+
+    if args.server:
+        host, port = args.server.rsplit(":", 1)
+        asyncio.run(
+            run_client(
+                host,
+                int(port),
+                menu_name=args.menu_name,
+                voice=args.voice,
+                personality=args.personality,
+                use_speech_input=args.speech_input,
+                use_speech_output=args.speech_input,
+                stt_backend=args.stt_backend,
+            )
+        )
+        return
+
     menu = Menu.from_file(args.menu_name)
-    logger.info(f"Menu: {json.dumps(menu.full_detail, indent=4)} \n")
+    logger.info(lambda: f"Menu: {json.dumps(menu.full_detail, indent=4)} \n")
+    logger.info(
+        lambda: f"Menu prompt tokens by encoding: {menu.encoding_report(DEFAULT_API_MODEL)} \n"
+    )
 
     sales_agent = SalesAgent(
         menu,
         use_speech_input=args.speech_input,
+        stt_backend=args.stt_backend,
+        barge_in=args.barge_in,
         personality_modifier=args.personality,
         voice_selection=args.voice,
+        use_fast_path=args.fast_path,
+        menu_encoding=args.menu_encoding,
     )
+    # The microphone belongs to this process, so its barge in detection
+    # follows the one local agent
+    set_barge_in(sales_agent.barge_in)
 
     sales_agent.process_order()
 
@@ -0,0 +1,304 @@
+import argparse
+import asyncio
+import itertools
+from dataclasses import asdict
+from typing import Dict
+
+from models.api import ApiModels, ApiVoices
+from models.base import DEFAULT_API_VOICE, record_api, replay_api
+from models.menu_encoding import DEFAULT_MENU_ENCODING, MenuEncoding
+from models.menu_registry import (
+    DEFAULT_MAX_MENUS,
+    DEFAULT_RELOAD_INTERVAL,
+    MenuRegistry,
+)
+from models.ordering import DEFAULT_PERSONALITY_MODIFIER, logger
+from models.session import SessionAgent, SessionChannel
+from utils.api_scheduler import api_scheduler_metrics
+from utils.frames import FRAME_LIMIT, FrameError
+from utils.metering import configure_metering, get_usage_meter
+from utils.stt import DEFAULT_STT_BACKEND, STT_BACKENDS
+from utils.tracing import DEFAULT_TRACE_FORMAT, SPAN_EXPORTERS, configure_tracing
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_MAX_SESSIONS = 500
+DEFAULT_MENU_NAME = "archies_deli"
+DEFAULT_RECORDING = f"tests/recordings/{DEFAULT_MENU_NAME}.jsonl"
+
+
+class OrderServer:
+    """Hosts many concurrent ordering sessions in one process. Menus, kept
+    by the registry, and the API clients are shared, each session keeps its
+    own history and usage."""
+
+    def __init__(
+        self,
+        max_sessions: int = DEFAULT_MAX_SESSIONS,
+        stt_backend: str = DEFAULT_STT_BACKEND,
+        menu_encoding: str = DEFAULT_MENU_ENCODING,
+        use_fast_path: bool = False,
+        menus: MenuRegistry = None,
+    ):
+        self.max_sessions = max_sessions
+        self.stt_backend = stt_backend
+        self.menu_encoding = menu_encoding
+        self.use_fast_path = use_fast_path
+        self.menus = menus or MenuRegistry()
+        self.sessions: Dict[int, SessionAgent] = {}
+        self.connections = 0
+        self._session_ids = itertools.count(1)
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        session_id = next(self._session_ids)
+        channel = SessionChannel(reader, writer, stt_backend=self.stt_backend)
+        self.connections += 1
+        try:
+            if self.connections > self.max_sessions:
+                await channel.send("error", message="Server is at capacity")
+                return
+
+            start = await channel.receive()
+            if start["type"] != "start":
+                raise FrameError(f"Expected a start frame, got {start['type']}")
+
+            agent = await self.create_agent(start, channel)
+            self.sessions[session_id] = agent
+            logger.info(
+                f"Session {session_id} started as {agent.session_id}, "
+                f"{len(self.sessions)} active",
+                session_id=agent.session_id,
+                active_sessions=len(self.sessions),
+            )
+            await channel.send("ready", session=session_id)
+
+            order = await agent.process_order_async()
+            await channel.send(
+                "done",
+                summary=order.get_human_order_summary() if order else None,
+                total_price=float(order.total_price) if order else None,
+                usage=asdict(agent.usage_data),
+                cost=get_usage_meter().session_totals(agent.session_id),
+            )
+        except (FrameError, ValueError, FileNotFoundError) as e:
+            logger.debug(f"Session {session_id} rejected: {e}")
+            await self._send_error(channel, str(e))
+        except ConnectionError as e:
+            logger.debug(f"Session {session_id} disconnected: {e}")
+        except Exception as e:
+            logger.error(f"Session {session_id} failed: {e!r}")
+            await self._send_error(channel, "Internal error")
+        finally:
+            self.connections -= 1
+            agent = self.sessions.pop(session_id, None)
+            if agent is not None:
+                cost = get_usage_meter().end_session(agent.session_id)
+                logger.info(
+                    f"Session {session_id} ended, usage: {agent.usage_data}, "
+                    f"cost: ${cost['cost']:.4f}, {len(self.sessions)} active",
+                    session_id=agent.session_id,
+                    usage=asdict(agent.usage_data),
+                    cost=cost["cost"],
+                    active_sessions=len(self.sessions),
+                )
+                logger.debug(lambda: f"API scheduler metrics: {api_scheduler_metrics()}")
+            await channel.close()
+
+    async def create_agent(
+        self, start: Dict, channel: SessionChannel
+    ) -> SessionAgent:
+        voice = start.get("voice", DEFAULT_API_VOICE)
+        if voice not in {v.value for v in ApiVoices}:
+            raise ValueError(f"Unknown voice: {voice}")
+
+        menu = await self.menus.get(start.get("menu", DEFAULT_MENU_NAME))
+        channel.wants_audio = bool(start.get("audio", False))
+        return SessionAgent(
+            menu,
+            channel=channel,
+            personality_modifier=start.get(
+                "personality", DEFAULT_PERSONALITY_MODIFIER
+            ),
+            voice_selection=voice,
+            use_fast_path=self.use_fast_path,
+            menu_encoding=self.menu_encoding,
+        )
+
+    async def _send_error(self, channel: SessionChannel, message: str):
+        try:
+            await channel.send("error", message=message)
+        except ConnectionError:
+            pass
+
+    async def serve(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+        server = await asyncio.start_server(
+            self.handle_connection, host, port, limit=FRAME_LIMIT
+        )
+        logger.info(f"Order server listening on {host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve ordering sessions.")
+    parser.add_argument("--host", type=str, default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--max_sessions",
+        type=int,
+        default=DEFAULT_MAX_SESSIONS,
+        help=f"Concurrent sessions before new ones are turned away (default: {DEFAULT_MAX_SESSIONS})",
+    )
+    parser.add_argument(
+        "--max_menus",
+        type=int,
+        default=DEFAULT_MAX_MENUS,
+        help=f"Menus kept loaded, the least recently used are unloaded past it (default: {DEFAULT_MAX_MENUS})",
+    )
+    parser.add_argument(
+        "--menu_reload_interval",
+        type=float,
+        default=DEFAULT_RELOAD_INTERVAL,
+        help=f"Seconds between checks for edited menu files, 0 to never reload (default: {DEFAULT_RELOAD_INTERVAL})",
+    )
+    parser.add_argument(
+        "--stt_backend",
+        choices=list(STT_BACKENDS),
+        default=DEFAULT_STT_BACKEND,
+        help="Speech to text engine for audio sent by clients",
+    )
+    parser.add_argument(
+        "--menu_encoding",
+        choices=[e.value for e in MenuEncoding],
+        default=DEFAULT_MENU_ENCODING,
+        help="How the menu is written into the agent prompt",
+    )
+    parser.add_argument(
+        "--fast_path",
+        type=bool,
+        default=False,
+        help="Whether to parse simple orders locally before calling the API (default: False)",
+    )
+    parser.add_argument(
+        "--mock",
+        type=bool,
+        default=False,
+        help="Whether to replay recorded API responses instead of calling the API (default: False)",
+    )
+    parser.add_argument(
+        "--record",
+        type=bool,
+        default=False,
+        help="Whether to record every API request and response for later replay (default: False)",
+    )
+    parser.add_argument(
+        "--recording",
+        type=str,
+        default=DEFAULT_RECORDING,
+        help=f"Recording file to replay or record into (default: {DEFAULT_RECORDING})",
+    )
+    parser.add_argument(
+        "--mock_latency",
+        type=str,
+        default="recorded",
+        help="Replayed response latency, recorded or a distribution like lognormal:-0.7,0.4 (default: recorded)",
+    )
+    parser.add_argument(
+        "--mock_chunk_latency",
+        type=str,
+        default="recorded",
+        help="Delay between replayed stream chunks, same format as --mock_latency (default: recorded)",
+    )
+    parser.add_argument(
+        "--trace",
+        type=bool,
+        default=False,
+        help="Whether to time listening, completions, parsing, speech and playback as spans (default: False)",
+    )
+    parser.add_argument(
+        "--trace_file",
+        type=str,
+        default=None,
+        help="File spans are appended to, turns on --trace (default: None)",
+    )
+    parser.add_argument(
+        "--trace_format",
+        choices=list(SPAN_EXPORTERS),
+        default=DEFAULT_TRACE_FORMAT,
+        help=f"Format of the trace file, otlp is OpenTelemetry JSON (default: {DEFAULT_TRACE_FORMAT})",
+    )
+    parser.add_argument(
+        "--session_budget",
+        type=str,
+        default=None,
+        help="Soft and hard USD budget per session as soft,hard, past soft completions use --budget_model (default: None)",
+    )
+    parser.add_argument(
+        "--restaurant_budget",
+        type=str,
+        default=None,
+        help="Soft and hard USD budget per restaurant as soft,hard (default: None)",
+    )
+    parser.add_argument(
+        "--daily_budget",
+        type=str,
+        default=None,
+        help="Soft and hard USD budget per day as soft,hard (default: None)",
+    )
+    parser.add_argument(
+        "--budget_model",
+        choices=[m.value for m in ApiModels],
+        default=ApiModels.GPT3_5.value,
+        help=f"Cheaper model used past a soft budget (default: {ApiModels.GPT3_5.value})",
+    )
+    parser.add_argument(
+        "--usage_file",
+        type=str,
+        default=None,
+        help="File every priced API request is appended to (default: None)",
+    )
+    parser.add_argument(
+        "--log_level",
+        type=int,
+        default=2,
+        help="The logging level (default: 2/INFO)",
+    )
+
+    args = parser.parse_args()
+
+    logger.set_level(args.log_level)
+
+    if args.trace or args.trace_file:
+        configure_tracing(args.trace_file, args.trace_format)
+
+    configure_metering(
+        args.session_budget,
+        args.restaurant_budget,
+        args.daily_budget,
+        args.budget_model,
+        args.usage_file,
+    )
+
+    if args.mock:
+        replay_api(args.recording, args.mock_latency, args.mock_chunk_latency)
+    elif args.record:
+        record_api(args.recording)
+
+    menus = MenuRegistry(max_menus=args.max_menus)
+    if args.menu_reload_interval > 0:
+        menus.start_watching(args.menu_reload_interval)
+
+    order_server = OrderServer(
+        max_sessions=args.max_sessions,
+        stt_backend=args.stt_backend,
+        menu_encoding=args.menu_encoding,
+        use_fast_path=args.fast_path,
+        menus=menus,
+    )
+    asyncio.run(order_server.serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+from utils.json_stream import IncrementalJsonFieldExtractor
+
+ARGUMENTS = json.dumps(
+    {
+        "menu_items": [{"name": "Latte", "quantity": 1, "details": ["oat milk"]}],
+        "response_to_customer": 'One "latte", anything else?',
+        "notes": "none",
+    }
+)
+
+
+def feed_in_chunks(extractor, text, size):
+    completed = {}
+    for i in range(0, len(text), size):
+        chunk = extractor.feed(text[i : i + size])
+        assert not completed.keys() & chunk.keys(), "a field was returned twice"
+        completed.update(chunk)
+    return completed
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, len(ARGUMENTS)])
+def test_fields_are_extracted_whatever_the_chunking(size):
+    extractor = IncrementalJsonFieldExtractor(["response_to_customer"])
+    completed = feed_in_chunks(extractor, ARGUMENTS, size)
+    assert completed == {"response_to_customer": 'One "latte", anything else?'}
+    assert extractor.completed == completed
+
+
+def test_field_is_returned_as_soon_as_its_string_closes():
+    extractor = IncrementalJsonFieldExtractor(["response_to_customer"])
+    end = ARGUMENTS.index('"notes"')
+    prefix = ARGUMENTS[:end]
+    assert extractor.feed(prefix[:-5]) == {}
+    assert extractor.feed(prefix[-5:]) == {
+        "response_to_customer": 'One "latte", anything else?'
+    }
+    assert extractor.feed(ARGUMENTS[end:]) == {}
+
+
+def test_unfinished_strings_are_not_returned():
+    extractor = IncrementalJsonFieldExtractor(["response_to_customer"])
+    assert extractor.feed('{"response_to_customer": "One lat') == {}
+    assert extractor.completed == {}
+
+
+def test_nested_strings_are_ignored():
+    extractor = IncrementalJsonFieldExtractor(["name", "response_to_customer"])
+    completed = extractor.feed(ARGUMENTS)
+    # "name" only appears inside menu_items
+    assert completed == {"response_to_customer": 'One "latte", anything else?'}
+
+
+def test_keys_are_not_mistaken_for_values():
+    extractor = IncrementalJsonFieldExtractor(["a", "b"])
+    assert extractor.feed('{"a": "b", "b": "a"}') == {"a": "b", "b": "a"}
+
+
+def test_escapes_are_decoded():
+    text = json.dumps({"reply": "tab\there, slash \\ and unicode é"})
+    extractor = IncrementalJsonFieldExtractor(["reply"])
+    assert feed_in_chunks(extractor, text, 1) == {
+        "reply": "tab\there, slash \\ and unicode é"
+    }
+
+
+def test_only_the_first_value_of_a_repeated_field_is_kept():
+    extractor = IncrementalJsonFieldExtractor(["reply"])
+    assert extractor.feed('{"reply": "first", ') == {"reply": "first"}
+    assert extractor.feed('"reply": "second"}') == {}
+    assert extractor.completed == {"reply": "first"}
+
+
+def test_non_string_values_are_skipped():
+    extractor = IncrementalJsonFieldExtractor(["count", "reply"])
+    completed = extractor.feed('{"count": 2, "flag": true, "reply": "ok"}')
+    assert completed == {"reply": "ok"}
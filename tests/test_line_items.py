@@ -0,0 +1,136 @@
+import pytest
+
+from models.line_items import LineItemTable
+
+LATTE, BAGEL = 3, 7
+
+
+def check_totals(table: LineItemTable):
+    """The kept total and line count agree with the rows."""
+    lines = table.as_dicts()
+    assert table.total_cents == sum(line["subtotal_cents"] for line in lines)
+    assert len(table) == len(lines) == len(list(table))
+    for line in lines:
+        assert line["subtotal_cents"] == line["unit_cents"] * line["quantity"]
+
+
+@pytest.fixture
+def table() -> LineItemTable:
+    table = LineItemTable()
+    table.add(LATTE, "Latte", 1, 350, ["oat milk"])
+    table.add(BAGEL, "Plain Bagel", 2, 250)
+    return table
+
+
+def test_lines_get_stable_ids(table):
+    assert list(table) == [1, 2]
+    assert table.find(LATTE, ["oat milk"]) == 1
+    assert table.find(BAGEL) == 2
+    assert table.total_cents == 850
+    check_totals(table)
+
+
+def test_ordering_the_same_thing_again_adds_to_its_line(table):
+    # Details are matched regardless of their order
+    table.add(LATTE, "Latte", 2, 350, ["oat milk"])
+    assert len(table) == 2
+    assert table.as_dicts()[0]["quantity"] == 3
+    assert table.total_cents == 3 * 350 + 500
+    check_totals(table)
+
+
+def test_different_details_are_different_lines(table):
+    assert table.add(LATTE, "Latte", 1, 350) == 3
+    assert table.add(LATTE, "Latte", 1, 400, ["extra shot", "oat milk"]) == 4
+    assert table.find(LATTE, ["oat milk", "extra shot"]) == 4
+    check_totals(table)
+
+
+def test_adding_nothing_is_rejected(table):
+    with pytest.raises(ValueError):
+        table.add(BAGEL, "Plain Bagel", 0, 250)
+    with pytest.raises(ValueError):
+        table.add(BAGEL, "Plain Bagel", -1, 250)
+    check_totals(table)
+
+
+def test_removed_lines_keep_their_id(table):
+    table.remove(1)
+    assert list(table) == [2]
+    assert 1 not in table
+    assert table.find(LATTE, ["oat milk"]) is None
+    with pytest.raises(KeyError):
+        table.set_quantity(1, 2)
+    check_totals(table)
+
+    # Ordering it again brings the same line back
+    assert table.add(LATTE, "Latte", 1, 350, ["oat milk"]) == 1
+    assert list(table) == [1, 2]
+    check_totals(table)
+
+
+def test_line_count_follows_quantities(table):
+    table.set_quantity(1, 0)
+    assert len(table) == 1
+    # Removing a line twice or setting it to zero again doesn't count twice
+    with pytest.raises(KeyError):
+        table.remove(1)
+    table.set_quantity(2, 0)
+    assert len(table) == 0
+    check_totals(table)
+
+    table.add(LATTE, "Latte", 1, 350, ["oat milk"])
+    table.add(LATTE, "Latte", 1, 350, ["oat milk"])
+    assert len(table) == 1
+    check_totals(table)
+
+
+def test_negative_quantities_remove_the_line(table):
+    table.set_quantity(2, -3)
+    assert list(table) == [1]
+    assert table.total_cents == 350
+    check_totals(table)
+
+
+def test_quantities_from_json_numbers_are_whole(table):
+    table.set_quantity(2, 3.0)
+    assert table.as_dicts()[1]["quantity"] == 3
+    check_totals(table)
+
+
+def test_changing_details_keeps_the_line_id(table):
+    assert table.set_details(1, ["almond milk"], 375) == 1
+    assert table.find(LATTE, ["almond milk"]) == 1
+    assert table.find(LATTE, ["oat milk"]) is None
+    assert table.total_cents == 375 + 500
+    check_totals(table)
+
+    # The old details are free for a new line
+    assert table.add(LATTE, "Latte", 1, 350, ["oat milk"]) == 3
+    check_totals(table)
+
+
+def test_changing_details_to_another_lines_merges_them(table):
+    table.add(LATTE, "Latte", 2, 350)
+    assert table.set_details(3, ["oat milk"], 350) == 1
+    assert list(table) == [1, 2]
+    assert table.as_dicts()[0]["quantity"] == 3
+    check_totals(table)
+
+
+def test_copies_are_independent(table):
+    copy = table.copy()
+    copy.add(BAGEL, "Plain Bagel", 1, 250)
+    copy.remove(1)
+
+    assert list(table) == [1, 2]
+    assert table.total_cents == 850
+    assert table.as_dicts()[1]["quantity"] == 2
+    check_totals(table)
+    check_totals(copy)
+
+
+def test_line_summary(table):
+    assert table.line_summary() == (
+        "line 1: 1 x Latte (oat milk)\nline 2: 2 x Plain Bagel"
+    )
@@ -0,0 +1,83 @@
+import json
+import os
+
+import pytest
+
+from models.menu_index import MenuIndex, normalize_name
+from models.menu_matcher import MenuMatcher
+
+TEST_MENU_DIR = os.path.join(os.path.dirname(__file__), "test_menus")
+
+
+def load_menu(menu_name: str) -> dict:
+    with open(os.path.join(TEST_MENU_DIR, f"{menu_name}.json")) as f:
+        return json.load(f)
+
+
+def test_normalize_name():
+    assert normalize_name("Ham & Cheese w/Egg") == "ham and cheese with egg"
+
+
+def test_items_of_the_same_name_in_different_categories_collide():
+    index = MenuIndex.from_menu_detail(
+        {"menu": {"breakfast": {"Bagel": 2.5}, "lunch": {"Bagel": 3.0}}}
+    )
+    assert index.get("bagel") is None
+    assert index.is_ambiguous("bagel")
+    assert [e.price for e in index.candidates("bagel")] == [2.5, 3.0]
+    assert index.get("lunch bagel").price == 3.0
+    assert set(index.flat_menu_items()) == {"Bagel (Breakfast)", "Bagel (Lunch)"}
+
+
+def test_rows_of_an_uncategorized_item_are_merged():
+    index = MenuIndex.from_menu_detail(
+        {
+            "menu_items": [
+                {"name": "Mac Pizza", "item_price": None},
+                {
+                    "name": "Mac Pizza",
+                    "item_price": "13.50",
+                    "details": [{"name": "Thousand Island base"}],
+                },
+                {
+                    "name": "Mac Pizza",
+                    "category": "Pizza",
+                    "options": [{"name": "Lg Mac Pizza", "detail_price": "20.50"}],
+                },
+            ]
+        }
+    )
+    assert len(index) == 1
+    entry = index.get("mac pizza")
+    assert entry.price == 13.5
+    assert entry.path == ("Pizza",)
+    assert [name for name, _ in entry.details] == [
+        "Thousand Island base",
+        "Lg Mac Pizza",
+    ]
+    assert index.get("pizza mac pizza") is entry
+
+
+@pytest.mark.parametrize(
+    "name",
+    [
+        "Chicken Cordon Blue",
+        "Mac Pizza",
+        "Deluxe Special",
+        "Buffalo Chicken",
+        "Chicken Romano",
+        "Chicken Bacon Ranch",
+    ],
+)
+def test_split_scraped_items_can_be_ordered(name):
+    index = MenuIndex.from_menu_detail(load_menu("grandslamdetailed_deli"))
+    entry = MenuMatcher(index).resolve(name)
+    assert entry is not None
+    assert entry.key == normalize_name(name)
+
+
+def test_scraped_menu_has_one_line_per_item():
+    index = MenuIndex.from_menu_detail(load_menu("grandslamdetailed_deli"))
+    assert not index.collisions
+    assert len(index.flat_menu_items()) == len(index)
+    assert [entry.id for entry in index] == list(range(len(index)))
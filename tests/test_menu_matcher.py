@@ -0,0 +1,147 @@
+import random
+
+import pytest
+
+from models.menu_index import MenuIndex
+from models.menu_matcher import (
+    MenuMatcher,
+    char_ngrams,
+    edit_similarity,
+    levenshtein,
+    match_key,
+)
+
+MENU = {
+    "restaurant": "Test Cafe",
+    "menu": {
+        "coffee": {
+            "Latte": 3.5,
+            "Mocha Latte": 4.0,
+            "Matcha Latte": 4.5,
+            "Cappuccino": 3.0,
+            "Americano": 2.5,
+        },
+        "breakfast": {
+            "Bagel with Cream Cheese": 3.0,
+            "Ham and Cheese Omelette": 8.0,
+        },
+        "lunch": {
+            "Bagel with Cream Cheese": 4.0,
+            "Turkey Club": 9.0,
+        },
+    },
+}
+
+
+def reference_levenshtein(a: str, b: str) -> int:
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(
+                min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            )
+        previous = current
+    return previous[-1]
+
+
+@pytest.fixture(scope="module")
+def matcher() -> MenuMatcher:
+    return MenuMatcher(MenuIndex.from_menu_detail(MENU))
+
+
+@pytest.mark.parametrize(
+    "a, b, distance",
+    [
+        ("", "", 0),
+        ("", "latte", 5),
+        ("latte", "", 5),
+        ("latte", "latte", 0),
+        ("latte", "latter", 1),
+        ("kitten", "sitting", 3),
+        ("mocha", "matcha", 2),
+        ("flaw", "lawn", 2),
+    ],
+)
+def test_levenshtein_known_distances(a, b, distance):
+    assert levenshtein(a, b) == distance
+    assert levenshtein(b, a) == distance
+
+
+def test_levenshtein_matches_dynamic_programming():
+    rng = random.Random(7)
+    # Longer than a machine word, the bit vectors are plain ints
+    for length in (1, 5, 17, 63, 64, 65, 130):
+        for _ in range(20):
+            a = "".join(rng.choices("abcd ", k=length))
+            b = "".join(rng.choices("abcd ", k=rng.randint(0, length + 3)))
+            assert levenshtein(a, b) == reference_levenshtein(a, b), (a, b)
+
+
+def test_edit_similarity_bounds():
+    assert edit_similarity("latte", "latte") == 1.0
+    assert edit_similarity("", "latte") == 0.0
+    assert edit_similarity("latte", "latter") == pytest.approx(1 - 1 / 6)
+
+
+def test_match_key_folds_plurals_and_shorthand():
+    assert match_key("Lattes") == "latte"
+    assert match_key("Espresso") == "espresso"
+    assert match_key("ham n cheese") == "ham and cheese"
+
+
+def test_char_ngrams_pad_the_key():
+    assert char_ngrams("ab") == [" ab", "ab "]
+    assert char_ngrams("") == ["  "]
+
+
+def test_score_all_only_scores_entries_sharing_ngrams(matcher):
+    scores = matcher.score_all("latte")
+    names = {matcher.index.entries[i].name for i in scores}
+    assert "Latte" in names
+    assert "Turkey Club" not in names
+    assert all(0 < score <= 1 for score in scores.values())
+    assert max(scores, key=scores.get) == matcher.index.get("latte").id
+
+
+def test_score_all_is_a_dice_coefficient(matcher):
+    entry_id = matcher.index.get("latte").id
+    assert matcher.score_all("latte")[entry_id] == pytest.approx(1.0)
+    assert matcher.score_all("zzzz") == {}
+
+
+def test_exact_names_match_with_full_confidence(matcher):
+    result = matcher.match("Americano")
+    assert result.entry.name == "Americano"
+    assert result.score == 1.0
+    assert result.is_confident
+
+
+def test_misspelled_names_resolve(matcher):
+    assert matcher.resolve("capuccino").name == "Cappuccino"
+    assert matcher.resolve("americanos").name == "Americano"
+
+
+def test_similar_items_are_not_confused(matcher):
+    result = matcher.match("mocca latte")
+    assert result.entry.name == "Mocha Latte"
+    assert result.runner_up.name == "Matcha Latte"
+    assert result.is_confident
+
+    # Close to both, so it goes back to the customer
+    result = matcher.match("macha latte")
+    assert result.entry.name == "Matcha Latte"
+    assert not result.is_confident
+    assert matcher.resolve("macha latte") is None
+
+
+def test_colliding_names_need_clarification(matcher):
+    result = matcher.match("bagle with cream cheese")
+    assert result.entry.key == "bagel with cream cheese"
+    assert not result.is_confident
+
+
+def test_unknown_names_do_not_match(matcher):
+    result = matcher.match("zzzz")
+    assert result.entry is None
+    assert matcher.resolve("pizza") is None
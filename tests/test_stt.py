@@ -0,0 +1,181 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+import speech_recognition as sr
+
+from utils import stt
+from utils.stt import (
+    GoogleSpeechToText,
+    SpeechToText,
+    Transcript,
+    VoskSpeechToText,
+    get_speech_to_text,
+    register_stt_backend,
+)
+
+
+class FixedSpeechToText(SpeechToText):
+    name = "fixed"
+
+    def __init__(self, texts=("one latte",), latency=0.5):
+        super().__init__()
+        self.texts = list(texts)
+        self.latency = latency
+
+    def _listen(self, recognizer, source, on_partial):
+        return Transcript(self.texts.pop(0), self.name, self.latency)
+
+
+class FakeDecoder:
+    """Plays back scripted vosk results, one per buffer read."""
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.final = ""
+        self._partial = ""
+        self._result = ""
+
+    def AcceptWaveform(self, buffer):
+        kind, text = self.script.pop(0) if self.script else ("partial", "")
+        if kind == "final":
+            self._result = text
+            return True
+        self._partial = text or self._partial
+        return False
+
+    def Result(self):
+        return json.dumps({"text": self._result})
+
+    def PartialResult(self):
+        return json.dumps({"partial": self._partial})
+
+    def FinalResult(self):
+        return json.dumps({"text": self.final})
+
+
+@pytest.fixture
+def fake_vosk(monkeypatch):
+    decoders = []
+
+    def recognizer(model, sample_rate):
+        return decoders.pop(0)
+
+    monkeypatch.setattr(
+        stt, "vosk", SimpleNamespace(Model=lambda path: path, KaldiRecognizer=recognizer)
+    )
+    return decoders
+
+
+def microphone():
+    return SimpleNamespace(
+        SAMPLE_RATE=16000,
+        CHUNK=1600,
+        stream=SimpleNamespace(read=lambda size: b"\0" * size),
+    )
+
+
+def test_transcripts_are_counted():
+    speech_to_text = FixedSpeechToText(["one latte", None], latency=0.5)
+
+    assert speech_to_text.listen(None, microphone()).text == "one latte"
+    assert speech_to_text.listen(None, microphone()).text is None
+    assert speech_to_text.utterances == 2
+    assert speech_to_text.recognized == 1
+    assert speech_to_text.average_latency == pytest.approx(0.5)
+
+
+def test_recognizer_failures_are_empty_transcripts():
+    def fail(audio, **kwargs):
+        raise sr.RequestError("offline")
+
+    recognizer = SimpleNamespace(
+        listen=lambda source: sr.AudioData(b"\0\0", 16000, 2),
+        recognize_google=fail,
+    )
+    transcript = GoogleSpeechToText().listen(recognizer, microphone())
+    assert transcript.text is None
+    assert transcript.backend == "google"
+
+
+def test_backends_are_pluggable(monkeypatch):
+    monkeypatch.setattr(stt, "STT_BACKENDS", dict(stt.STT_BACKENDS))
+    register_stt_backend("fixed", FixedSpeechToText)
+    speech_to_text = get_speech_to_text("fixed", texts=["a mocha"])
+    assert isinstance(speech_to_text, FixedSpeechToText)
+    assert speech_to_text.texts == ["a mocha"]
+
+
+def test_vosk_needs_its_package(monkeypatch):
+    monkeypatch.setattr(stt, "vosk", None)
+    with pytest.raises(ImportError):
+        VoskSpeechToText()
+
+
+def test_vosk_reports_each_new_partial_once(fake_vosk):
+    fake_vosk.append(
+        FakeDecoder(
+            [
+                ("partial", "one"),
+                ("partial", "one"),
+                ("partial", "one lat"),
+                ("partial", "one latte"),
+                ("final", "one latte please"),
+            ]
+        )
+    )
+    partials = []
+    transcript = VoskSpeechToText(model_path="model").listen(
+        None, microphone(), on_partial=partials.append
+    )
+
+    assert partials == ["one", "one lat", "one latte"]
+    assert transcript.text == "one latte please"
+    assert transcript.partials == 3
+    assert transcript.backend == "vosk"
+
+
+def test_vosk_latency_runs_from_the_end_of_speech(fake_vosk, monkeypatch):
+    clock = SimpleNamespace(now=0.0)
+    monkeypatch.setattr(stt, "time", SimpleNamespace(perf_counter=lambda: clock.now))
+
+    def read(size):
+        # Each buffer takes a tenth of a second to record
+        clock.now += 0.1
+        return b"\0" * size
+
+    source = microphone()
+    source.stream.read = read
+    fake_vosk.append(
+        FakeDecoder(
+            [
+                ("partial", "one latte"),
+                ("partial", ""),
+                ("partial", ""),
+                ("final", "one latte"),
+            ]
+        )
+    )
+    transcript = VoskSpeechToText(model_path="model").listen(None, source)
+
+    # Three buffers of trailing silence before the engine finalized
+    assert transcript.latency == pytest.approx(0.3)
+
+
+def test_vosk_keeps_listening_after_noise(fake_vosk):
+    fake_vosk.append(FakeDecoder([("final", ""), ("final", "a bagel")]))
+    transcript = VoskSpeechToText(model_path="model").listen(None, microphone())
+    assert transcript.text == "a bagel"
+
+
+def test_vosk_finalizes_at_the_phrase_time_limit(fake_vosk):
+    decoder = FakeDecoder([("partial", "a really long")])
+    decoder.final = "a really long order"
+    fake_vosk.append(decoder)
+
+    # One tenth of a second per buffer, so the limit is hit after ten reads
+    transcript = VoskSpeechToText(model_path="model", phrase_time_limit=1.0).listen(
+        None, microphone()
+    )
+    assert transcript.text == "a really long order"
+    assert transcript.partials == 1
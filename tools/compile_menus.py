@@ -0,0 +1,37 @@
+import os
+import sys
+import time
+
+from models.menu_artifact import (
+    MENU_ARTIFACT_DIR,
+    compile_menu_artifact,
+    menu_artifact_path,
+    write_menu_artifact,
+)
+from models.ordering import TEST_MENU_DIR
+
+
+def compile_menus():
+    """Compiles the named menus, or every menu, ahead of time so no process
+    has to on its first start."""
+    menu_names = sys.argv[1:] or sorted(
+        os.path.splitext(name)[0]
+        for name in os.listdir(TEST_MENU_DIR)
+        if name.endswith(".json")
+    )
+
+    for menu_name in menu_names:
+        source_path = f"{TEST_MENU_DIR}/{menu_name}.json"
+        start = time.perf_counter()
+        artifact = compile_menu_artifact(source_path)
+        path = menu_artifact_path(source_path, MENU_ARTIFACT_DIR)
+        write_menu_artifact(artifact, path)
+        print(
+            f"{menu_name}: {len(artifact.index)} items, "
+            f"{os.path.getsize(path)} bytes in {time.perf_counter() - start:.3f}s "
+            f"-> {path}"
+        )
+
+
+if __name__ == "__main__":
+    compile_menus()
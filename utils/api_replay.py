@@ -0,0 +1,504 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from utils.api_scheduler import CHAT_COMPLETIONS, SPEECH
+from utils.audio import PCM_SAMPLE_RATE
+from utils.frames import decode_audio, encode_audio
+
+# Arguments that change how a response is delivered, not what it says
+STREAM_ARGUMENTS = ("stream", "stream_options")
+# Replayed completion streams are cut into pieces of this many characters
+REPLAY_STREAM_CHUNK_CHARS = 16
+REPLAY_AUDIO_CHUNK_SIZE = 4096
+# Sizes the silence returned for speech that was never recorded
+SILENCE_CHARS_PER_SECOND = 15
+
+RECORDED_LATENCY = "recorded"
+LATENCY_DISTRIBUTIONS: Dict[str, Callable[..., float]] = {
+    "fixed": lambda seconds: seconds,
+    "uniform": random.uniform,
+    "normal": random.gauss,
+    "lognormal": random.lognormvariate,
+}
+
+
+class ReplayMissError(LookupError):
+    pass
+
+
+class LatencyModel:
+    """Samples replay delays from a spec such as "fixed:0.3", "uniform:0.2,0.8",
+    "normal:0.5,0.1" or "lognormal:-0.7,0.4". "recorded" replays the delays
+    measured while recording."""
+
+    def __init__(self, spec: str = RECORDED_LATENCY):
+        name, _, params = spec.partition(":")
+        if name != RECORDED_LATENCY and name not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution: {name}")
+        self.spec = spec
+        self.name = name
+        self.params = [float(p) for p in params.split(",")] if params else []
+
+    def sample(self, recorded: Optional[float] = None) -> float:
+        if self.name == RECORDED_LATENCY:
+            return recorded or 0.0
+        return max(LATENCY_DISTRIBUTIONS[self.name](*self.params), 0.0)
+
+
+def request_key(endpoint: str, request: Dict) -> str:
+    request = {k: v for k, v in request.items() if k not in STREAM_ARGUMENTS}
+    payload = json.dumps([endpoint, request], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def request_route(endpoint: str, request: Dict) -> str:
+    """The loose match used when the exact request was never recorded, the
+    called function for completions and the spoken text for speech."""
+    if endpoint == CHAT_COMPLETIONS:
+        tool_choice = request.get("tool_choice")
+        if isinstance(tool_choice, dict):
+            return tool_choice["function"]["name"]
+        return "message"
+    return f"{request.get('voice')}:{request.get('response_format')}:{request.get('input')}"
+
+
+class ApiRecording:
+    """API requests and their responses, one exchange per line of a JSONL
+    file. Recording only appends, replaying loads the whole file."""
+
+    def __init__(self, path: str, entries: List[Dict] = None):
+        self.path = path
+        self.entries = entries or []
+        self._replayed = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str) -> ApiRecording:
+        with open(path) as f:
+            return cls(path, [json.loads(line) for line in f if line.strip()])
+
+    def append(self, endpoint: str, request: Dict, **fields):
+        entry = {
+            "endpoint": endpoint,
+            "key": request_key(endpoint, request),
+            "route": request_route(endpoint, request),
+            "request": request,
+            **fields,
+        }
+        line = json.dumps(entry, default=str)
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+
+    def match(self, endpoint: str, request: Dict) -> Dict:
+        """The exact request if it was recorded, otherwise the next recorded
+        exchange on the same route. Once a route runs out its last exchange
+        keeps being served."""
+        key = request_key(endpoint, request)
+        route = request_route(endpoint, request)
+        with self._lock:
+            for field_name, value in (("key", key), ("route", route)):
+                found = [
+                    i
+                    for i, entry in enumerate(self.entries)
+                    if entry["endpoint"] == endpoint and entry.get(field_name) == value
+                ]
+                if found:
+                    fresh = [i for i in found if i not in self._replayed]
+                    index = fresh[0] if fresh else found[-1]
+                    self._replayed.add(index)
+                    return self.entries[index]
+        raise ReplayMissError(f"No recorded {endpoint} response for {route}")
+
+
+def merge_completion_chunks(chunks: List[Dict]) -> Dict:
+    message = {"role": "assistant", "content": None, "tool_calls": []}
+    finish_reason = None
+    usage = None
+    for chunk in chunks:
+        usage = chunk.get("usage") or usage
+        for choice in chunk["choices"]:
+            if choice["index"] != 0:
+                continue
+            finish_reason = choice.get("finish_reason") or finish_reason
+            delta = choice["delta"]
+            if delta.get("content"):
+                message["content"] = (message["content"] or "") + delta["content"]
+            for tool_call in delta.get("tool_calls") or []:
+                while len(message["tool_calls"]) <= tool_call["index"]:
+                    message["tool_calls"].append(
+                        {
+                            "id": None,
+                            "type": "function",
+                            "function": {"name": "", "arguments": ""},
+                        }
+                    )
+                merged = message["tool_calls"][tool_call["index"]]
+                merged["id"] = tool_call.get("id") or merged["id"]
+                function = tool_call.get("function") or {}
+                merged["function"]["name"] += function.get("name") or ""
+                merged["function"]["arguments"] += function.get("arguments") or ""
+
+    first = chunks[0] if chunks else {}
+    return {
+        "id": first.get("id", ""),
+        "object": "chat.completion",
+        "created": first.get("created", 0),
+        "model": first.get("model", ""),
+        "choices": [
+            {
+                "index": 0,
+                "message": {**message, "tool_calls": message["tool_calls"] or None},
+                "finish_reason": finish_reason or "stop",
+                "logprobs": None,
+            }
+        ],
+        "usage": usage,
+    }
+
+
+def split_completion(
+    completion: Dict, include_usage=False, chunk_chars=REPLAY_STREAM_CHUNK_CHARS
+) -> List[Dict]:
+    base = {
+        "id": completion.get("id", ""),
+        "object": "chat.completion.chunk",
+        "created": completion.get("created", 0),
+        "model": completion.get("model", ""),
+    }
+
+    def chunk(delta: Dict, finish_reason: str = None) -> Dict:
+        return {
+            **base,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+
+    choice = completion["choices"][0]
+    message = choice["message"]
+    chunks = [chunk({"role": "assistant"})]
+    content = message.get("content") or ""
+    for i in range(0, len(content), chunk_chars):
+        chunks.append(chunk({"content": content[i : i + chunk_chars]}))
+
+    for index, tool_call in enumerate(message.get("tool_calls") or []):
+        function = tool_call["function"]
+        chunks.append(
+            chunk(
+                {
+                    "tool_calls": [
+                        {
+                            "index": index,
+                            "id": tool_call["id"],
+                            "type": "function",
+                            "function": {"name": function["name"], "arguments": ""},
+                        }
+                    ]
+                }
+            )
+        )
+        arguments = function["arguments"]
+        for i in range(0, len(arguments), chunk_chars):
+            piece = {"arguments": arguments[i : i + chunk_chars]}
+            chunks.append(
+                chunk({"tool_calls": [{"index": index, "function": piece}]})
+            )
+
+    chunks.append(chunk({}, finish_reason=choice.get("finish_reason") or "stop"))
+    if include_usage and completion.get("usage"):
+        chunks.append({**base, "choices": [], "usage": completion["usage"]})
+    return chunks
+
+
+def _split_bytes(audio: bytes, chunk_size: int = None) -> Iterator[bytes]:
+    chunk_size = chunk_size or REPLAY_AUDIO_CHUNK_SIZE
+    for i in range(0, len(audio), chunk_size):
+        yield audio[i : i + chunk_size]
+
+
+def _chunk_delay(entry: Dict, chunks: int) -> Optional[float]:
+    if "duration" not in entry or not chunks:
+        return None
+    return max(entry["duration"] - entry.get("latency", 0), 0) / chunks
+
+
+class _Replayer:
+    def __init__(
+        self,
+        recording: ApiRecording,
+        latency: LatencyModel = None,
+        chunk_latency: LatencyModel = None,
+    ):
+        self.recording = recording
+        self.latency = latency or LatencyModel()
+        self.chunk_latency = chunk_latency or LatencyModel()
+        self.chat = SimpleNamespace(
+            completions=SimpleNamespace(create=self._create_completion)
+        )
+        self.audio = SimpleNamespace(
+            speech=SimpleNamespace(
+                create=self._create_speech,
+                with_streaming_response=SimpleNamespace(create=self._stream_speech),
+            )
+        )
+
+    def _completion_plan(self, request: Dict) -> Tuple[float, object]:
+        entry = self.recording.match(CHAT_COMPLETIONS, request)
+        delay = self.latency.sample(entry.get("latency"))
+        if not request.get("stream"):
+            return delay, ChatCompletion(**entry["response"])
+
+        include_usage = (request.get("stream_options") or {}).get("include_usage")
+        chunks = split_completion(entry["response"], include_usage=include_usage)
+        recorded = _chunk_delay(entry, len(chunks))
+        return delay, [
+            (self.chunk_latency.sample(recorded), ChatCompletionChunk(**c))
+            for c in chunks
+        ]
+
+    def _speech_plan(self, request: Dict) -> Tuple[float, bytes, Optional[float]]:
+        try:
+            entry = self.recording.match(SPEECH, request)
+        except ReplayMissError:
+            if request.get("response_format") != "pcm":
+                raise
+            # Raw PCM silence as long as the text would take to say
+            seconds = len(request.get("input", "")) / SILENCE_CHARS_PER_SECOND
+            return self.latency.sample(), bytes(int(seconds * PCM_SAMPLE_RATE) * 2), None
+
+        audio = decode_audio(entry["audio"])
+        chunks = -(-len(audio) // REPLAY_AUDIO_CHUNK_SIZE)
+        return (
+            self.latency.sample(entry.get("latency")),
+            audio,
+            _chunk_delay(entry, chunks),
+        )
+
+
+class ReplayOpenAI(_Replayer):
+    """Stands in for the OpenAI client, answering completions and speech from
+    an ApiRecording without network access or spend."""
+
+    def _create_completion(self, **request):
+        delay, response = self._completion_plan(request)
+        time.sleep(delay)
+        if not request.get("stream"):
+            return response
+        return self._replay_chunks(response)
+
+    def _replay_chunks(self, chunks):
+        for delay, chunk in chunks:
+            time.sleep(delay)
+            yield chunk
+
+    def _create_speech(self, **request):
+        delay, audio, _ = self._speech_plan(request)
+        time.sleep(delay)
+        return SimpleNamespace(content=audio)
+
+    @contextlib.contextmanager
+    def _stream_speech(self, **request):
+        delay, audio, recorded = self._speech_plan(request)
+        time.sleep(delay)
+
+        def iter_bytes(chunk_size: int = None):
+            for chunk in _split_bytes(audio, chunk_size):
+                time.sleep(self.chunk_latency.sample(recorded))
+                yield chunk
+
+        yield SimpleNamespace(iter_bytes=iter_bytes)
+
+
+class AsyncReplayOpenAI(_Replayer):
+    """ReplayOpenAI for code written against AsyncOpenAI."""
+
+    async def _create_completion(self, **request):
+        delay, response = self._completion_plan(request)
+        await asyncio.sleep(delay)
+        if not request.get("stream"):
+            return response
+        return self._replay_chunks(response)
+
+    async def _replay_chunks(self, chunks):
+        for delay, chunk in chunks:
+            await asyncio.sleep(delay)
+            yield chunk
+
+    async def _create_speech(self, **request):
+        delay, audio, _ = self._speech_plan(request)
+        await asyncio.sleep(delay)
+        return SimpleNamespace(content=audio)
+
+    @contextlib.asynccontextmanager
+    async def _stream_speech(self, **request):
+        delay, audio, recorded = self._speech_plan(request)
+        await asyncio.sleep(delay)
+
+        async def iter_bytes(chunk_size: int = None):
+            for chunk in _split_bytes(audio, chunk_size):
+                await asyncio.sleep(self.chunk_latency.sample(recorded))
+                yield chunk
+
+        yield SimpleNamespace(iter_bytes=iter_bytes)
+
+
+class _Recorder:
+    def __init__(self, client, recording: ApiRecording):
+        self.client = client
+        self.recording = recording
+        self.chat = SimpleNamespace(
+            completions=SimpleNamespace(create=self._create_completion)
+        )
+        self.audio = SimpleNamespace(
+            speech=SimpleNamespace(
+                create=self._create_speech,
+                with_streaming_response=SimpleNamespace(create=self._stream_speech),
+            )
+        )
+
+    def _record(self, endpoint: str, request: Dict, started: float, latency=None, **fields):
+        duration = time.perf_counter() - started
+        self.recording.append(
+            endpoint,
+            request,
+            latency=duration if latency is None else latency,
+            duration=duration,
+            **fields,
+        )
+
+
+class RecordingOpenAI(_Recorder):
+    """Passes requests through to a real OpenAI client, appending every
+    completed exchange to an ApiRecording for later replay."""
+
+    def _create_completion(self, **request):
+        started = time.perf_counter()
+        response = self.client.chat.completions.create(**request)
+        if not request.get("stream"):
+            self._record(
+                CHAT_COMPLETIONS, request, started, response=response.model_dump(mode="json")
+            )
+            return response
+        return self._record_chunks(request, response, started)
+
+    def _record_chunks(self, request: Dict, stream, started: float):
+        chunks = []
+        latency = None
+        for chunk in stream:
+            if latency is None:
+                latency = time.perf_counter() - started
+            chunks.append(chunk.model_dump(mode="json"))
+            yield chunk
+        self._record(
+            CHAT_COMPLETIONS,
+            request,
+            started,
+            latency=latency,
+            response=merge_completion_chunks(chunks),
+        )
+
+    def _create_speech(self, **request):
+        started = time.perf_counter()
+        response = self.client.audio.speech.create(**request)
+        self._record(SPEECH, request, started, audio=encode_audio(response.content))
+        return response
+
+    @contextlib.contextmanager
+    def _stream_speech(self, **request):
+        started = time.perf_counter()
+        received = []
+        latency = []
+        with self.client.audio.speech.with_streaming_response.create(
+            **request
+        ) as response:
+
+            def iter_bytes(chunk_size: int = None):
+                for chunk in response.iter_bytes(chunk_size):
+                    if not latency:
+                        latency.append(time.perf_counter() - started)
+                    received.append(chunk)
+                    yield chunk
+                # Speech the caller stopped reading early is not recorded
+                self._record(
+                    SPEECH,
+                    request,
+                    started,
+                    latency=latency[0] if latency else None,
+                    audio=encode_audio(b"".join(received)),
+                )
+
+            yield SimpleNamespace(iter_bytes=iter_bytes)
+
+
+class AsyncRecordingOpenAI(_Recorder):
+    """RecordingOpenAI for an AsyncOpenAI client."""
+
+    async def _create_completion(self, **request):
+        started = time.perf_counter()
+        response = await self.client.chat.completions.create(**request)
+        if not request.get("stream"):
+            self._record(
+                CHAT_COMPLETIONS, request, started, response=response.model_dump(mode="json")
+            )
+            return response
+        return self._record_chunks(request, response, started)
+
+    async def _record_chunks(self, request: Dict, stream, started: float):
+        chunks = []
+        latency = None
+        async for chunk in stream:
+            if latency is None:
+                latency = time.perf_counter() - started
+            chunks.append(chunk.model_dump(mode="json"))
+            yield chunk
+        self._record(
+            CHAT_COMPLETIONS,
+            request,
+            started,
+            latency=latency,
+            response=merge_completion_chunks(chunks),
+        )
+
+    async def _create_speech(self, **request):
+        started = time.perf_counter()
+        response = await self.client.audio.speech.create(**request)
+        self._record(SPEECH, request, started, audio=encode_audio(response.content))
+        return response
+
+    @contextlib.asynccontextmanager
+    async def _stream_speech(self, **request):
+        started = time.perf_counter()
+        received = []
+        latency = []
+        async with self.client.audio.speech.with_streaming_response.create(
+            **request
+        ) as response:
+
+            async def iter_bytes(chunk_size: int = None):
+                async for chunk in response.iter_bytes(chunk_size):
+                    if not latency:
+                        latency.append(time.perf_counter() - started)
+                    received.append(chunk)
+                    yield chunk
+                # Speech the caller stopped reading early is not recorded
+                self._record(
+                    SPEECH,
+                    request,
+                    started,
+                    latency=latency[0] if latency else None,
+                    audio=encode_audio(b"".join(received)),
+                )
+
+            yield SimpleNamespace(iter_bytes=iter_bytes)
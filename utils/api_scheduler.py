@@ -0,0 +1,323 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from enum import IntEnum
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+import openai
+
+T = TypeVar("T")
+
+CHAT_COMPLETIONS = "chat_completions"
+SPEECH = "speech"
+
+# Per minute limits for the account tier, (requests, tokens), override them
+# through the environment to match the organization's actual limits
+API_LIMITS = {
+    CHAT_COMPLETIONS: (
+        int(os.getenv("OPENAI_CHAT_RPM", 500)),
+        int(os.getenv("OPENAI_CHAT_TPM", 30000)),
+    ),
+    SPEECH: (int(os.getenv("OPENAI_TTS_RPM", 50)), None),
+}
+
+DEFAULT_MAX_RETRIES = 5
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+
+
+class Priority(IntEnum):
+    LIVE_TURN = 0
+    FILLER = 1
+    BACKGROUND = 2
+
+
+_current_priority: ContextVar[Priority] = ContextVar(
+    "api_priority", default=Priority.LIVE_TURN
+)
+
+
+@contextlib.contextmanager
+def api_priority(priority: Priority):
+    """Schedules every API request made in this context, including tasks
+    started from it, in the given lane."""
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.available = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.available = min(
+            self.capacity, self.available + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        # Requests bigger than the whole bucket only wait for a full one
+        missing = min(amount, self.capacity) - self.available
+        return max(missing, 0) / self.rate
+
+    def take(self, amount: float, now: float):
+        self._refill(now)
+        self.available -= min(amount, self.capacity)
+
+    def adjust(self, amount: float):
+        # Settles an estimate, the bucket can go into debt
+        self.available = min(self.capacity, self.available - amount)
+
+
+@dataclass
+class LaneMetrics:
+    waiting: int = 0
+    granted: int = 0
+    rate_limited: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+    @property
+    def average_wait(self) -> float:
+        return self.total_wait / self.granted if self.granted else 0.0
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "tokens", "wake")
+
+    def __init__(self, priority: Priority, seq: int, tokens: int, wake: Callable):
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.wake = wake
+
+    def __lt__(self, other: _Waiter) -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class ApiScheduler:
+    """Admits requests to one API resource in priority order, within per
+    minute request and token budgets, backing everyone off after a 429.
+
+    Sync callers block their thread and async callers await, so scraper
+    threads and event loop sessions share the same budget.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+    ):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.cooldown_until = 0.0
+        self.lanes = {priority: LaneMetrics() for priority in Priority}
+
+        self._queue = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def _enqueue(self, tokens: int, priority: Optional[Priority], wake) -> _Waiter:
+        if priority is None:
+            priority = _current_priority.get()
+        waiter = _Waiter(priority, next(self._seq), tokens, wake)
+        with self._lock:
+            heapq.heappush(self._queue, waiter)
+            self.lanes[priority].waiting += 1
+        return waiter
+
+    def _try_grant(self, waiter: _Waiter, started: float) -> Optional[float]:
+        """Grants the request and returns 0 if waiter is next and the budget
+        allows it, otherwise how long to wait. None waits for a wake up."""
+        with self._lock:
+            if self._queue[0] is not waiter:
+                return None
+
+            now = time.monotonic()
+            delay = max(
+                self.cooldown_until - now,
+                self.requests.wait_time(1, now) if self.requests else 0,
+                self.tokens.wait_time(waiter.tokens, now) if self.tokens else 0,
+            )
+            if delay > 0:
+                return delay
+
+            heapq.heappop(self._queue)
+            if self.requests:
+                self.requests.take(1, now)
+            if self.tokens:
+                self.tokens.take(waiter.tokens, now)
+
+            lane = self.lanes[waiter.priority]
+            lane.waiting -= 1
+            lane.granted += 1
+            lane.total_wait += now - started
+            lane.max_wait = max(lane.max_wait, now - started)
+            self._wake_next()
+            return 0
+
+    def _abandon(self, waiter: _Waiter):
+        with self._lock:
+            if waiter in self._queue:
+                self._queue.remove(waiter)
+                heapq.heapify(self._queue)
+                self.lanes[waiter.priority].waiting -= 1
+                self._wake_next()
+
+    def _wake_next(self):
+        if self._queue:
+            self._queue[0].wake()
+
+    def acquire(self, tokens: int = 0, priority: Priority = None):
+        woken = threading.Event()
+        waiter = self._enqueue(tokens, priority, woken.set)
+        started = time.monotonic()
+        try:
+            while True:
+                woken.clear()
+                delay = self._try_grant(waiter, started)
+                if delay == 0:
+                    return
+                woken.wait(delay)
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+    async def acquire_async(self, tokens: int = 0, priority: Priority = None):
+        loop = asyncio.get_running_loop()
+        woken = asyncio.Event()
+        waiter = self._enqueue(
+            tokens, priority, lambda: loop.call_soon_threadsafe(woken.set)
+        )
+        started = time.monotonic()
+        try:
+            while True:
+                woken.clear()
+                delay = self._try_grant(waiter, started)
+                if delay == 0:
+                    return
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(woken.wait(), delay)
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+    def run(
+        self, call: Callable[[], T], tokens: int = 0, priority: Priority = None
+    ) -> T:
+        for attempt in itertools.count():
+            self.acquire(tokens, priority)
+            try:
+                return call()
+            except openai.RateLimitError as e:
+                if not self._back_off(e, attempt, priority):
+                    raise
+
+    async def run_async(
+        self,
+        call: Callable[[], Awaitable[T]],
+        tokens: int = 0,
+        priority: Priority = None,
+    ) -> T:
+        for attempt in itertools.count():
+            await self.acquire_async(tokens, priority)
+            try:
+                return await call()
+            except openai.RateLimitError as e:
+                if not self._back_off(e, attempt, priority):
+                    raise
+
+    def _back_off(
+        self, error: openai.RateLimitError, attempt: int, priority: Priority
+    ) -> bool:
+        # An exhausted quota will not recover by waiting
+        if attempt >= self.max_retries or error.code == "insufficient_quota":
+            return False
+
+        delay = _retry_after(error)
+        if delay is None:
+            delay = min(BACKOFF_BASE_SECONDS * 2**attempt, BACKOFF_MAX_SECONDS)
+            delay *= 0.5 + random.random() / 2
+
+        with self._lock:
+            # The limit is shared, so every lane waits out the cooldown
+            self.cooldown_until = max(self.cooldown_until, time.monotonic() + delay)
+            self.lanes[priority or _current_priority.get()].rate_limited += 1
+        return True
+
+    def record_tokens(self, estimated: int, actual: int):
+        if self.tokens:
+            with self._lock:
+                self.tokens.adjust(actual - estimated)
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            return {
+                "queue_depth": len(self._queue),
+                "cooldown": max(self.cooldown_until - time.monotonic(), 0.0),
+                "lanes": {
+                    priority.name.lower(): {
+                        **asdict(lane),
+                        "average_wait": lane.average_wait,
+                    }
+                    for priority, lane in self.lanes.items()
+                },
+            }
+
+
+def _retry_after(error: openai.RateLimitError) -> Optional[float]:
+    headers = error.response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+_schedulers: Dict[str, ApiScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_api_scheduler(resource: str) -> ApiScheduler:
+    with _schedulers_lock:
+        scheduler = _schedulers.get(resource)
+        if scheduler is None:
+            requests_per_minute, tokens_per_minute = API_LIMITS[resource]
+            scheduler = _schedulers[resource] = ApiScheduler(
+                resource, requests_per_minute, tokens_per_minute
+            )
+        return scheduler
+
+
+def set_api_scheduler(resource: str, scheduler: ApiScheduler):
+    with _schedulers_lock:
+        _schedulers[resource] = scheduler
+
+
+def api_scheduler_metrics() -> Dict[str, Dict]:
+    with _schedulers_lock:
+        schedulers = dict(_schedulers)
+    return {name: scheduler.metrics() for name, scheduler in schedulers.items()}
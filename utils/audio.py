@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import asyncio
+import queue
+import threading
+import wave
+from concurrent.futures import Future
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, List
+
+import pyaudio
+
+from utils.tracing import start_span
+
+# OpenAI TTS "pcm" responses are 24kHz, 16 bit, mono, little endian
+PCM_SAMPLE_RATE = 24000
+PCM_SAMPLE_WIDTH = 2
+PCM_CHANNELS = 1
+PCM_FRAMES_PER_BUFFER = 1024
+
+
+class BufferedAudio:
+    """Audio chunks produced in the background that can be played while
+    they are still arriving, and replayed once complete."""
+
+    def __init__(self, chunks: Iterable[bytes] = None):
+        self.chunks: List[bytes] = []
+        self.error = None
+        self.done = False
+        self._condition = threading.Condition()
+        self._waiters = []
+        self._task = None
+        if chunks is not None:
+            self._thread = threading.Thread(
+                target=self._fill, args=(chunks,), name="audio-buffer", daemon=True
+            )
+            self._thread.start()
+
+    @classmethod
+    def from_async(cls, chunks: AsyncIterable[bytes]) -> BufferedAudio:
+        """Fills the buffer from a task on the running event loop."""
+        buffered = cls()
+        buffered._task = asyncio.get_running_loop().create_task(
+            buffered._fill_async(chunks)
+        )
+        return buffered
+
+    def _fill(self, chunks: Iterable[bytes]):
+        error = None
+        try:
+            for chunk in chunks:
+                self.append(chunk)
+        except Exception as e:
+            error = e
+        finally:
+            self.close(error)
+
+    async def _fill_async(self, chunks: AsyncIterable[bytes]):
+        error = None
+        try:
+            async for chunk in chunks:
+                self.append(chunk)
+        except Exception as e:
+            error = e
+        finally:
+            # A cancelled fill just ends the audio early
+            self.close(error)
+
+    def append(self, chunk: bytes):
+        with self._condition:
+            self.chunks.append(chunk)
+            self._notify()
+
+    def close(self, error: Exception = None):
+        with self._condition:
+            self.error = error
+            self.done = True
+            self._notify()
+
+    def _notify(self):
+        self._condition.notify_all()
+        waiters, self._waiters = self._waiters, []
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    def __iter__(self) -> Iterator[bytes]:
+        position = 0
+        while True:
+            with self._condition:
+                while position >= len(self.chunks) and not self.done:
+                    self._condition.wait()
+                if position >= len(self.chunks):
+                    break
+                chunk = self.chunks[position]
+            position += 1
+            yield chunk
+
+        if self.error is not None:
+            raise self.error
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        position = 0
+        while True:
+            with self._condition:
+                if position >= len(self.chunks) and not self.done:
+                    changed = asyncio.Event()
+                    self._waiters.append((asyncio.get_running_loop(), changed))
+                    chunk = None
+                elif position >= len(self.chunks):
+                    break
+                else:
+                    chunk = self.chunks[position]
+
+            if chunk is None:
+                await changed.wait()
+                continue
+            position += 1
+            yield chunk
+
+        if self.error is not None:
+            raise self.error
+
+    def result(self) -> bytes:
+        return b"".join(self)
+
+
+class Playback:
+    def __init__(self):
+        self.finished = threading.Event()
+        self.cancelled = False
+        self.error = None
+        self._future = Future()
+        # Queued in the caller's context, finished by the worker
+        self.span = start_span("playback")
+
+    def wait(self, timeout: float = None) -> bool:
+        finished = self.finished.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return finished
+
+    async def wait_async(self):
+        try:
+            await asyncio.shield(asyncio.wrap_future(self._future))
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
+        if self.error is not None:
+            raise self.error
+
+    def cancel(self):
+        # Stops at the next chunk, or skips the utterance if still queued
+        self.cancelled = True
+
+    def _finish(self):
+        self.span.set(cancelled=self.cancelled)
+        self.span.finish(error=self.error)
+        self.finished.set()
+        self._future.set_result(None)
+
+
+class AudioSink:
+    """Plays queued utterances one after another on a single worker thread,
+    so overlapping requests to speak never talk over each other."""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._current = None
+        self._worker = threading.Thread(
+            target=self._run, name="audio-sink", daemon=True
+        )
+        self._worker.start()
+
+    def play(self, chunks: Iterable[bytes], blocking=True) -> Playback:
+        playback = Playback()
+        self._queue.put((chunks, playback))
+        if blocking:
+            playback.wait()
+        return playback
+
+    async def play_async(self, chunks: Iterable[bytes], blocking=True) -> Playback:
+        playback = self.play(chunks, blocking=False)
+        if blocking:
+            await playback.wait_async()
+        return playback
+
+    def interrupt(self):
+        """Cancels the utterance being played and everything queued after it."""
+        with self._queue.mutex:
+            pending = [playback for _, playback in self._queue.queue]
+        for playback in [self._current, *pending]:
+            if playback is not None:
+                playback.cancel()
+
+    def _run(self):
+        while True:
+            chunks, playback = self._queue.get()
+            self._current = playback
+            playback.span.set(queue_wait=playback.span.duration)
+            played = 0
+            try:
+                if playback.cancelled:
+                    continue
+                for chunk in chunks:
+                    if playback.cancelled:
+                        break
+                    if not played:
+                        playback.span.set(first_chunk=playback.span.duration)
+                    self.write(chunk)
+                    played += len(chunk)
+                else:
+                    self.drain()
+            except Exception as e:
+                playback.error = e
+            finally:
+                self._current = None
+                playback.span.set(bytes=played)
+                playback._finish()
+
+    def write(self, chunk: bytes):
+        raise NotImplementedError
+
+    def drain(self):
+        pass
+
+
+class PcmAudioSink(AudioSink):
+    """Keeps one PyAudio output stream open for the life of the process so
+    playback starts on the first chunk without spawning a player."""
+
+    def __init__(self, sample_rate: int = PCM_SAMPLE_RATE):
+        self._audio = pyaudio.PyAudio()
+        self._stream = self._audio.open(
+            format=self._audio.get_format_from_width(PCM_SAMPLE_WIDTH),
+            channels=PCM_CHANNELS,
+            rate=sample_rate,
+            output=True,
+            frames_per_buffer=PCM_FRAMES_PER_BUFFER,
+        )
+        super().__init__()
+
+    def write(self, chunk: bytes):
+        self._stream.write(chunk)
+
+
+class NullAudioSink(AudioSink):
+    """Consumes audio without playing it."""
+
+    def write(self, chunk: bytes):
+        pass
+
+
+def tee_to_wav(chunks: Iterable[bytes], filename: str) -> Iterator[bytes]:
+    with wave.open(filename, "wb") as wav_file:
+        wav_file.setnchannels(PCM_CHANNELS)
+        wav_file.setsampwidth(PCM_SAMPLE_WIDTH)
+        wav_file.setframerate(PCM_SAMPLE_RATE)
+        for chunk in chunks:
+            wav_file.writeframes(chunk)
+            yield chunk
+
+
+_audio_sink = None
+_audio_sink_lock = threading.Lock()
+
+
+def get_audio_sink() -> AudioSink:
+    global _audio_sink
+    with _audio_sink_lock:
+        if _audio_sink is None:
+            _audio_sink = PcmAudioSink()
+        return _audio_sink
+
+
+def set_audio_sink(sink: AudioSink):
+    global _audio_sink
+    with _audio_sink_lock:
+        _audio_sink = sink
@@ -0,0 +1,126 @@
+import audioop
+import threading
+from contextlib import contextmanager
+
+import speech_recognition as sr
+
+from utils.vad import VoiceActivityDetector
+
+# How long the calibrator waits for the microphone before checking again
+# whether it was paused or stopped
+MICROPHONE_RETRY_SECONDS = 0.1
+
+
+class AmbientNoiseCalibrator:
+    """Keeps recognizer.energy_threshold tracking the ambient noise from a
+    dedicated thread, reading the live microphone whenever nobody is listening.
+
+    Listening pauses the calibrator, which then releases the microphone within
+    one buffer, so calibration never delays a customer turn. An enabled voice
+    activity detector sees the same buffers, and speech is left out of the
+    calibration.
+    """
+
+    def __init__(
+        self,
+        recognizer: sr.Recognizer,
+        microphone: sr.AudioSource,
+        microphone_lock: threading.Lock,
+        detector: VoiceActivityDetector = None,
+    ):
+        self.recognizer = recognizer
+        self.microphone = microphone
+        self.microphone_lock = microphone_lock
+        self.detector = detector
+        self.calibrated = threading.Event()
+        self.seconds_calibrated = 0.0
+        self.error = None
+
+        self._stopped = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+        self._pauses = 0
+        self._pauses_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="noise-calibration", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        self._stopped.set()
+        self._resumed.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @contextmanager
+    def paused(self):
+        with self._pauses_lock:
+            self._pauses += 1
+            self._resumed.clear()
+        try:
+            yield
+        finally:
+            with self._pauses_lock:
+                self._pauses -= 1
+                if not self._pauses:
+                    self._resumed.set()
+
+    def _should_yield(self) -> bool:
+        return self._stopped.is_set() or not self._resumed.is_set()
+
+    def _run(self):
+        try:
+            while not self._stopped.is_set():
+                self._resumed.wait()
+                if self._stopped.is_set():
+                    break
+                if not self.microphone_lock.acquire(timeout=MICROPHONE_RETRY_SECONDS):
+                    continue
+                try:
+                    if not self._should_yield():
+                        with self.microphone as source:
+                            self._calibrate(source)
+                finally:
+                    self.microphone_lock.release()
+        except Exception as e:
+            # Listening still works uncalibrated, so just record the failure
+            self.error = e
+
+    def _calibrate(self, source: sr.AudioSource):
+        recognizer = self.recognizer
+        seconds_per_buffer = source.CHUNK / source.SAMPLE_RATE
+        # Same asymmetric weighted average as Recognizer.adjust_for_ambient_noise,
+        # applied one buffer at a time for as long as the microphone is free
+        damping = recognizer.dynamic_energy_adjustment_damping**seconds_per_buffer
+
+        while not self._should_yield():
+            buffer = source.stream.read(source.CHUNK)
+            energy = audioop.rms(buffer, source.SAMPLE_WIDTH)
+            detector = self.detector
+            if (
+                detector is not None
+                and detector.enabled
+                and detector.feed(
+                    buffer, energy, recognizer.energy_threshold, seconds_per_buffer
+                )
+            ):
+                continue
+
+            target_energy = energy * recognizer.dynamic_energy_ratio
+            recognizer.energy_threshold = (
+                recognizer.energy_threshold * damping + target_energy * (1 - damping)
+            )
+
+            self.seconds_calibrated += seconds_per_buffer
+            if self.seconds_calibrated >= 1:
+                self.calibrated.set()
@@ -0,0 +1,39 @@
+import asyncio
+import base64
+import json
+from typing import Dict
+
+# Frames are single JSON lines, audio frames carry base64 PCM so a line can
+# get much longer than asyncio's 64KiB default
+FRAME_LIMIT = 16 * 1024 * 1024
+
+
+class FrameError(Exception):
+    pass
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Dict:
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Connection closed")
+    try:
+        frame = json.loads(line)
+    except json.JSONDecodeError as e:
+        raise FrameError(f"Malformed frame: {line[:80]!r}") from e
+    if not isinstance(frame, dict) or "type" not in frame:
+        raise FrameError(f"Frame without a type: {line[:80]!r}")
+    return frame
+
+
+async def write_frame(writer: asyncio.StreamWriter, frame_type: str, **fields):
+    frame = {"type": frame_type, **fields}
+    writer.write(json.dumps(frame, separators=(",", ":")).encode("utf-8") + b"\n")
+    await writer.drain()
+
+
+def encode_audio(audio: bytes) -> str:
+    return base64.b64encode(audio).decode("ascii")
+
+
+def decode_audio(data: str) -> bytes:
+    return base64.b64decode(data)
@@ -0,0 +1,70 @@
+import json
+from typing import Dict, Iterable
+
+
+class IncrementalJsonFieldExtractor:
+    """Pulls top level string fields out of a JSON object while it is still
+    being streamed, returning each one as soon as its closing quote arrives."""
+
+    def __init__(self, field_names: Iterable[str]):
+        self.field_names = set(field_names)
+        self.completed: Dict[str, str] = {}
+
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._string_start = 0
+        self._expecting_key = False
+        self._current_key = None
+        self._buffer = []
+        self._position = 0
+
+    def feed(self, chunk: str) -> Dict[str, str]:
+        completed = {}
+        for char in chunk:
+            self._buffer.append(char)
+            position = self._position
+            self._position += 1
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        raw = "".join(self._buffer[self._string_start : position + 1])
+                        self._on_top_level_string(json.loads(raw), completed)
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = position
+            elif char in "{[":
+                self._depth += 1
+                self._expecting_key = self._depth == 1 and char == "{"
+            elif char in "}]":
+                self._depth -= 1
+            elif char == "," and self._depth == 1:
+                self._expecting_key = True
+                self._current_key = None
+            elif char == ":" and self._depth == 1:
+                self._expecting_key = False
+
+        if not self._in_string:
+            # Nothing before the current position is needed anymore
+            self._buffer.clear()
+            self._string_start = 0
+            self._position = 0
+        return completed
+
+    def _on_top_level_string(self, value: str, completed: Dict[str, str]):
+        if self._expecting_key:
+            self._current_key = value
+            return
+
+        key, self._current_key = self._current_key, None
+        if key in self.field_names and key not in self.completed:
+            self.completed[key] = value
+            completed[key] = value
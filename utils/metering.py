@@ -0,0 +1,324 @@
+from __future__ import annotations
+
+import atexit
+import contextlib
+import datetime
+import json
+import os
+import queue
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Optional
+
+from utils.api_scheduler import CHAT_COMPLETIONS, SPEECH
+
+SESSION = "session"
+RESTAURANT = "restaurant"
+DAY = "day"
+FUNCTION = "fn_name"
+MODEL = "model"
+
+
+@dataclass(frozen=True)
+class ModelPrice:
+    """USD per million tokens, or per million characters for speech."""
+
+    input: float = 0.0
+    output: float = 0.0
+    cached_input: Optional[float] = None
+    characters: float = 0.0
+
+
+# List prices, override them with register_model_price for negotiated rates
+MODEL_PRICES: Dict[str, ModelPrice] = {
+    "gpt-4-0613": ModelPrice(input=30.0, output=60.0),
+    "gpt-4o-2024-08-06": ModelPrice(input=2.5, output=10.0, cached_input=1.25),
+    "gpt-4-1106-preview": ModelPrice(input=10.0, output=30.0),
+    "gpt-3.5-turbo-0613": ModelPrice(input=1.5, output=2.0),
+    "tts-1": ModelPrice(characters=15.0),
+    "tts-1-hd": ModelPrice(characters=30.0),
+}
+
+
+def register_model_price(model: str, price: ModelPrice):
+    MODEL_PRICES[model] = price
+
+
+class BudgetExceededException(Exception):
+    pass
+
+
+@dataclass
+class UsageRecord:
+    endpoint: str
+    model: str
+    fn_name: Optional[str] = None
+    session_id: Optional[str] = None
+    restaurant: Optional[str] = None
+    turn: Optional[int] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    tts_chars: int = 0
+    latency: float = 0.0
+    timestamp: float = field(default_factory=time.time)
+    cost: float = field(init=False, default=0.0)
+
+    def __post_init__(self):
+        price = MODEL_PRICES.get(self.model, ModelPrice())
+        cached_rate = price.input if price.cached_input is None else price.cached_input
+        self.cost = (
+            (self.prompt_tokens - self.cached_tokens) * price.input
+            + self.cached_tokens * cached_rate
+            + self.completion_tokens * price.output
+            + self.tts_chars * price.characters
+        ) / 1e6
+
+    @property
+    def day(self) -> str:
+        return datetime.date.fromtimestamp(self.timestamp).isoformat()
+
+
+@dataclass
+class UsageTotals:
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    tts_chars: int = 0
+    latency: float = 0.0
+    cost: float = 0.0
+
+    def add(self, record: UsageRecord):
+        self.calls += 1
+        self.prompt_tokens += record.prompt_tokens
+        self.completion_tokens += record.completion_tokens
+        self.cached_tokens += record.cached_tokens
+        self.tts_chars += record.tts_chars
+        self.latency += record.latency
+        self.cost += record.cost
+
+    def as_dict(self) -> Dict:
+        return {
+            **asdict(self),
+            "average_latency": self.latency / self.calls if self.calls else 0.0,
+        }
+
+
+@dataclass
+class Budget:
+    """Soft and hard USD limits for one session, restaurant or day. Past the
+    soft limit completions use the fallback model, past the hard limit no
+    more requests are made."""
+
+    scope: str
+    soft_limit: Optional[float] = None
+    hard_limit: Optional[float] = None
+
+    @classmethod
+    def parse(cls, scope: str, spec: str) -> Budget:
+        """Parses "soft,hard", where either can be left empty."""
+        soft, _, hard = spec.partition(",")
+        return cls(
+            scope,
+            float(soft) if soft.strip() else None,
+            float(hard) if hard.strip() else None,
+        )
+
+
+_metering_tags: ContextVar[Dict[str, str]] = ContextVar("metering_tags", default={})
+
+
+@contextlib.contextmanager
+def metered(session_id: str = None, restaurant: str = None):
+    """Attributes the usage of every API request made in this context,
+    including tasks started from it, to the session and restaurant."""
+    token = _metering_tags.set({SESSION: session_id, RESTAURANT: restaurant})
+    try:
+        yield
+    finally:
+        _metering_tags.reset(token)
+
+
+class UsageMeter:
+    """Prices every completion and speech request and totals them by
+    session, restaurant, day, function and model, optionally appending each
+    record to a JSONL file from a background thread, so recording only costs
+    a queue put."""
+
+    def __init__(
+        self,
+        budgets: Dict[str, Budget] = None,
+        fallback_model: str = None,
+        path: str = None,
+    ):
+        self.budgets = budgets or {}
+        self.fallback_model = fallback_model
+        self.path = path
+        self.totals: Dict[str, Dict[str, UsageTotals]] = {
+            scope: {} for scope in (SESSION, RESTAURANT, DAY, FUNCTION, MODEL)
+        }
+        self._lock = threading.Lock()
+
+        self._records: Optional[queue.SimpleQueue] = None
+        self._writer: Optional[threading.Thread] = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._records = queue.SimpleQueue()
+            self._writer = threading.Thread(
+                target=self._write_records, name="usage-writer", daemon=True
+            )
+            self._writer.start()
+            atexit.register(self.close)
+
+    def close(self, timeout: float = 5):
+        """Writes out the records still queued and stops the writer."""
+        if self._writer is not None and self._writer.is_alive():
+            self._records.put(None)
+            self._writer.join(timeout)
+
+    def _write_records(self):
+        with open(self.path, "a") as f:
+            while True:
+                record = self._records.get()
+                if record is None:
+                    return
+                f.write(json.dumps(asdict(record)) + "\n")
+                if self._records.empty():
+                    f.flush()
+
+    def _scope_keys(self, tags: Dict[str, str], day: str) -> Dict[str, str]:
+        return {SESSION: tags.get(SESSION), RESTAURANT: tags.get(RESTAURANT), DAY: day}
+
+    def _spent(self, scope: str, key: Optional[str]) -> float:
+        totals = self.totals[scope].get(key)
+        return totals.cost if totals else 0.0
+
+    def check_budget(self) -> bool:
+        """Raises once a hard budget is spent in this context and returns
+        whether a soft budget is."""
+        keys = self._scope_keys(_metering_tags.get(), datetime.date.today().isoformat())
+        with self._lock:
+            spent = {
+                scope: self._spent(scope, keys[scope])
+                for scope in self.budgets
+                if keys[scope] is not None
+            }
+
+        over_soft = False
+        for scope, cost in spent.items():
+            budget = self.budgets[scope]
+            if budget.hard_limit is not None and cost >= budget.hard_limit:
+                raise BudgetExceededException(
+                    f"Hard {scope} budget of ${budget.hard_limit:.4f} spent "
+                    f"for {keys[scope]}"
+                )
+            if budget.soft_limit is not None and cost >= budget.soft_limit:
+                over_soft = True
+        return over_soft
+
+    def select_model(self, model: str) -> str:
+        """Returns the model to call in this context, raising once a hard
+        budget is spent and falling back once a soft budget is."""
+        if self.check_budget() and self.fallback_model:
+            return self.fallback_model
+        return model
+
+    def record(self, record: UsageRecord) -> UsageRecord:
+        tags = _metering_tags.get()
+        if record.session_id is None:
+            record.session_id = tags.get(SESSION)
+        if record.restaurant is None:
+            record.restaurant = tags.get(RESTAURANT)
+
+        keys = {
+            SESSION: record.session_id,
+            RESTAURANT: record.restaurant,
+            DAY: record.day,
+            FUNCTION: record.fn_name or record.endpoint,
+            MODEL: record.model,
+        }
+        with self._lock:
+            for scope, key in keys.items():
+                if key is not None:
+                    self.totals[scope].setdefault(key, UsageTotals()).add(record)
+        if self._records is not None:
+            self._records.put(record)
+        return record
+
+    def record_completion(
+        self, model: str, fn_name: str, usage, latency: float, turn: int = None
+    ) -> Optional[UsageRecord]:
+        if usage is None:
+            return None
+        prompt_details = getattr(usage, "prompt_tokens_details", None)
+        return self.record(
+            UsageRecord(
+                CHAT_COMPLETIONS,
+                model,
+                fn_name=fn_name,
+                turn=turn,
+                prompt_tokens=usage.prompt_tokens,
+                completion_tokens=usage.completion_tokens,
+                cached_tokens=getattr(prompt_details, "cached_tokens", None) or 0,
+                latency=latency,
+            )
+        )
+
+    def record_speech(self, model: str, text: str, latency: float) -> UsageRecord:
+        return self.record(
+            UsageRecord(SPEECH, model, tts_chars=len(text), latency=latency)
+        )
+
+    def session_totals(self, session_id: str) -> Dict:
+        with self._lock:
+            totals = self.totals[SESSION].get(session_id) or UsageTotals()
+            return totals.as_dict()
+
+    def end_session(self, session_id: str) -> Dict:
+        """Forgets the session's totals, which a long running server would
+        otherwise keep for every session, and returns them."""
+        with self._lock:
+            totals = self.totals[SESSION].pop(session_id, None) or UsageTotals()
+            return totals.as_dict()
+
+    def report(self) -> Dict[str, Dict[str, Dict]]:
+        with self._lock:
+            return {
+                scope: {key: totals.as_dict() for key, totals in by_key.items()}
+                for scope, by_key in self.totals.items()
+            }
+
+
+_usage_meter = UsageMeter()
+_usage_meter_lock = threading.Lock()
+
+
+def get_usage_meter() -> UsageMeter:
+    with _usage_meter_lock:
+        return _usage_meter
+
+
+def set_usage_meter(meter: UsageMeter):
+    global _usage_meter
+    with _usage_meter_lock:
+        previous, _usage_meter = _usage_meter, meter
+    if previous is not meter:
+        previous.close()
+
+
+def configure_metering(
+    session_budget: str = None,
+    restaurant_budget: str = None,
+    daily_budget: str = None,
+    fallback_model: str = None,
+    path: str = None,
+):
+    """Replaces the usage meter, with budgets given as "soft,hard" USD."""
+    specs = {SESSION: session_budget, RESTAURANT: restaurant_budget, DAY: daily_budget}
+    budgets = {
+        scope: Budget.parse(scope, spec) for scope, spec in specs.items() if spec
+    }
+    set_usage_meter(UsageMeter(budgets, fallback_model, path))
@@ -0,0 +1,98 @@
+from typing import List
+
+VOWELS = "AEIOU"
+FRONT_VOWELS = "EIY"
+# Doubled letters collapse to a single sound except for C, "accent" -> "AKSNT"
+DOUBLE_EXCEPTIONS = "C"
+
+
+def metaphone(word: str) -> str:
+    """Simplified Metaphone code for a single word."""
+    word = "".join(c for c in word.upper() if c.isalpha())
+    if not word:
+        return ""
+
+    for prefix, replacement in (
+        ("AE", "E"),
+        ("GN", "N"),
+        ("KN", "N"),
+        ("PN", "N"),
+        ("WR", "R"),
+        ("X", "S"),
+        ("WH", "W"),
+    ):
+        if word.startswith(prefix):
+            word = replacement + word[len(prefix) :]
+            break
+
+    code = []
+    length = len(word)
+    for i, c in enumerate(word):
+        prev = word[i - 1] if i > 0 else ""
+        nxt = word[i + 1] if i + 1 < length else ""
+        after = word[i + 2] if i + 2 < length else ""
+
+        if c == prev and c not in DOUBLE_EXCEPTIONS:
+            continue
+
+        if c in VOWELS:
+            if i == 0:
+                code.append(c)
+        elif c == "B":
+            if not (prev == "M" and i == length - 1):
+                code.append("B")
+        elif c == "C":
+            if nxt == "I" and after == "A" or nxt == "H":
+                code.append("X")
+            elif nxt in FRONT_VOWELS:
+                if prev != "S":
+                    code.append("S")
+            else:
+                code.append("K")
+        elif c == "D":
+            code.append("J" if nxt == "G" and after in FRONT_VOWELS else "T")
+        elif c == "G":
+            if nxt == "H" and after not in VOWELS and after:
+                continue
+            if nxt == "N" and (i + 2 == length or word[i + 2 :] == "ED"):
+                continue
+            code.append("J" if nxt in FRONT_VOWELS and prev != "G" else "K")
+        elif c == "H":
+            if prev not in "CSPTG" and nxt in VOWELS and nxt:
+                code.append("H")
+        elif c == "K":
+            if prev != "C":
+                code.append("K")
+        elif c == "P":
+            code.append("F" if nxt == "H" else "P")
+        elif c == "Q":
+            code.append("K")
+        elif c == "S":
+            if nxt == "H" or (nxt == "I" and after in "OA" and after):
+                code.append("X")
+            else:
+                code.append("S")
+        elif c == "T":
+            if nxt == "I" and after in "OA" and after:
+                code.append("X")
+            elif nxt == "H":
+                code.append("0")
+            elif not (nxt == "C" and after == "H"):
+                code.append("T")
+        elif c == "V":
+            code.append("F")
+        elif c in "WY":
+            if nxt in VOWELS and nxt:
+                code.append(c)
+        elif c == "X":
+            code.append("KS")
+        elif c == "Z":
+            code.append("S")
+        else:
+            code.append(c)
+
+    return "".join(code)
+
+
+def phonetic_tokens(text: str) -> List[str]:
+    return [code for code in (metaphone(word) for word in text.split()) if code]
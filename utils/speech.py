@@ -1,40 +1,178 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
 import io
+import os
 import subprocess
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Iterable, List
 
 import pyttsx3
 import speech_recognition as sr
 from gtts import gTTS
 
 from models.api import ApiVoices
+from utils.api_scheduler import SPEECH, Priority, api_priority, get_api_scheduler
+from utils.audio import BufferedAudio, Playback, get_audio_sink, tee_to_wav
+from utils.calibration import AmbientNoiseCalibrator
+from utils.metering import get_usage_meter
+from utils.stt import GoogleSpeechToText, SpeechToText, Transcript
+from utils.tracing import span, start_span
+from utils.tts_cache import get_speech_cache, speech_cache_key
+from utils.vad import ReplayStream, VoiceActivityDetector
+
+TTS_MODEL = "tts-1"
+TTS_SPEED = 1.4
+TTS_STREAM_CHUNK_SIZE = 4096
+
+# Stream raw PCM straight into the audio sink instead of writing and playing
+# an mp3 file, set a tee filename to also keep a wav copy for debugging
+USE_STREAMING_SPEECH = True
+SPEECH_TEE_FILENAME = None
+
+# Fills the speech cache with stock phrases without competing with live speech
+PREWARM_CONCURRENCY = 2
+
+default_speech_to_text = GoogleSpeechToText()
+
+
+@dataclass
+class MicrophoneInput:
+    recognizer: sr.Recognizer
+    microphone: sr.Microphone
+    # The microphone can only be opened by one caller at a time, and blocking
+    # reads still running in a worker thread after a cancel must finish first
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    voice_activity_detector: VoiceActivityDetector = field(
+        default_factory=VoiceActivityDetector
+    )
+    calibrator: AmbientNoiseCalibrator = field(init=False)
+
+    def __post_init__(self):
+        self.calibrator = AmbientNoiseCalibrator(
+            self.recognizer,
+            self.microphone,
+            self.lock,
+            detector=self.voice_activity_detector,
+        )
+        # The customer talking over the agent cuts its speech off right away
+        self.voice_activity_detector.on_speech.append(_interrupt_speech)
+
+
+# Opening the microphone needs a local audio device, so it is only set up on
+# first use and importing this module stays safe for the server
+_microphone_input = None
+_microphone_input_lock = threading.Lock()
 
-recognizer = sr.Recognizer()
-microphone = sr.Microphone()
+
+def get_microphone_input() -> MicrophoneInput:
+    global _microphone_input
+    with _microphone_input_lock:
+        if _microphone_input is None:
+            _microphone_input = MicrophoneInput(sr.Recognizer(), sr.Microphone())
+        return _microphone_input
+
+
+def _interrupt_speech():
+    get_audio_sink().interrupt()
+
+
+def set_barge_in(enabled: bool):
+    detector = get_microphone_input().voice_activity_detector
+    detector.enabled = enabled
+    if not enabled:
+        detector.take_frames()
+
+
+async def wait_for_barge_in():
+    await get_microphone_input().voice_activity_detector.wait_async()
 
 
 def adjust_for_ambient_noise():
-    with microphone as source:
-        recognizer.adjust_for_ambient_noise(source)
+    mic = get_microphone_input()
+    with mic.calibrator.paused(), mic.lock, mic.microphone as source:
+        mic.recognizer.adjust_for_ambient_noise(source)
 
 
 async def adjust_for_ambient_noise_async():
-    adjust_for_ambient_noise()
+    # Calibration runs continuously in the background, so there is nothing
+    # to wait for here
+    start_ambient_noise_calibration()
 
 
-def listen(logger) -> str:
-    with microphone as source:
-        logger.debug("Listening for input...")
-        audio_text = recognizer.listen(source)
-        # recoginize_() method will throw a request error if the API is unreachable, hence using exception handling
+def start_ambient_noise_calibration():
+    get_microphone_input().calibrator.start()
+
+
+def stop_ambient_noise_calibration(timeout: float = None):
+    # Nothing to stop when the microphone was never opened
+    with _microphone_input_lock:
+        mic = _microphone_input
+    if mic is not None:
+        mic.calibrator.stop(timeout)
 
-        response = None
-        try:
-            response = recognizer.recognize_google(audio_text)
-            # using google speech recognition
-            logger.debug(f"Your input was: {response}")
-        except Exception as e:
-            logger.debug("Sorry, I did not get that")
 
-    return response
+def listen(
+    logger,
+    speech_to_text: SpeechToText = None,
+    on_partial: Callable[[str], None] = None,
+) -> str:
+    return listen_for_transcript(logger, speech_to_text, on_partial).text
+
+
+def listen_for_transcript(
+    logger,
+    speech_to_text: SpeechToText = None,
+    on_partial: Callable[[str], None] = None,
+) -> Transcript:
+    speech_to_text = speech_to_text or default_speech_to_text
+    mic = get_microphone_input()
+    with span("listen", backend=speech_to_text.name) as listen_span:
+        with mic.calibrator.paused(), mic.lock, mic.microphone as source:
+            logger.debug("Listening for input...")
+            # Speech that interrupted the agent was already captured, so the
+            # recognizer starts from the beginning of the utterance
+            barge_in_frames = mic.voice_activity_detector.take_frames()
+            if barge_in_frames:
+                source.stream = ReplayStream(source.stream, barge_in_frames)
+            transcript = speech_to_text.listen(mic.recognizer, source, on_partial)
+        listen_span.set(
+            chars=len(transcript.text or ""),
+            partials=transcript.partials,
+            recognition_latency=transcript.latency,
+            barge_in_frames=len(barge_in_frames),
+        )
+
+    if transcript.text:
+        logger.debug(f"Your input was: {transcript.text}")
+    else:
+        logger.debug("Sorry, I did not get that")
+    logger.debug(
+        f"Recognized by {transcript.backend} in {transcript.latency * 1000:.0f}ms "
+        f"(average {speech_to_text.average_latency * 1000:.0f}ms)"
+    )
+    return transcript
+
+
+async def listen_async(
+    logger,
+    speech_to_text: SpeechToText = None,
+    on_partial: Callable[[str], None] = None,
+) -> str:
+    loop = asyncio.get_running_loop()
+
+    def on_partial_threadsafe(text: str):
+        # Partials arrive on the listening thread, hand them to the loop
+        loop.call_soon_threadsafe(on_partial, text)
+
+    # The microphone only offers blocking reads, so they run off the loop
+    return await asyncio.to_thread(
+        listen, logger, speech_to_text, on_partial and on_partial_threadsafe
+    )
 
 
 def speak(text: str, filename: str = "order_playback.mp3"):
@@ -56,27 +194,259 @@ def speak(text: str, filename: str = "order_playback.mp3"):
     subprocess.call(["afplay", filename])
 
 
-def speak_new(
-    client,
+async def synthesize_speech_bytes_async(
+    async_client,
+    text: str,
+    voice_selection=ApiVoices.ONYX.value,
+    response_format: str = "mp3",
+    persist: bool = False,
+) -> bytes:
+    cache = get_speech_cache()
+    key = speech_cache_key(text, voice_selection, TTS_MODEL, TTS_SPEED, response_format)
+    audio = await cache.get_async(key)
+    if audio is None:
+        # Speech is billed too, so a spent hard budget stops it like it
+        # stops completions
+        get_usage_meter().check_budget()
+        started = time.perf_counter()
+        with span("tts", chars=len(text), format=response_format) as tts_span:
+            response = await get_api_scheduler(SPEECH).run_async(
+                lambda: async_client.audio.speech.create(
+                    model=TTS_MODEL,
+                    voice=voice_selection,
+                    input=text,
+                    speed=TTS_SPEED,
+                    response_format=response_format,
+                )
+            )
+            audio = response.content
+            get_usage_meter().record_speech(
+                TTS_MODEL, text, time.perf_counter() - started
+            )
+            tts_span.set(bytes=len(audio))
+        cache.put(key, audio, persist=persist)
+    return audio
+
+
+async def synthesize_speech_async(
+    async_client,
+    text: str,
+    filename: str,
+    voice_selection=ApiVoices.ONYX.value,
+) -> str:
+    audio = await synthesize_speech_bytes_async(
+        async_client, text, voice_selection=voice_selection
+    )
+    with open(filename, "wb") as f:
+        f.write(audio)
+
+    return filename
+
+
+async def stream_speech_async(
+    async_client,
+    text: str,
+    voice_selection=ApiVoices.ONYX.value,
+    persist: bool = False,
+) -> AsyncIterator[bytes]:
+    cache = get_speech_cache()
+    key = speech_cache_key(text, voice_selection, TTS_MODEL, TTS_SPEED, "pcm")
+    audio = await cache.get_async(key)
+    if audio is not None:
+        for i in range(0, len(audio), TTS_STREAM_CHUNK_SIZE):
+            yield audio[i : i + TTS_STREAM_CHUNK_SIZE]
+        return
+
+    get_usage_meter().check_budget()
+    received = []
+    # Not the current span, the consumer keeps running between chunks
+    tts_span = start_span("tts", chars=len(text), format="pcm")
+    started = time.perf_counter()
+    error = None
+    try:
+        async with contextlib.AsyncExitStack() as stack:
+            # A rate limited response fails on entering, before any audio
+            response = await get_api_scheduler(SPEECH).run_async(
+                lambda: stack.enter_async_context(
+                    async_client.audio.speech.with_streaming_response.create(
+                        model=TTS_MODEL,
+                        voice=voice_selection,
+                        input=text,
+                        speed=TTS_SPEED,
+                        response_format="pcm",
+                    )
+                )
+            )
+            get_usage_meter().record_speech(
+                TTS_MODEL, text, time.perf_counter() - started
+            )
+            async for chunk in response.iter_bytes(TTS_STREAM_CHUNK_SIZE):
+                if not received:
+                    tts_span.set(first_chunk=tts_span.duration)
+                received.append(chunk)
+                yield chunk
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        tts_span.set(bytes=sum(map(len, received)))
+        tts_span.finish(error=error)
+
+    # Only cache audio that was received completely
+    cache.put(key, b"".join(received), persist=persist)
+
+
+async def _drain_speech_stream_async(
+    async_client, text: str, voice_selection=ApiVoices.ONYX.value, persist=False
+):
+    async for _ in stream_speech_async(
+        async_client, text, voice_selection=voice_selection, persist=persist
+    ):
+        pass
+
+
+def prewarm_speech_async(
+    async_client, phrases: Iterable[str], voice_selection=ApiVoices.ONYX.value
+) -> List[asyncio.Task]:
+    response_format = "pcm" if USE_STREAMING_SPEECH else "mp3"
+    cache = get_speech_cache()
+    semaphore = asyncio.Semaphore(PREWARM_CONCURRENCY)
+    synthesize = (
+        _drain_speech_stream_async
+        if USE_STREAMING_SPEECH
+        else synthesize_speech_bytes_async
+    )
+
+    async def prewarm(phrase: str):
+        # Cache warming yields to live turns and filler speech
+        with api_priority(Priority.BACKGROUND):
+            async with semaphore:
+                # Stock phrases are kept on disk, one off replies only in
+                # memory
+                await synthesize(
+                    async_client, phrase, voice_selection=voice_selection, persist=True
+                )
+
+    tasks = []
+    for phrase in dict.fromkeys(phrases):
+        key = speech_cache_key(
+            phrase, voice_selection, TTS_MODEL, TTS_SPEED, response_format
+        )
+        if key not in cache:
+            tasks.append(asyncio.create_task(prewarm(phrase)))
+    return tasks
+
+
+def prefetch_speech_async(
+    async_client, text: str, voice_selection=ApiVoices.ONYX.value
+) -> asyncio.Task | BufferedAudio:
+    if USE_STREAMING_SPEECH:
+        return BufferedAudio.from_async(
+            stream_speech_async(async_client, text, voice_selection=voice_selection)
+        )
+    return asyncio.create_task(
+        synthesize_speech_bytes_async(
+            async_client, text, voice_selection=voice_selection
+        )
+    )
+
+
+async def speak_streaming_async(
+    async_client,
+    text: str,
+    voice_selection=ApiVoices.ONYX.value,
+    blocking=True,
+    tee_filename: str = None,
+) -> Playback:
+    buffered = BufferedAudio.from_async(
+        stream_speech_async(async_client, text, voice_selection=voice_selection)
+    )
+    return await play_buffered_speech_async(buffered, blocking, tee_filename)
+
+
+async def play_buffered_speech_async(
+    buffered: BufferedAudio, blocking=True, tee_filename: str = None
+) -> Playback:
+    chunks = buffered
+    tee_filename = tee_filename or SPEECH_TEE_FILENAME
+    if tee_filename:
+        chunks = tee_to_wav(chunks, tee_filename)
+    try:
+        return await get_audio_sink().play_async(chunks, blocking=blocking)
+    except asyncio.CancelledError:
+        buffered.cancel()
+        raise
+
+
+async def speak_async(
+    async_client,
     text: str,
     filename: str = "order_playback.mp3",
     voice_selection=ApiVoices.ONYX.value,
     blocking=True,
 ):
-    response = client.audio.speech.create(
-        model="tts-1",
-        voice=voice_selection,
-        input=text,
-        speed=1.4
-    )
+    with span("speak", chars=len(text), blocking=blocking):
+        if USE_STREAMING_SPEECH:
+            return await speak_streaming_async(
+                async_client, text, voice_selection=voice_selection, blocking=blocking
+            )
 
-    response.stream_to_file(filename)
+        await synthesize_speech_async(
+            async_client, text, filename, voice_selection=voice_selection
+        )
+        return await play_speech_file_async(filename, blocking=blocking)
+
+
+async def play_prefetched_speech_async(
+    prefetched: asyncio.Task | BufferedAudio, blocking=True
+):
+    if isinstance(prefetched, BufferedAudio):
+        return await play_buffered_speech_async(prefetched, blocking=blocking)
+    return await play_speech_bytes_async(await prefetched, blocking=blocking)
+
+
+async def play_speech_bytes_async(audio: bytes, blocking=True):
+    """Plays mp3 audio from a temporary file, removed once playback ends."""
+    with tempfile.NamedTemporaryFile(
+        prefix="orderly_", suffix=".mp3", delete=False
+    ) as f:
+        f.write(audio)
+    return await play_speech_file_async(f.name, blocking=blocking, delete=True)
+
+
+# Keeps the cleanup of files still playing in the background from being
+# garbage collected before it runs
+_speech_file_cleanups = set()
+
+
+async def play_speech_file_async(filename: str, blocking=True, delete=False):
+    try:
+        process = await asyncio.create_subprocess_exec("afplay", filename)
+    except BaseException:
+        if delete:
+            os.remove(filename)
+        raise
+
+    if delete:
+        cleanup = asyncio.create_task(_remove_after_playback(process, filename))
+        _speech_file_cleanups.add(cleanup)
+        cleanup.add_done_callback(_speech_file_cleanups.discard)
 
-    # Playing the converted file
     if blocking:
-        play_mp3(filename)
-    else:
-        play_mp3_non_blocking(filename)
+        try:
+            await process.wait()
+        except asyncio.CancelledError:
+            process.terminate()
+            raise
+    return process
+
+
+async def _remove_after_playback(process, filename: str):
+    try:
+        await process.wait()
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(filename)
 
 
 def play_mp3_non_blocking(file_path):
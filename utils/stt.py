@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from dataclasses import dataclass
+from enum import Enum
+from functools import lru_cache
+from typing import Callable, Dict, Optional, Type
+
+import speech_recognition as sr
+
+try:
+    import vosk
+except ImportError:  # the local engine is optional
+    vosk = None
+
+
+class SttBackend(Enum):
+    GOOGLE = "google"
+    WHISPER = "whisper"
+    VOSK = "vosk"
+
+
+DEFAULT_STT_BACKEND = SttBackend.GOOGLE.value
+
+DEFAULT_VOSK_MODEL_PATH = os.getenv("VOSK_MODEL_PATH", "assets/vosk-model-small-en-us")
+DEFAULT_WHISPER_MODEL = "base.en"
+# Longest utterance a streaming engine listens to before finalizing
+DEFAULT_PHRASE_TIME_LIMIT = 15
+
+
+@dataclass
+class Transcript:
+    text: Optional[str]
+    backend: str
+    # Seconds from the end of the utterance to its final transcript
+    latency: float
+    partials: int = 0
+
+
+class SpeechToText:
+    """Turns one utterance into text, either live from an open microphone or
+    from audio that was already recorded."""
+
+    name: str = None
+    streams_partials: bool = False
+
+    def __init__(self):
+        self.utterances = 0
+        self.recognized = 0
+        self.total_latency = 0.0
+
+    @property
+    def average_latency(self) -> float:
+        return self.total_latency / self.utterances if self.utterances else 0.0
+
+    def listen(
+        self,
+        recognizer: sr.Recognizer,
+        source: sr.AudioSource,
+        on_partial: Callable[[str], None] = None,
+    ) -> Transcript:
+        return self._record(self._listen(recognizer, source, on_partial))
+
+    def transcribe(self, audio: sr.AudioData) -> Transcript:
+        return self._record(self._transcribe(audio))
+
+    def _record(self, transcript: Transcript) -> Transcript:
+        self.utterances += 1
+        self.recognized += bool(transcript.text)
+        self.total_latency += transcript.latency
+        return transcript
+
+    def _transcribe(self, audio: sr.AudioData) -> Transcript:
+        raise NotImplementedError
+
+    def _listen(
+        self,
+        recognizer: sr.Recognizer,
+        source: sr.AudioSource,
+        on_partial: Callable[[str], None],
+    ) -> Transcript:
+        raise NotImplementedError
+
+
+class RecognizerSpeechToText(SpeechToText):
+    """Records the whole utterance, then hands it to one of the
+    speech_recognition recognize_* engines."""
+
+    recognize_method: str = None
+
+    def __init__(self, **recognize_kwargs):
+        super().__init__()
+        self.recognize_kwargs = recognize_kwargs
+
+    def _listen(self, recognizer, source, on_partial):
+        return self._recognize(recognizer, recognizer.listen(source))
+
+    def _transcribe(self, audio):
+        return self._recognize(sr.Recognizer(), audio)
+
+    def _recognize(self, recognizer: sr.Recognizer, audio: sr.AudioData):
+        started = time.perf_counter()
+        try:
+            text = getattr(recognizer, self.recognize_method)(
+                audio, **self.recognize_kwargs
+            )
+        except Exception:
+            text = None
+        return Transcript(
+            text=text or None,
+            backend=self.name,
+            latency=time.perf_counter() - started,
+        )
+
+
+class GoogleSpeechToText(RecognizerSpeechToText):
+    name = SttBackend.GOOGLE.value
+    recognize_method = "recognize_google"
+
+
+class WhisperSpeechToText(RecognizerSpeechToText):
+    name = SttBackend.WHISPER.value
+    recognize_method = "recognize_whisper"
+
+    def __init__(self, model: str = DEFAULT_WHISPER_MODEL, **recognize_kwargs):
+        super().__init__(model=model, language="english", **recognize_kwargs)
+
+
+@lru_cache(maxsize=None)
+def _load_vosk_model(model_path: str):
+    # Models are large and read only, so every session shares one copy
+    return vosk.Model(model_path)
+
+
+class VoskSpeechToText(SpeechToText):
+    """Decodes the microphone buffer by buffer on the CPU, reporting partial
+    transcripts while the customer is still speaking."""
+
+    name = SttBackend.VOSK.value
+    streams_partials = True
+
+    def __init__(
+        self,
+        model_path: str = DEFAULT_VOSK_MODEL_PATH,
+        phrase_time_limit: float = DEFAULT_PHRASE_TIME_LIMIT,
+    ):
+        if vosk is None:
+            raise ImportError("The vosk package is required for the vosk backend")
+        super().__init__()
+        self.model = _load_vosk_model(model_path)
+        self.phrase_time_limit = phrase_time_limit
+
+    def _listen(self, recognizer, source, on_partial):
+        decoder = vosk.KaldiRecognizer(self.model, source.SAMPLE_RATE)
+        seconds_per_buffer = source.CHUNK / source.SAMPLE_RATE
+
+        partial = ""
+        partials = 0
+        elapsed = 0.0
+        # Latency is what the customer waits for, from the last buffer that
+        # still changed the transcript to the final result
+        speech_ended = None
+        read_at = time.perf_counter()
+        while elapsed < self.phrase_time_limit:
+            buffer = source.stream.read(source.CHUNK)
+            read_at = time.perf_counter()
+            elapsed += seconds_per_buffer
+
+            if decoder.AcceptWaveform(buffer):
+                # The engine detected the end of the utterance
+                text = json.loads(decoder.Result())["text"]
+                if text:
+                    return Transcript(
+                        text=text,
+                        backend=self.name,
+                        latency=time.perf_counter() - (speech_ended or read_at),
+                        partials=partials,
+                    )
+                # Only noise so far, keep listening for speech
+                speech_ended = None
+                continue
+
+            current = json.loads(decoder.PartialResult())["partial"]
+            if current and current != partial:
+                partial = current
+                partials += 1
+                speech_ended = read_at
+                if on_partial:
+                    on_partial(partial)
+
+        text = json.loads(decoder.FinalResult())["text"]
+        return Transcript(
+            text=text or None,
+            backend=self.name,
+            latency=time.perf_counter() - (speech_ended or read_at),
+            partials=partials,
+        )
+
+    def _transcribe(self, audio):
+        started = time.perf_counter()
+        decoder = vosk.KaldiRecognizer(self.model, audio.sample_rate)
+        decoder.AcceptWaveform(audio.get_raw_data(convert_width=2))
+        text = json.loads(decoder.FinalResult())["text"]
+        return Transcript(
+            text=text or None,
+            backend=self.name,
+            latency=time.perf_counter() - started,
+        )
+
+
+STT_BACKENDS: Dict[str, Type[SpeechToText]] = {
+    SttBackend.GOOGLE.value: GoogleSpeechToText,
+    SttBackend.WHISPER.value: WhisperSpeechToText,
+    SttBackend.VOSK.value: VoskSpeechToText,
+}
+
+
+def register_stt_backend(name: str, backend: Type[SpeechToText]):
+    STT_BACKENDS[name] = backend
+
+
+def get_speech_to_text(name: str = DEFAULT_STT_BACKEND, **kwargs) -> SpeechToText:
+    return STT_BACKENDS[name](**kwargs)
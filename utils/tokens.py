@@ -0,0 +1,28 @@
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # token counts fall back to a character estimate
+    tiktoken = None
+
+# Which counter token counts came from, counts cached on disk are only
+# reused by the same one
+TOKENIZER = "chars" if tiktoken is None else f"tiktoken-{tiktoken.__version__}"
+
+# Rough average for English menu text when tiktoken is unavailable
+CHARS_PER_TOKEN = 4
+FALLBACK_ENCODING = "o200k_base"
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(FALLBACK_ENCODING)
+
+
+def count_tokens(text: str, model: str) -> int:
+    if tiktoken is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(_get_encoding(model).encode(text))
@@ -0,0 +1,332 @@
+from __future__ import annotations
+
+import asyncio
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Type
+
+SERVICE_NAME = "orderly"
+DEFAULT_TRACE_FORMAT = "jsonl"
+
+# Log spaced from 1ms to about 17 minutes
+HISTOGRAM_BUCKETS = tuple(0.001 * 2 ** (i / 2) for i in range(41))
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+_session_id: ContextVar[Optional[str]] = ContextVar("trace_session_id", default=None)
+_turn_id: ContextVar[Optional[int]] = ContextVar("trace_turn_id", default=None)
+
+
+@contextmanager
+def trace_session(session_id: str):
+    token = _session_id.set(session_id)
+    try:
+        yield
+    finally:
+        _session_id.reset(token)
+
+
+def set_trace_turn(turn: int):
+    _turn_id.set(turn)
+
+
+class Span:
+    __slots__ = (
+        "tracer",
+        "name",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "start",
+        "end",
+        "attributes",
+        "error",
+    )
+
+    def __init__(self, tracer: Tracer, name: str, parent: Optional[Span], attributes):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.start = time.time_ns()
+        self.end = None
+        self.attributes = attributes
+        self.error = None
+
+    @property
+    def duration(self) -> float:
+        return ((self.end or time.time_ns()) - self.start) / 1e9
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self, error: BaseException = None):
+        if self.end is not None:
+            return
+        self.end = time.time_ns()
+        if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+            # Interrupted by a barge in or shutdown, not a failure
+            self.attributes["cancelled"] = True
+        elif error is not None:
+            self.error = repr(error)
+        self.tracer._finished(self)
+
+    def as_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "end": self.end,
+            "duration": self.duration,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    """Stands in for every span while tracing is off."""
+
+    duration = 0.0
+
+    def set(self, **attributes):
+        pass
+
+    def finish(self, error: BaseException = None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(HISTOGRAM_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p: float) -> float:
+        """Upper bound of the bucket holding the percentile, capped at the
+        slowest observation."""
+        rank = self.count * p / 100
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(HISTOGRAM_BUCKETS[i], self.max) if i < len(HISTOGRAM_BUCKETS) else self.max
+        return self.max
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+class Tracer:
+    enabled = True
+
+    def __init__(self, exporter: SpanExporter = None):
+        self.exporter = exporter
+        self.histograms: Dict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+        self._lock = threading.Lock()
+
+    def start_span(self, name: str, **attributes) -> Span:
+        """Starts a span without making it the parent of spans started after
+        it, for work that outlives the caller, like a playback or a stream."""
+        session_id = _session_id.get()
+        if session_id is not None:
+            attributes["session.id"] = session_id
+        turn_id = _turn_id.get()
+        if turn_id is not None:
+            attributes["turn.id"] = turn_id
+        return Span(self, name, _current_span.get(), attributes)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        span = self.start_span(name, **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.finish(error=e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.finish()
+
+    def _finished(self, span: Span):
+        with self._lock:
+            self.histograms[span.name].observe(span.duration)
+        if self.exporter is not None:
+            self.exporter.export(span)
+
+    def latency_report(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {name: h.snapshot() for name, h in self.histograms.items()}
+
+    def close(self):
+        if self.exporter is not None:
+            self.exporter.close()
+
+
+class NoopTracer(Tracer):
+    enabled = False
+
+    def start_span(self, name: str, **attributes) -> _NoopSpan:
+        return NOOP_SPAN
+
+    def span(self, name: str, **attributes) -> _NoopSpan:
+        return NOOP_SPAN
+
+
+class SpanExporter:
+    """Writes finished spans to a file from a background thread, so ending a
+    span only costs a queue put."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        self._worker = threading.Thread(
+            target=self._run, name="span-exporter", daemon=True
+        )
+        self._worker.start()
+        atexit.register(self.close)
+
+    def export(self, span: Span):
+        self._queue.put(span)
+
+    def close(self, timeout: float = 5):
+        if self._worker.is_alive():
+            self._queue.put(None)
+            self._worker.join(timeout)
+
+    def _run(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a") as f:
+            while True:
+                span = self._queue.get()
+                if span is None:
+                    return
+                f.write(json.dumps(self.format(span), default=str) + "\n")
+                if self._queue.empty():
+                    f.flush()
+
+    def format(self, span: Span) -> Dict:
+        raise NotImplementedError
+
+
+class JsonlSpanExporter(SpanExporter):
+    def format(self, span):
+        return span.as_dict()
+
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OtlpJsonSpanExporter(SpanExporter):
+    """One OTLP/JSON export request per line, the format read by the
+    OpenTelemetry collector's otlpjsonfile receiver."""
+
+    def format(self, span):
+        otlp_span = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            # SPAN_KIND_INTERNAL
+            "kind": 1,
+            "startTimeUnixNano": str(span.start),
+            "endTimeUnixNano": str(span.end),
+            "attributes": [
+                {"key": key, "value": _otlp_value(value)}
+                for key, value in span.attributes.items()
+            ],
+            # STATUS_CODE_OK or STATUS_CODE_ERROR
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+        if span.parent_id:
+            otlp_span["parentSpanId"] = span.parent_id
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {"key": "service.name", "value": _otlp_value(SERVICE_NAME)}
+                        ]
+                    },
+                    "scopeSpans": [
+                        {"scope": {"name": SERVICE_NAME}, "spans": [otlp_span]}
+                    ],
+                }
+            ]
+        }
+
+
+SPAN_EXPORTERS: Dict[str, Type[SpanExporter]] = {
+    "jsonl": JsonlSpanExporter,
+    "otlp": OtlpJsonSpanExporter,
+}
+
+
+def register_span_exporter(name: str, exporter: Type[SpanExporter]):
+    SPAN_EXPORTERS[name] = exporter
+
+
+_tracer: Tracer = NoopTracer()
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def set_tracer(tracer: Tracer):
+    global _tracer
+    _tracer = tracer
+
+
+def configure_tracing(path: str = None, trace_format: str = DEFAULT_TRACE_FORMAT):
+    """Turns tracing on, writing spans to path when given and always keeping
+    in process latency histograms per span name."""
+    exporter = SPAN_EXPORTERS[trace_format](path) if path else None
+    set_tracer(Tracer(exporter))
+
+
+def span(name: str, **attributes):
+    return _tracer.span(name, **attributes)
+
+
+def start_span(name: str, **attributes):
+    return _tracer.start_span(name, **attributes)
@@ -0,0 +1,211 @@
+import asyncio
+import atexit
+import hashlib
+import json
+import os
+import queue
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+DEFAULT_CACHE_DIR = ".tts_cache"
+DEFAULT_MAX_MEMORY_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_DISK_BYTES = 512 * 1024 * 1024
+
+
+def speech_cache_key(
+    text: str, voice: str, model: str, speed: float, response_format: str
+) -> str:
+    normalized = " ".join(text.split())
+    payload = json.dumps([normalized, voice, model, speed, response_format])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SpeechCache:
+    """Content addressed audio cache, a size bounded in memory LRU in front of
+    a size bounded directory of files. Only audio put with persist, like
+    pre-warmed stock phrases, goes to disk, written by a background thread
+    so a put never blocks the event loop. The files on disk are indexed
+    once at start and tracked after that instead of rescanned."""
+
+    def __init__(
+        self,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        max_memory_bytes: int = DEFAULT_MAX_MEMORY_BYTES,
+        max_disk_bytes: int = DEFAULT_MAX_DISK_BYTES,
+    ):
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        # Sizes of the files on disk by key, least recently used first
+        self._disk: OrderedDict[str, int] = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._writes: Optional[queue.SimpleQueue] = None
+        self._writer: Optional[threading.Thread] = None
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._index_disk()
+            self._writes = queue.SimpleQueue()
+            self._writer = threading.Thread(
+                target=self._write_disk, name="speech-cache-writer", daemon=True
+            )
+            self._writer.start()
+            atexit.register(self.close)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.audio")
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._memory or key in self._disk
+
+    def get(self, key: str) -> Optional[bytes]:
+        audio = self._get_memory(key)
+        if audio is None:
+            audio = self._get_disk(key, self._read_disk(key))
+        return audio
+
+    async def get_async(self, key: str) -> Optional[bytes]:
+        """Like get, reading a file on disk from a worker thread."""
+        audio = self._get_memory(key)
+        if audio is None:
+            audio = self._get_disk(key, await asyncio.to_thread(self._read_disk, key))
+        return audio
+
+    def put(self, key: str, audio: bytes, persist: bool = False):
+        with self._lock:
+            self._put_memory(key, audio)
+        if persist and self._writes is not None:
+            self._writes.put((key, audio))
+
+    def invalidate(self, key: str):
+        with self._lock:
+            audio = self._memory.pop(key, None)
+            if audio is not None:
+                self._memory_bytes -= len(audio)
+            self._disk_bytes -= self._disk.pop(key, 0)
+        if self.cache_dir:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def close(self, timeout: float = 5):
+        """Writes out the audio still queued and stops the writer."""
+        if self._writer is not None and self._writer.is_alive():
+            self._writes.put(None)
+            self._writer.join(timeout)
+
+    def _get_memory(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+            return audio
+
+    def _get_disk(self, key: str, audio: Optional[bytes]) -> Optional[bytes]:
+        with self._lock:
+            if audio is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if key in self._disk:
+                self._disk.move_to_end(key)
+            self._put_memory(key, audio)
+        return audio
+
+    def _put_memory(self, key: str, audio: bytes):
+        if len(audio) > self.max_memory_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+        self._memory[key] = audio
+        self._memory_bytes += len(audio)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _index_disk(self):
+        entries = [
+            entry
+            for entry in os.scandir(self.cache_dir)
+            if entry.is_file() and entry.name.endswith(".audio")
+        ]
+        for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+            size = entry.stat().st_size
+            self._disk[entry.name[: -len(".audio")]] = size
+            self._disk_bytes += size
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            if key not in self._disk:
+                return None
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            # Evicted by another process sharing the directory
+            with self._lock:
+                self._disk_bytes -= self._disk.pop(key, 0)
+            return None
+
+    def _write_disk(self):
+        while True:
+            write = self._writes.get()
+            if write is None:
+                return
+            key, audio = write
+            path = self._path(key)
+            # Write then rename so concurrent readers never see partial audio
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                with open(temp_path, "wb") as f:
+                    f.write(audio)
+                os.replace(temp_path, path)
+            except OSError:
+                # The cache is only an optimization, so a full or read only
+                # disk just means the audio is synthesized again
+                continue
+
+            with self._lock:
+                self._disk_bytes += len(audio) - self._disk.pop(key, 0)
+                self._disk[key] = len(audio)
+                evicted = []
+                while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+                    evicted_key, size = self._disk.popitem(last=False)
+                    self._disk_bytes -= size
+                    evicted.append(evicted_key)
+            for evicted_key in evicted:
+                try:
+                    os.remove(self._path(evicted_key))
+                except FileNotFoundError:
+                    pass
+
+
+_speech_cache = None
+_speech_cache_lock = threading.Lock()
+
+
+def get_speech_cache() -> SpeechCache:
+    global _speech_cache
+    with _speech_cache_lock:
+        if _speech_cache is None:
+            _speech_cache = SpeechCache()
+        return _speech_cache
+
+
+def set_speech_cache(cache: Optional[SpeechCache]):
+    global _speech_cache
+    with _speech_cache_lock:
+        previous, _speech_cache = _speech_cache, cache
+    if previous is not None and previous is not cache:
+        previous.close()
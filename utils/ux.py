@@ -14,6 +14,41 @@ def halo_context(*args, **kwargs):
         spinner.stop()
 
 
+def get_greeting(restaurant_name: str) -> str:
+    return f"Hi, welcome to {restaurant_name}. What can I get for you today? \n"
+
+
+def get_no_input_message() -> str:
+    return (
+        "Sorry, it seems I am unable to hear you or that you've stepped away."
+        "Thank you for stopping by!"
+    )
+
+
+def get_api_error_message() -> str:
+    return (
+        "Sorry, there seems to be an issue with our system or the internet connection. "
+        "Please try again later."
+    )
+
+
+def get_processing_error_message(waiting_phrase: str) -> str:
+    return "Sorry, something went wrong processing your request. " + waiting_phrase
+
+
+def get_stock_phrases(restaurant_name: str) -> List[str]:
+    waiting_phrases = get_generic_order_waiting_phrases()
+    return [
+        get_greeting(restaurant_name),
+        *waiting_phrases,
+        *get_generic_requests_to_repeat_order(),
+        *get_fast_path_confirmation_phrases(),
+        get_no_input_message(),
+        get_api_error_message(),
+        *[get_processing_error_message(phrase) for phrase in waiting_phrases],
+    ]
+
+
 def get_generic_order_waiting_phrases() -> List[str]:
     return [
         "One moment please...",
@@ -45,6 +80,16 @@ def get_generic_order_waiting_phrases() -> List[str]:
     ]
 
 
+def get_fast_path_confirmation_phrases() -> List[str]:
+    return [
+        "Got it! Is that everything, and does this look right?",
+        "Coming right up! Anything else, or is that it?",
+        "Great choice! Does that complete your order?",
+        "You got it. Is there anything else I can get for you?",
+        "Sounds delicious! Is that all for today?",
+    ]
+
+
 def get_generic_requests_to_repeat_order() -> List[str]:
     return [
         "Sorry, I didn't catch that. Could you say it again, please?",
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+from collections import deque
+from typing import Callable, List
+
+# Speech has to be this much louder than the calibrated ambient threshold,
+# which keeps the agents own voice leaking into the microphone from counting
+DEFAULT_ENERGY_RATIO = 2.0
+DEFAULT_MIN_SPEECH_SECONDS = 0.2
+# Audio kept from just before the onset so the first word is not clipped
+DEFAULT_PREROLL_SECONDS = 0.5
+DEFAULT_MAX_CAPTURE_SECONDS = 10
+
+
+class VoiceActivityDetector:
+    """Energy based speech onset detection over live microphone buffers.
+
+    Once speech starts it fires on_speech and keeps capturing, so whoever
+    listens next can replay the start of the utterance with take_frames.
+    """
+
+    def __init__(
+        self,
+        energy_ratio: float = DEFAULT_ENERGY_RATIO,
+        min_speech_seconds: float = DEFAULT_MIN_SPEECH_SECONDS,
+        preroll_seconds: float = DEFAULT_PREROLL_SECONDS,
+        max_capture_seconds: float = DEFAULT_MAX_CAPTURE_SECONDS,
+    ):
+        self.energy_ratio = energy_ratio
+        self.min_speech_seconds = min_speech_seconds
+        self.preroll_seconds = preroll_seconds
+        self.max_capture_seconds = max_capture_seconds
+        self.enabled = False
+        self.triggered = threading.Event()
+        self.on_speech: List[Callable[[], None]] = []
+
+        self._frames = deque()
+        self._frame_seconds = 0.0
+        self._speech_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def feed(
+        self, buffer: bytes, energy: float, threshold: float, seconds_per_buffer: float
+    ) -> bool:
+        """Returns whether the buffer belongs to speech, which callers should
+        leave out of ambient noise calibration."""
+        is_speech = energy > threshold * self.energy_ratio
+        with self._lock:
+            if self.triggered.is_set():
+                if self._frame_seconds < self.max_capture_seconds:
+                    self._add_frame(buffer, seconds_per_buffer)
+                return True
+
+            self._add_frame(buffer, seconds_per_buffer)
+            while self._frame_seconds > self.preroll_seconds:
+                self._frames.popleft()
+                self._frame_seconds -= seconds_per_buffer
+
+            self._speech_seconds = (
+                self._speech_seconds + seconds_per_buffer if is_speech else 0.0
+            )
+            if self._speech_seconds < self.min_speech_seconds:
+                return is_speech
+            self.triggered.set()
+
+        for callback in list(self.on_speech):
+            callback()
+        return True
+
+    def _add_frame(self, buffer: bytes, seconds_per_buffer: float):
+        self._frames.append(buffer)
+        self._frame_seconds += seconds_per_buffer
+
+    def take_frames(self) -> List[bytes]:
+        """Hands over the captured start of the utterance and re-arms."""
+        with self._lock:
+            frames = list(self._frames) if self.triggered.is_set() else []
+            self._frames.clear()
+            self._frame_seconds = 0.0
+            self._speech_seconds = 0.0
+            self.triggered.clear()
+        return frames
+
+    async def wait_async(self):
+        if self.triggered.is_set():
+            return
+
+        loop = asyncio.get_running_loop()
+        speech_started = asyncio.Event()
+
+        def on_speech():
+            loop.call_soon_threadsafe(speech_started.set)
+
+        self.on_speech.append(on_speech)
+        try:
+            # Speech may have started between the check and registering
+            if not self.triggered.is_set():
+                await speech_started.wait()
+        finally:
+            self.on_speech.remove(on_speech)
+
+
+class ReplayStream:
+    """Microphone stream that first returns frames that were already
+    captured, then continues reading live audio."""
+
+    def __init__(self, stream, frames: List[bytes]):
+        self.stream = stream
+        self.frames = deque(frames)
+
+    def read(self, size: int) -> bytes:
+        if self.frames:
+            return self.frames.popleft()
+        return self.stream.read(size)
+
+    def close(self):
+        self.stream.close()